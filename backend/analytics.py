@@ -0,0 +1,143 @@
+"""
+Analytics of measurable habits, computed with NumPy.
+
+The `(timestamp, value)` columns of a habit's logs are read straight into arrays (no ORM objects)
+and every series below is computed on whole arrays at once:
+
+- daily totals (days without logs count as 0) with 7 and 30 day rolling averages
+- percentiles of single logged values and of the totals of days with logs
+- a least-squares trend of the daily totals, in units per day
+- per weekday (Monday first) and per hour of day counts and sums
+"""
+
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import partitions
+
+ROLLING_WINDOWS = (7, 30)
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def load(
+    session: Session,
+    habit_id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    query = (
+        select(d.MeasureableLogEntry.timestamp, d.MeasureableLogEntry.value)
+        .where(d.MeasureableLogEntry.habit_id == habit_id)
+        .order_by(d.MeasureableLogEntry.timestamp)
+    )
+    if since is not None:
+        query = query.where(d.MeasureableLogEntry.timestamp >= since)
+    if until is not None:
+        query = query.where(d.MeasureableLogEntry.timestamp < until)
+    rows = session.execute(query).all()
+    archived = partitions.read(
+        session, since, until, lambda archive: archive.execute(query).all()
+    )
+    if archived:
+        rows = sorted([*archived, *rows], key=lambda row: row[0])
+    timestamps = np.array([row[0] for row in rows], dtype="datetime64[s]")
+    values = np.array([row[1] for row in rows], dtype=np.int64)
+    return timestamps, values
+
+
+def rolling_mean(series: np.ndarray, window: int) -> list[float | None]:
+    """
+    Mean of the `window` values ending at each position, None until the window is full.
+    """
+    if len(series) < window:
+        return [None] * len(series)
+    sums = np.cumsum(np.concatenate(([0], series)), dtype=np.float64)
+    means = (sums[window:] - sums[:-window]) / window
+    return [None] * (window - 1) + np.round(means, 3).tolist()
+
+
+def percentiles(values: np.ndarray) -> dict[str, float] | None:
+    if len(values) == 0:
+        return None
+    results = np.percentile(values, PERCENTILES)
+    return {f"p{p}": float(result) for p, result in zip(PERCENTILES, results)}
+
+
+def trend(totals: np.ndarray) -> dict[str, float] | None:
+    if len(totals) < 2:
+        return None
+    slope, intercept = np.polyfit(np.arange(len(totals)), totals, 1)
+    return {"slope_per_day": float(slope), "intercept": float(intercept)}
+
+
+def summarize(timestamps: np.ndarray, values: np.ndarray) -> dict:
+    if len(values) == 0:
+        start = None
+        totals = np.zeros(0, dtype=np.int64)
+        logged_totals = totals
+        weekdays = hours = np.zeros(0, dtype=np.int64)
+    else:
+        days = timestamps.astype("datetime64[D]")
+        start = days[0]
+        day_index = (days - start).astype(np.int64)
+        totals = np.bincount(day_index, weights=values).astype(np.int64)
+        logged_totals = totals[np.bincount(day_index) > 0]
+        # 1970-01-01, day 0, was a Thursday
+        weekdays = (days.astype(np.int64) + 3) % 7
+        hours = (timestamps - days).astype("timedelta64[h]").astype(np.int64)
+
+    # Days of each weekday covered by the daily series, for the per weekday averages
+    if len(totals):
+        series_weekdays = (np.arange(len(totals)) + weekdays[0]) % 7
+        weekday_days = np.bincount(series_weekdays, minlength=7)
+    else:
+        weekday_days = np.zeros(7, dtype=np.int64)
+    weekday_totals = np.bincount(weekdays, weights=values, minlength=7)
+    weekday_means = np.divide(
+        weekday_totals,
+        weekday_days,
+        out=np.zeros(7, dtype=np.float64),
+        where=weekday_days > 0,
+    )
+
+    return {
+        "total_logs": len(values),
+        "daily": {
+            "start": None if start is None else str(start),
+            "totals": totals.tolist(),
+            **{
+                f"rolling_{window}": rolling_mean(totals, window)
+                for window in ROLLING_WINDOWS
+            },
+        },
+        "percentiles": {
+            "value": percentiles(values),
+            "daily_total": percentiles(logged_totals),
+        },
+        "trend": trend(totals),
+        "weekday": {
+            "count": np.bincount(weekdays, minlength=7).tolist(),
+            "total": weekday_totals.astype(np.int64).tolist(),
+            "mean_daily_total": np.round(weekday_means, 3).tolist(),
+        },
+        "hour": {
+            "count": np.bincount(hours, minlength=24).tolist(),
+            "total": np.bincount(hours, weights=values, minlength=24)
+            .astype(np.int64)
+            .tolist(),
+        },
+    }
+
+
+def habit_analytics(
+    session: Session,
+    habit: d.MeasureableHabit,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> dict:
+    timestamps, values = load(session, habit.id, since, until)
+    return {"habit_id": habit.id, "unit": habit.unit} | summarize(timestamps, values)
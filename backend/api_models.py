@@ -1,12 +1,16 @@
 from pydantic import BaseModel, Field, create_model, ConfigDict
 from typing import Literal, Annotated, get_origin, Optional
-from db_models import HabitType, Timeframe
-from datetime import datetime
+from db_models import CLIENT_ID_LENGTH, HabitType, Timeframe
+from datetime import date, datetime
 
 
 class HabitLogBase(BaseModel):
     model_config = ConfigDict(extra="forbid")
     timestamp: datetime
+    # Logging again with the same client id returns the existing entry instead of a duplicate
+    client_id: str | None = Field(
+        default=None, min_length=1, max_length=CLIENT_ID_LENGTH
+    )
 
     @property
     def type(self) -> HabitType:
@@ -80,12 +84,16 @@ class ChoiceHabitOptions(HabitOptions):
 
 
 def make_patch_model(
-    model: type[BaseModel], *, discriminator: str | None = "type"
+    model: type[BaseModel],
+    *,
+    discriminator: str | None = "type",
+    exclude: tuple[str, ...] = (),
 ) -> type[BaseModel]:
     """
     Create a PATCH version of `model`:
     - all fields optional (default None)
     - drop the discriminator field
+    - `exclude`d fields can't be changed, they're inherited from `model` so only null is accepted
     """
     defs = {}
 
@@ -94,6 +102,9 @@ def make_patch_model(
 
         if name == discriminator:
             continue
+        if name in exclude:
+            defs[name] = (None, None)
+            continue
 
         # make optional unless already optional
         if get_origin(ann) is Optional or (get_origin(ann) is type(None)):
@@ -127,8 +138,74 @@ HabitPatch = (
 
 HabitLog = CompletionHabitLog | MeasureableHabitLog | ChoiceHabitLog
 
-CompletionHabitLogPatch = make_patch_model(CompletionHabitLog)
-MeasureableHabitLogPatch = make_patch_model(MeasureableHabitLog)
-ChoiceHabitLogPatch = make_patch_model(ChoiceHabitLog)
+
+# Rows of a bulk import carry their own habit id since they can span many habits
+class BulkCompletionHabitLog(CompletionHabitLog):
+    habit_id: int
+
+
+class BulkMeasureableHabitLog(MeasureableHabitLog):
+    habit_id: int
+
+
+class BulkChoiceHabitLog(ChoiceHabitLog):
+    habit_id: int
+
+
+BulkHabitLog = BulkCompletionHabitLog | BulkMeasureableHabitLog | BulkChoiceHabitLog
+
+# A log's client id is fixed once it's logged
+CompletionHabitLogPatch = make_patch_model(CompletionHabitLog, exclude=("client_id",))
+MeasureableHabitLogPatch = make_patch_model(MeasureableHabitLog, exclude=("client_id",))
+ChoiceHabitLogPatch = make_patch_model(ChoiceHabitLog, exclude=("client_id",))
 
 HabitLogPatch = CompletionHabitLogPatch | MeasureableHabitLogPatch | ChoiceHabitLogPatch
+
+
+class SyncPush(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    # Rows like those of a bulk import, validated one by one so a bad row doesn't reject the push
+    created: list[dict] = []
+    deleted: list[int] = []
+
+
+# Entries of a check-in are logged at the check-in's date, so they only name the habit
+class CheckinCompletionLog(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    habit_id: int
+    status: bool = True
+
+    @property
+    def type(self) -> HabitType:
+        return HabitType.COMPLETION
+
+
+class CheckinMeasureableLog(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    habit_id: int
+    amount: int
+
+    @property
+    def type(self) -> HabitType:
+        return HabitType.MEASURABLE
+
+
+class CheckinChoiceLog(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    habit_id: int
+    option_id: int
+
+    @property
+    def type(self) -> HabitType:
+        return HabitType.CHOICE
+
+
+CheckinLog = CheckinCompletionLog | CheckinMeasureableLog | CheckinChoiceLog
+
+
+class Checkin(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    date: date
+    logs: list[CheckinLog] = Field(min_length=1)
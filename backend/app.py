@@ -1,259 +1,905 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from db_models import get_engine
-from sqlalchemy.orm import sessionmaker, Session
+from database import DatabaseSettings, env_int
+from db_models import get_async_engine, get_engine
+from sqlalchemy import select, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import (
+    sessionmaker,
+    Session,
+    joinedload,
+    with_polymorphic,
+)
+from collections.abc import Callable
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import FunctionType
+from typing import Annotated
+import atexit
+import base64
+import inspect
+import os
 import api_models as a  # Shortcut for "API models", reduces confusion compared to importing without alias
 import db_models as d  # Shortcut for "database models"
+import analytics
+import auth
+import bulk
+import cache
+import changes
+import checkin
+import events
+import export
+import heatmap
+import idempotency
+import metrics
+import option_stats
+import ownership
+import partitions
+import rollups
+import serializers
+import stats
+import structured_logging
+import sync
+import tenants
+import versions
+from changes import ChangeAction, ChangeKind
 
 app = FastAPI()
 
+DEFAULT_LOG_PAGE_SIZE = 500
+MAX_LOG_PAGE_SIZE = 5000
+
 # Necessary to prevent initializing the production database when running tests, since the test suite monkeypatches this variable
 db: sessionmaker[Session] = None  # ty: ignore[invalid-assignment]
-
-app.add_middleware(CORSMiddleware, allow_origins=["http://localhost:5173"])  # ty: ignore[invalid-argument-type] #? Why is this an error
+# When set, endpoints run on the async engine (aiosqlite) instead of on `db` in the threadpool
+async_db: async_sessionmaker[AsyncSession] | None = None
+# When set, every user's habits and logs are in a database of their own (HABITS_TENANT_DATABASE_URL)
+tenant_dbs: tenants.EngineCache | None = None
+# Requests without a token act as the default user unless this is set (HABITS_AUTH_REQUIRED=1)
+auth_required = False
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:5173"],
+    expose_headers=["ETag", "X-Next-Cursor", "Server-Timing", "X-Request-ID"],
+)
+# Does nothing unless metrics are enabled (HABITS_METRICS=1)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(structured_logging.RequestIdMiddleware)
+
+
+def sessions(user_id: int | None = None) -> Callable[[], Session]:
+    """
+    Session factory of the database holding `user_id`'s rows, its sessions scoped to the user.
+    Without a user, sessions of the main database that see everything (users and tokens live there).
+    """
+    if user_id is None:
+        return db
+    user_db = tenant_dbs.get(user_id) if tenant_dbs is not None else db
+    return lambda: ownership.scope(user_db(), user_id)
+
+
+async def run_db[T](work: Callable[[Session], T], user_id: int | None = None) -> T:
+    """
+    Run `work` with a session from whichever database layer is configured, scoped to `user_id`.
+    """
+    # Tenant databases only get sync engines
+    if async_db is not None and tenant_dbs is None:
+        # run_sync hands `work` the sync facade of the async session, its queries await aiosqlite
+        async with async_db() as session:
+            if user_id is not None:
+                ownership.scope(session.sync_session, user_id)
+            return await session.run_sync(work)
+
+    def run() -> T:
+        with sessions(user_id)() as session:
+            return work(session)
+
+    return await run_in_threadpool(run)
+
+
+async def current_user_id(
+    authorization: Annotated[str | None, Header()] = None,
+) -> int:
+    """
+    Id of the user whose bearer token the request carries.
+    """
+    if authorization is None:
+        if auth_required:
+            raise HTTPException(
+                status_code=401,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return d.DEFAULT_USER_ID
+    token = auth.bearer_token(authorization)
+    user_id = None
+    if token is not None:
+        user_id = await run_db(lambda session: auth.resolve(session, token))
+    if not user_id:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
+
+
+CurrentUserId = Annotated[int, Depends(current_user_id)]
+
+
+def with_session(handler: FunctionType) -> Callable:
+    """
+    Turn `handler(session, ...)` into an async endpoint that gets its session from `run_db`,
+    scoped to the user making the request. FastAPI sees the handler's signature without the
+    session parameter.
+    """
+    signature = inspect.signature(handler)
+
+    async def endpoint(*args, current_user_id: int, **kwargs):
+        return await run_db(
+            lambda session: handler(session, *args, **kwargs), current_user_id
+        )
+
+    # ! Not functools.wraps, FastAPI would unwrap it and treat the endpoint as sync
+    endpoint.__name__ = handler.__name__
+    endpoint.__doc__ = handler.__doc__
+    endpoint.__signature__ = signature.replace(  # ty: ignore[unresolved-attribute]
+        parameters=[
+            *list(signature.parameters.values())[1:],
+            inspect.Parameter(
+                "current_user_id",
+                inspect.Parameter.KEYWORD_ONLY,
+                annotation=CurrentUserId,
+            ),
+        ]
+    )
+    return endpoint
 
 
 @app.post("/habits/new", status_code=201)
-def create_habit(options: a.HabitInput):
+@with_session
+def create_habit(session: Session, options: a.HabitInput):
     id = None
     if isinstance(options, a.CompletionHabitOptions):
-        with db() as session:
-            habit = d.CompletionHabit(**options.model_dump(exclude={"type"}))
-            session.add(habit)
-            session.commit()
-            id = habit.id
+        habit = d.CompletionHabit(**options.model_dump(exclude={"type"}))
+        session.add(habit)
+        session.flush()
+        id = habit.id
     elif isinstance(options, a.MeasureableHabitOptions):
-        with db() as session:
-            habit = d.MeasureableHabit(**options.model_dump(exclude={"type"}))
-            session.add(habit)
-            session.commit()
-            id = habit.id
+        habit = d.MeasureableHabit(**options.model_dump(exclude={"type"}))
+        session.add(habit)
+        session.flush()
+        id = habit.id
     elif isinstance(options, a.ChoiceHabitOptions):
-        with db() as session:
-            habit = d.ChoiceHabit(**options.model_dump(exclude={"type", "options"}))
-            session.add(habit)
-            session.commit()
-
-            for option in options.options:
-                choice_option = d.ChoiceOption(**option.model_dump(), habit_id=habit.id)
-                session.add(choice_option)
-            session.commit()
-            id = habit.id
+        habit = d.ChoiceHabit(**options.model_dump(exclude={"type", "options"}))
+        session.add(habit)
+        session.flush()
+
+        for option in options.options:
+            choice_option = d.ChoiceOption(**option.model_dump(), habit_id=habit.id)
+            session.add(choice_option)
+        id = habit.id
     # ? Will FastAPI guarantee that this case is impossible?
+    changes.record(session, ChangeKind.HABIT, ChangeAction.CREATED, id)
+    session.commit()
+    cache.habit_changed(session)
 
     return {"message": "Habit created", "id": id}
 
 
 @app.patch("/habits/{id}")
-def update_habit(id: int, habit: a.HabitPatch):
-    with db() as session:
-        existing_habit = session.get(d.Habit, id)
-        if existing_habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if hasattr(habit, "type") and existing_habit.habit_type != habit.type:
-            raise HTTPException(
-                status_code=400, detail="Changing habit type is not supported"
-            )
-        if (
-            a.HabitOptions.inspect_type(habit) is not None
-            and a.HabitOptions.inspect_type(habit) != existing_habit.habit_type
-        ):
-            raise HTTPException(
-                status_code=400, detail="Invalid update data for this habit type"
-            )
-        if hasattr(habit, "options"):
-            raise HTTPException(
-                status_code=400,
-                detail="Updating options through this endpoint is not supported",
-            )
-
-        update_data = habit.model_dump(exclude_unset=True, exclude={"type"})
-        for key, value in update_data.items():
-            setattr(existing_habit, key, value)
-        session.commit()
+@with_session
+def update_habit(session: Session, id: int, habit: a.HabitPatch):
+    existing_habit = session.get(d.Habit, id)
+    if existing_habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if hasattr(habit, "type") and existing_habit.habit_type != habit.type:
+        raise HTTPException(
+            status_code=400, detail="Changing habit type is not supported"
+        )
+    if (
+        a.HabitOptions.inspect_type(habit) is not None
+        and a.HabitOptions.inspect_type(habit) != existing_habit.habit_type
+    ):
+        raise HTTPException(
+            status_code=400, detail="Invalid update data for this habit type"
+        )
+    if hasattr(habit, "options"):
+        raise HTTPException(
+            status_code=400,
+            detail="Updating options through this endpoint is not supported",
+        )
+
+    update_data = habit.model_dump(exclude_unset=True, exclude={"type"})
+    target_before = stats.habit_target(existing_habit)
+    for key, value in update_data.items():
+        setattr(existing_habit, key, value)
+    if stats.habit_target(existing_habit) != target_before:
+        session.flush()
+        stats.target_changed(session, existing_habit)
+    changes.record(session, ChangeKind.HABIT, ChangeAction.UPDATED, id)
+    session.commit()
+    cache.habit_changed(session, id)
 
 
 @app.delete("/habits/{id}")
-def delete_habit(id: int):
-    with db() as session:
-        habit = session.get(d.Habit, id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        session.delete(habit)
-        session.commit()
+@with_session
+def delete_habit(session: Session, id: int):
+    habit = session.get(d.Habit, id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    stats.forget(session, id)
+    session.delete(habit)
+    changes.record(session, ChangeKind.HABIT, ChangeAction.DELETED, id)
+    session.commit()
+    # ? SQLite can give the id to the next habit, which mustn't inherit its archived logs
+    partitions.delete_habit(session, id)
+    cache.habit_changed(session, id)
 
 
 @app.post("/habits/{id}/options", status_code=201)
-def add_option(id: int, option: a.ChoiceHabitOption):
-    with db() as session:
-        habit = session.get(d.Habit, id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if habit.habit_type != d.HabitType.CHOICE:
-            raise HTTPException(status_code=400, detail="Habit is not a choice habit")
-
-        choice_option = d.ChoiceOption(**option.model_dump(), habit_id=id)
-        session.add(choice_option)
-        session.commit()
+@with_session
+def add_option(session: Session, id: int, option: a.ChoiceHabitOption):
+    habit = session.get(d.Habit, id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if habit.habit_type != d.HabitType.CHOICE:
+        raise HTTPException(status_code=400, detail="Habit is not a choice habit")
+
+    choice_option = d.ChoiceOption(**option.model_dump(), habit_id=id)
+    session.add(choice_option)
+    session.flush()
+    changes.record(
+        session, ChangeKind.OPTION, ChangeAction.CREATED, id, choice_option.id
+    )
+    session.commit()
+    cache.habit_changed(session, id)
 
 
 @app.patch("/habits/{habit_id}/options/{option_id}")
-def update_option(habit_id: int, option_id: int, option: a.ChoiceHabitOptionPatch):
-    with db() as session:
-        habit = session.get(d.Habit, habit_id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if habit.habit_type != d.HabitType.CHOICE:
-            raise HTTPException(status_code=400, detail="Habit is not a choice habit")
-
-        existing_option = session.get(d.ChoiceOption, option_id)
-        if existing_option is None or existing_option.habit_id != habit_id:
-            raise HTTPException(
-                status_code=404, detail="Option not found for this habit"
-            )
-
-        update_data = option.model_dump(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(existing_option, key, value)
-        session.commit()
+@with_session
+def update_option(
+    session: Session, habit_id: int, option_id: int, option: a.ChoiceHabitOptionPatch
+):
+    habit = session.get(d.Habit, habit_id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if habit.habit_type != d.HabitType.CHOICE:
+        raise HTTPException(status_code=400, detail="Habit is not a choice habit")
+
+    existing_option = session.get(d.ChoiceOption, option_id)
+    if existing_option is None or existing_option.habit_id != habit_id:
+        raise HTTPException(status_code=404, detail="Option not found for this habit")
+
+    update_data = option.model_dump(exclude_unset=True)
+    for key, value in update_data.items():
+        setattr(existing_option, key, value)
+    changes.record(
+        session, ChangeKind.OPTION, ChangeAction.UPDATED, habit_id, option_id
+    )
+    session.commit()
+    cache.habit_changed(session, habit_id)
 
 
 @app.delete("/habits/{habit_id}/options/{option_id}")
-def delete_option(habit_id: int, option_id: int):
-    with db() as session:
-        habit = session.get(d.Habit, habit_id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if habit.habit_type != d.HabitType.CHOICE:
-            raise HTTPException(status_code=400, detail="Habit is not a choice habit")
-
-        existing_option = session.get(d.ChoiceOption, option_id)
-        if existing_option is None or existing_option.habit_id != habit_id:
-            raise HTTPException(
-                status_code=404, detail="Option not found for this habit"
-            )
-
-        session.delete(existing_option)
-        session.commit()
+@with_session
+def delete_option(session: Session, habit_id: int, option_id: int):
+    habit = session.get(d.Habit, habit_id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if habit.habit_type != d.HabitType.CHOICE:
+        raise HTTPException(status_code=400, detail="Habit is not a choice habit")
+
+    existing_option = session.get(d.ChoiceOption, option_id)
+    if existing_option is None or existing_option.habit_id != habit_id:
+        raise HTTPException(status_code=404, detail="Option not found for this habit")
+    # Refused by the foreign key anyway where it's enforced, archives have no foreign keys though
+    in_use = select(d.ChoiceLogEntry.id).where(d.ChoiceLogEntry.option_id == option_id)
+    if session.scalar(in_use.limit(1)) is not None or partitions.read(
+        session, None, None, lambda archive: archive.scalars(in_use.limit(1))
+    ):
+        raise HTTPException(status_code=409, detail="Option is used by log entries")
+
+    session.delete(existing_option)
+    changes.record(
+        session, ChangeKind.OPTION, ChangeAction.DELETED, habit_id, option_id
+    )
+    session.commit()
+    cache.habit_changed(session, habit_id)
+
+
+# Registered before /habits/{id}, which would otherwise reject "heatmap" as an id
+@app.get("/habits/heatmap")
+@with_session
+def get_heatmap(
+    session: Session,
+    start: Annotated[date | None, Query(alias="from")] = None,
+    end: Annotated[date | None, Query(alias="to")] = None,
+):
+    """
+    Per-day grid of every habit from `from` to `to` (both included, defaults to the last year),
+    one packed base64 string per habit. See heatmap.py for the encodings.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=364)
+    if start > end:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if (end - start).days + 1 > heatmap.MAX_DAYS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {heatmap.MAX_DAYS} days per request"
+        )
+    return JSONResponse(heatmap.build(session, start, end))
 
 
 @app.get("/habits/{id}")
-def get_habit(id: int):
-    with db() as session:
-        habit = session.get(d.Habit, id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        return habit.to_dict()
+@with_session
+def get_habit(session: Session, request: Request, id: int):
+    cached = cache.get_habit(session, id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    etag = versions.etag(session, "habit", id)
+    if versions.matches(request, etag):
+        return versions.not_modified(etag)
+    return JSONResponse(cached.data, headers={"ETag": etag})
 
 
 @app.get("/habits/{id}/options")
-def get_habit_options(id: int):
-    with db() as session:
-        habit = session.get(d.Habit, id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if not isinstance(habit, d.ChoiceHabit):
-            raise HTTPException(status_code=400, detail="Habit is not a choice habit")
-        return [option.to_dict() for option in habit.options]
+@with_session
+def get_habit_options(session: Session, request: Request, id: int):
+    cached = cache.get_habit(session, id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    etag = versions.etag(session, "options", id)
+    if versions.matches(request, etag):
+        return versions.not_modified(etag)
+    if cached.data["habit_type"] != d.HabitType.CHOICE:
+        raise HTTPException(status_code=400, detail="Habit is not a choice habit")
+    return JSONResponse(cached.data["options"], headers={"ETag": etag})
+
+
+@app.get("/habits/{id}/options/stats")
+@with_session
+def get_option_stats(
+    session: Session,
+    id: int,
+    timeframe: d.Timeframe = d.Timeframe.WEEK,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Per option counts in total and per period of `timeframe`, and the option-to-option transition
+    matrix of consecutive logs, for the logs of a choice habit in [since, until).
+    """
+    cached = cache.get_habit(session, id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if not isinstance(cached.habit, d.ChoiceHabit):
+        raise HTTPException(status_code=400, detail="Habit is not a choice habit")
+    return JSONResponse(
+        option_stats.summary(session, cached.habit, timeframe, since, until)
+    )
+
+
+@app.get("/habits/{id}/stats")
+@with_session
+def get_habit_stats(session: Session, id: int, at: datetime | None = None):
+    """
+    Current and best streak of periods meeting the habit's target, and progress in the period containing `at` (defaults to now).
+    """
+    habit = session.get(d.Habit, id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    summary = stats.summary(session, habit, at or datetime.now())
+    session.commit()  # Persists the stats if this was the first time they were computed
+    return summary
+
+
+@app.get("/habits/{id}/analytics")
+@with_session
+def get_habit_analytics(
+    session: Session,
+    id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Daily totals with rolling averages, percentiles, trend and weekday/hour distributions of a
+    measurable habit's values, for the logs in [since, until).
+    """
+    habit = session.get(d.Habit, id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if not isinstance(habit, d.MeasureableHabit):
+        raise HTTPException(status_code=400, detail="Habit is not a measurable habit")
+    return JSONResponse(analytics.habit_analytics(session, habit, since, until))
+
+
+@app.get("/habits/{id}/rollups")
+@with_session
+def get_habit_rollups(
+    session: Session,
+    id: int,
+    timeframe: d.Timeframe = d.Timeframe.DAY,
+    since: date | None = None,
+    until: date | None = None,
+):
+    """
+    Count, sum, min and max of the logged amounts per period, for the periods overlapping [since, until).
+    """
+    habit = session.get(d.Habit, id)
+    if habit is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    # Makes sure the rollups of older databases are built
+    stats.get_stats(session, habit)
+    session.commit()
+    return JSONResponse(
+        [
+            {
+                "period_start": serializers.format_date(rollup.period_start),
+                "count": rollup.count,
+                "total": rollup.total,
+                "min_value": rollup.min_value,
+                "max_value": rollup.max_value,
+            }
+            for rollup in rollups.get_rollups(session, id, timeframe, since, until)
+        ]
+    )
+
+
+def encode_log_cursor(timestamp: datetime, id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_log_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(id)
+    except ValueError:  # Also covers binascii.Error and UnicodeDecodeError
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @app.get("/log/{habit_id}")
-def get_habit_logs(habit_id: int):
-    with db() as session:
-        habit = session.get(d.Habit, habit_id)
-        if habit is None:
+@with_session
+def get_habit_logs(
+    session: Session,
+    request: Request,
+    habit_id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = DEFAULT_LOG_PAGE_SIZE,
+    cursor: str | None = None,
+):
+    """
+    Logs for a habit ordered by (timestamp, id), `since` inclusive and `until` exclusive.
+    When more rows are available, the `X-Next-Cursor` header holds the cursor for the next page.
+    """
+    if not 1 <= limit <= MAX_LOG_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {MAX_LOG_PAGE_SIZE}"
+        )
+    etag = versions.etag(session, "logs", habit_id)
+    if versions.matches(request, etag):
+        if cache.get_habit(session, habit_id) is None:
             raise HTTPException(status_code=404, detail="Habit not found")
-        return [log.to_dict() for log in habit.logs]
+        return versions.not_modified(etag)
+
+    # Load every subclass in the same statement instead of per row
+    logs = with_polymorphic(d.LogEntry, "*")
+    query = (
+        select(logs)
+        .where(logs.habit_id == habit_id)
+        .order_by(logs.timestamp, logs.id)
+        .limit(limit + 1)  # One extra row tells us whether there is a next page
+    )
+    if since is not None:
+        query = query.where(logs.timestamp >= since)
+    if until is not None:
+        query = query.where(logs.timestamp < until)
+    if cursor is not None:
+        after_timestamp, after_id = decode_log_cursor(cursor)
+        query = query.where(
+            or_(
+                logs.timestamp > after_timestamp,
+                and_(logs.timestamp == after_timestamp, logs.id > after_id),
+            )
+        )
+        # Archives before the cursor can be skipped. Stored timestamps are naive, so is the cursor.
+        since = (
+            after_timestamp
+            if since is None
+            else max(since.replace(tzinfo=None), after_timestamp)
+        )
+
+    # With the option of choice logs, archives have no options table
+    entries = (
+        session.scalars(query.options(joinedload(logs.ChoiceLogEntry.option)))
+        .unique()
+        .all()
+    )
+    archived = partitions.read(
+        session, since, until, lambda archive: archive.scalars(query).all()
+    )
+    if archived:
+        partitions.attach_options(session, archived)
+        # ? An interrupted compaction can leave a row in both places, the hot one wins. Ids are
+        # ? never reused (habit_logs is AUTOINCREMENT), the timestamp guards against archives
+        # ? made before that.
+        hot = {(entry.id, entry.timestamp) for entry in entries}
+        entries = sorted(
+            [
+                *entries,
+                *(
+                    entry
+                    for entry in archived
+                    if (entry.id, entry.timestamp) not in hot
+                ),
+            ],
+            key=lambda entry: (entry.timestamp, entry.id),
+        )[: limit + 1]
+    # ! Only hit the habits table when there's nothing to return, so a normal page stays a single query
+    if not entries and session.get(d.Habit, habit_id) is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+
+    headers = {"ETag": etag}
+    if len(entries) > limit:
+        entries = entries[:limit]
+        last = entries[-1]
+        headers["X-Next-Cursor"] = encode_log_cursor(last.timestamp, last.id)
+    return JSONResponse([log.to_dict() for log in entries], headers=headers)
+
+
+@app.post("/log/bulk", status_code=201)
+async def bulk_log(request: Request, user_id: CurrentUserId):
+    """
+    Import many log entries across habits, as a JSON array or as NDJSON (`Content-Type: application/x-ndjson`).
+    Every row needs a `habit_id` next to the usual log fields. Valid rows are inserted in one
+    transaction, invalid ones are skipped and reported by their index.
+    """
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        raw_rows = []
+        async for line in bulk.ndjson_lines(request.stream()):
+            raw_rows.append(line)
+            # No need to read the rest of a body that's refused below
+            if len(raw_rows) > bulk.MAX_ROWS:
+                break
+    else:
+        try:
+            raw_rows = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        if not isinstance(raw_rows, list):
+            raise HTTPException(
+                status_code=400, detail="Expected a list of log entries"
+            )
+    if len(raw_rows) > bulk.MAX_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {bulk.MAX_ROWS} rows per request"
+        )
+
+    def import_rows(session: Session):
+        inserted, errors = bulk.import_rows(session, raw_rows)
+        session.commit()
+        return inserted, errors
+
+    inserted, errors = await run_db(import_rows, user_id)
+    return {"message": "Logs imported", "inserted": inserted, "errors": errors}
+
+
+def check_option(session: Session, cached: cache.CachedHabit, option_id: int):
+    # Validation to ensure option belongs to the habit, the database only tells the errors apart.
+    # Options aren't scoped to a user, so this is also what keeps other users' options out.
+    if option_id not in cached.option_ids:
+        if session.get(d.ChoiceOption, option_id) is None:
+            raise HTTPException(status_code=404, detail="Option not found")
+        raise HTTPException(
+            status_code=400,
+            detail="Option does not belong to the specified habit",
+        )
 
 
 @app.post("/log/{habit_id}", status_code=201)
-def log_habit(habit_id: int, log: a.HabitLog):
-    with db() as session:
-        habit = session.get(d.Habit, habit_id)
-        if habit is None:
-            raise HTTPException(status_code=404, detail="Habit not found")
-        if habit.habit_type != log.type:
-            raise HTTPException(status_code=400, detail="Habit type mismatch")
-
-        if isinstance(log, a.CompletionHabitLog):
-            entry = d.CompletionLogEntry(
-                habit_id=habit_id,
-                timestamp=log.timestamp,
-                status=log.status,
-                habit_type=d.HabitType.COMPLETION,
+@with_session
+def log_habit(
+    session: Session,
+    response: Response,
+    habit_id: int,
+    log: a.HabitLog,
+    idempotency_key: Annotated[
+        str | None, Header(min_length=1, max_length=d.CLIENT_ID_LENGTH)
+    ] = None,
+    upsert: bool = False,
+):
+    """
+    Log a habit. Retrying with the same `client_id` (or `Idempotency-Key` header) answers with the
+    entry logged the first time (200) instead of logging it again. With `upsert`, a completion
+    habit's log of that day is updated if there is one.
+    """
+    cached = cache.get_habit(session, habit_id)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Habit not found")
+    if cached.habit.habit_type != log.type:
+        raise HTTPException(status_code=400, detail="Habit type mismatch")
+    if upsert and not isinstance(log, a.CompletionHabitLog):
+        raise HTTPException(
+            status_code=400, detail="Upsert is only supported for completion habits"
+        )
+    if log.client_id and idempotency_key and log.client_id != idempotency_key:
+        raise HTTPException(
+            status_code=400, detail="client_id and Idempotency-Key don't match"
+        )
+
+    client_id = log.client_id or idempotency_key
+    if client_id is not None:
+        logged_id = idempotency.find_logged(session, habit_id, client_id)
+        if logged_id is not None:
+            response.status_code = 200
+            return {"message": "Already logged", "id": logged_id}
+
+    if upsert and isinstance(log, a.CompletionHabitLog):
+        # Concurrent upserts of the day take turns, or they could both find nothing and both insert
+        stats.lock_habits(session, [habit_id])
+        entry = idempotency.completion_on_day(session, habit_id, log.timestamp.date())
+        if entry is not None:
+            before = rollups.log_point(entry)
+            entry.timestamp, entry.status = log.timestamp, log.status
+            session.flush()
+            habit = cache.attach(session, cached)
+            stats.apply_log_change(
+                session, habit, removed=before, added=rollups.log_point(entry)
             )
-        elif isinstance(log, a.MeasureableHabitLog):
-            entry = d.MeasureableLogEntry(
-                habit_id=habit_id,
-                timestamp=log.timestamp,
-                value=log.amount,
-                habit_type=d.HabitType.MEASURABLE,
+            changes.record(
+                session, ChangeKind.LOG, ChangeAction.UPDATED, habit_id, entry.id
             )
-        elif isinstance(log, a.ChoiceHabitLog):
-            # Validation to ensure option belongs to the habit
-            option = session.get(d.ChoiceOption, log.option_id)
-            if option is None:
-                raise HTTPException(status_code=404, detail="Option not found")
-            if option.habit_id != habit_id:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Option does not belong to the specified habit",
-                )
-            entry = d.ChoiceLogEntry(
-                habit_id=habit_id,
-                timestamp=log.timestamp,
-                option_id=log.option_id,
-                habit_type=d.HabitType.CHOICE,
-            )
-        session.add(entry)
-        session.commit()
-        return {"message": "Habit logged", "id": entry.id}
+            session.commit()
+            response.status_code = 200
+            return {"message": "Habit log updated", "id": entry.id}
+
+    if isinstance(log, a.CompletionHabitLog):
+        entry = d.CompletionLogEntry(
+            habit_id=habit_id,
+            timestamp=log.timestamp,
+            client_id=client_id,
+            status=log.status,
+            habit_type=d.HabitType.COMPLETION,
+        )
+    elif isinstance(log, a.MeasureableHabitLog):
+        entry = d.MeasureableLogEntry(
+            habit_id=habit_id,
+            timestamp=log.timestamp,
+            client_id=client_id,
+            value=log.amount,
+            habit_type=d.HabitType.MEASURABLE,
+        )
+    elif isinstance(log, a.ChoiceHabitLog):
+        check_option(session, cached, log.option_id)
+        entry = d.ChoiceLogEntry(
+            habit_id=habit_id,
+            timestamp=log.timestamp,
+            client_id=client_id,
+            option_id=log.option_id,
+            habit_type=d.HabitType.CHOICE,
+        )
+    session.add(entry)
+    try:
+        session.flush()
+    except IntegrityError:
+        # A concurrent retry with the same client id got in first
+        session.rollback()
+        logged_id = client_id and idempotency.find_logged(session, habit_id, client_id)
+        if not logged_id:
+            raise
+        response.status_code = 200
+        return {"message": "Already logged", "id": logged_id}
+    habit = cache.attach(session, cached)
+    stats.apply_log_change(session, habit, added=rollups.log_point(entry))
+    changes.record(session, ChangeKind.LOG, ChangeAction.CREATED, habit_id, entry.id)
+    session.commit()
+    return {"message": "Habit logged", "id": entry.id}
+
+
+@app.post("/checkin", status_code=201)
+@with_session
+def check_in(session: Session, body: a.Checkin):
+    """
+    Log several habits for one day in a single transaction, e.g. when ticking off today's habits.
+    Entries are logged at the current time of day on `date`. If any entry is invalid nothing is
+    logged and the errors are reported by their index. The response includes the refreshed
+    target progress of every habit that was logged.
+    """
+    at = datetime.combine(body.date, datetime.now().time())
+    result = checkin.check_in(session, body, at)
+    if isinstance(result, list):
+        raise HTTPException(status_code=400, detail=result)
+    session.commit()
+    return {"message": "Checked in", "date": body.date.isoformat()} | result
 
 
 @app.get("/log/{id}")
-def get_log_entry(id: int):
-    with db() as session:
-        entry = session.get(d.LogEntry, id)
-        if entry is None:
-            raise HTTPException(status_code=404, detail="Log entry not found")
-        return entry.to_dict()
+@with_session
+def get_log_entry(session: Session, id: int):
+    entry = session.get(d.LogEntry, id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Log entry not found")
+    return JSONResponse(entry.to_dict())
 
 
 @app.patch("/log/{id}")
-def update_log_entry(id: int, log: a.HabitLogPatch):
-    with db() as session:
-        log_entry = session.get(d.LogEntry, id)
-        if log_entry is None:
-            raise HTTPException(status_code=404, detail="Log entry not found")
-        if log_entry.habit_type != log.type:
-            raise HTTPException(status_code=400, detail="Habit type mismatch")
-
-        update_data = log.model_dump(exclude_unset=True, exclude={"type"})
-        for key, value in update_data.items():
-            setattr(log_entry, key, value)
-        session.commit()
+@with_session
+def update_log_entry(session: Session, id: int, log: a.HabitLogPatch):
+    log_entry = session.get(d.LogEntry, id)
+    if log_entry is None:
+        raise HTTPException(status_code=404, detail="Log entry not found")
+    if log_entry.habit_type != log.type:
+        raise HTTPException(status_code=400, detail="Habit type mismatch")
+
+    update_data = log.model_dump(exclude_unset=True, exclude={"type", "client_id"})
+    if "option_id" in update_data:
+        cached = cache.get_habit(session, log_entry.habit_id)
+        if cached is None:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        check_option(session, cached, update_data["option_id"])
+    before = rollups.log_point(log_entry)
+    for key, value in update_data.items():
+        setattr(log_entry, key, value)
+    session.flush()
+    stats.apply_log_change(
+        session, log_entry.habit, removed=before, added=rollups.log_point(log_entry)
+    )
+    changes.record(
+        session, ChangeKind.LOG, ChangeAction.UPDATED, log_entry.habit_id, id
+    )
+    session.commit()
 
 
 @app.delete("/log/{id}")
-def delete_log_entry(id: int):
-    with db() as session:
-        log_entry = session.get(d.LogEntry, id)
-        if log_entry is None:
-            raise HTTPException(status_code=404, detail="Log entry not found")
-        session.delete(log_entry)
-        session.commit()
+@with_session
+def delete_log_entry(session: Session, id: int):
+    log_entry = session.get(d.LogEntry, id)
+    if log_entry is None:
+        raise HTTPException(status_code=404, detail="Log entry not found")
+    habit, removed = log_entry.habit, rollups.log_point(log_entry)
+    session.delete(log_entry)
+    session.flush()
+    stats.apply_log_change(session, habit, removed=removed)
+    changes.record(session, ChangeKind.LOG, ChangeAction.DELETED, habit.id, id)
+    session.commit()
 
 
 @app.get("/habits")
-def list_habits():
-    with db() as session:
-        habits = session.query(d.Habit).all()
-        return [habit.to_dict() for habit in habits]
+@with_session
+def list_habits(session: Session, request: Request):
+    etag = versions.etag(session, "habits")
+    if versions.matches(request, etag):
+        return versions.not_modified(etag)
+    return JSONResponse(cache.list_habits(session), headers={"ETag": etag})
+
+
+@app.get("/sync")
+@with_session
+def get_changes(session: Session, since: int = 0):
+    """
+    Habits and log entries changed after `since` (a `seq` from an earlier sync), with the ids of
+    deleted ones. Deleting a habit deletes its logs and options too. `since=0` returns everything.
+    """
+    return JSONResponse(sync.changes_since(session, since))
+
+
+@app.post("/sync")
+@with_session
+def push_changes(session: Session, push: a.SyncPush):
+    """
+    Apply writes queued by an offline client: log entries to create (rows of a bulk import) and ids
+    of log entries to delete. Edits are sent as a deletion plus a creation.
+    """
+    if len(push.created) > bulk.MAX_ROWS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {bulk.MAX_ROWS} rows per request"
+        )
+    result = sync.push(session, push.created, push.deleted)
+    session.commit()
+    return {"message": "Changes applied", **result, "seq": versions.current(session)}
+
+
+@app.get("/events")
+async def stream_events(
+    request: Request, user_id: CurrentUserId, habit_id: int | None = None
+):
+    """
+    Server-Sent Events for every committed habit, option and log change (optionally of one habit).
+    A `reset` event means events were missed, the client should re-fetch and reconnect.
+    """
+    subscriber = events.broker.subscribe(habit_id, user_id)
+    return StreamingResponse(
+        events.stream(subscriber, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/me")
+async def get_me(user_id: CurrentUserId):
+    user = await run_db(lambda session: session.get(d.User, user_id))
+    if user is None:  # Its token was cached, but the user is gone
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return {"id": user.id, "name": user.name}
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Hit and miss counters of the habit definition cache.
+    """
+    return cache.habits.stats()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Request, SQL and cache metrics in the Prometheus text format.
+    """
+    if not metrics.registry.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(
+        metrics.registry.render(cache.habits.stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/export")
+def export_all(
+    user_id: CurrentUserId, format: export.ExportFormat = export.ExportFormat.NDJSON
+):
+    """
+    Stream every habit, choice option and log entry, e.g. for backups.
+    """
+    media_type = (
+        "text/csv" if format == export.ExportFormat.CSV else "application/x-ndjson"
+    )
+    return StreamingResponse(
+        export.stream(sessions(user_id), format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{export.filename(format, datetime.now())}"'
+        },
+    )
 
 
 if __name__ == "__main__":
     engine = get_engine()
     db = sessionmaker(bind=engine)
+    if os.environ.get("HABITS_ASYNC_DB") == "1":
+        async_db = async_sessionmaker(get_async_engine())
+        # The engine requests run on, for the cursor event listeners
+        request_engine = async_db.kw["bind"].sync_engine
+    else:
+        request_engine = engine
+    auth_required = os.environ.get("HABITS_AUTH_REQUIRED") == "1"
+    log_settings = structured_logging.LogSettings.from_env()
+    log_listener = structured_logging.configure(log_settings)
+    atexit.register(log_listener.stop)
+    profile_dir = os.environ.get("HABITS_PROFILE_DIR")
+    metrics_enabled = os.environ.get("HABITS_METRICS") == "1"
+
+    def instrument(engine):
+        structured_logging.install_sql_logging(engine, log_settings)
+        if metrics_enabled:
+            metrics.enable(engine, Path(profile_dir) if profile_dir else None)
+
+    instrument(request_engine)
+    tenant_url = os.environ.get("HABITS_TENANT_DATABASE_URL")
+    if tenant_url:
+        tenant_dbs = tenants.EngineCache(
+            tenant_url,
+            DatabaseSettings.from_env(),
+            env_int("HABITS_TENANT_MAX_ENGINES", tenants.MAX_ENGINES),
+            on_open=instrument,
+        )
+        atexit.register(tenant_dbs.dispose)
 
     import uvicorn
 
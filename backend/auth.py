@@ -0,0 +1,68 @@
+"""
+Users and their bearer tokens (`Authorization: Bearer <token>`).
+
+Tokens are created with `manage.py create-user` and `create-token`. Only their SHA-256 is stored,
+so the database never holds anything that can be used to log in. Resolved tokens are kept in a
+small LRU for `TOKEN_TTL_SECONDS`, so most requests authenticate without a query.
+
+Unless auth is required (`HABITS_AUTH_REQUIRED=1`), requests without a token act as the default
+user, which owns everything in a single-user setup.
+"""
+
+import hashlib
+import secrets
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import cache
+import db_models as d
+
+TOKEN_TTL_SECONDS = 60
+
+tokens = cache.LRUCache(10_000, TOKEN_TTL_SECONDS)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_user(session: Session, name: str) -> d.User:
+    user = d.User(name=name)
+    session.add(user)
+    session.flush()
+    return user
+
+
+def create_token(session: Session, user_id: int) -> str:
+    """
+    New token for `user_id`. It's only ever returned here, the database keeps its hash.
+    """
+    token = secrets.token_urlsafe(32)
+    session.add(
+        d.AuthToken(
+            token_hash=hash_token(token), user_id=user_id, created_at=datetime.now()
+        )
+    )
+    return token
+
+
+def bearer_token(authorization: str) -> str | None:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def resolve(session: Session, token: str) -> int | None:
+    """
+    Id of the user `token` belongs to, None for unknown tokens (which aren't cached).
+    """
+    token_hash = hash_token(token)
+    return tokens.get_or_load(
+        token_hash,
+        lambda: session.scalar(
+            select(d.AuthToken.user_id).where(d.AuthToken.token_hash == token_hash)
+        ),
+    )
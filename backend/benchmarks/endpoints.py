@@ -0,0 +1,278 @@
+"""
+Latency and throughput of the main endpoints at several data sizes, through the ASGI app.
+
+For every size (`HABITSxYEARS`: habits of each type, years of daily logs) a fresh SQLite database
+is filled by `synthetic.generate`, then every case sends `--requests` requests with
+`--concurrency` of them in flight through httpx's ASGI transport. Routing, validation,
+serialization and the database are all measured, without any network in between.
+
+Results are printed as a table and, with `--output`, written as JSON. Pass an earlier file as
+`--baseline` to compare against it: the exit status is 1 if any case's p50 got slower by more
+than `--threshold`. Run from the backend directory:
+
+    python benchmarks/endpoints.py [--sizes 1x1 5x2 20x5] [--requests 200] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic
+
+import app
+import cache
+import db_models as d
+from database import DatabaseSettings
+
+# A request is (method, url, json body or None), built from the request's index
+Request = tuple[str, str, dict | None]
+
+
+@dataclass
+class Fixture:
+    habits: dict[d.HabitType, list[int]]
+    # Completion logs, one per request, which the update and delete cases work through
+    log_ids: list[int]
+
+
+def load_fixture(session: Session, requests: int) -> Fixture:
+    habits: dict[d.HabitType, list[int]] = {kind: [] for kind in d.HabitType}
+    for id, habit_type in session.execute(
+        select(d.Habit.id, d.Habit.habit_type).order_by(d.Habit.id)
+    ):
+        habits[habit_type].append(id)
+    log_ids = session.scalars(
+        select(d.CompletionLogEntry.id)
+        .order_by(d.CompletionLogEntry.id)
+        .limit(requests)
+    ).all()
+    return Fixture(habits, list(log_ids))
+
+
+def pick[T](items: list[T], i: int) -> T:
+    return items[i % len(items)]
+
+
+CASES: dict[str, Callable[[Fixture, int], Request]] = {
+    "list_habits": lambda f, i: ("GET", "/habits", None),
+    "get_habit_logs": lambda f, i: (
+        "GET",
+        f"/log/{pick(f.habits[d.HabitType.MEASURABLE], i)}?limit=500",
+        None,
+    ),
+    "log_habit": lambda f, i: (
+        "POST",
+        f"/log/{pick(f.habits[d.HabitType.COMPLETION], i)}",
+        {
+            "timestamp": str(synthetic.END + timedelta(minutes=i)),
+            "status": True,
+        },
+    ),
+    "update_log": lambda f, i: (
+        "PATCH",
+        f"/log/{pick(f.log_ids, i)}",
+        {"status": i % 2 == 0},
+    ),
+    "update_habit": lambda f, i: (
+        "PATCH",
+        f"/habits/{pick(f.habits[d.HabitType.COMPLETION], i)}",
+        {"name": f"Renamed {i}"},
+    ),
+    # Last, since it removes the logs the update case uses
+    "delete_log": lambda f, i: ("DELETE", f"/log/{pick(f.log_ids, i)}", None),
+}
+
+
+def percentile(latencies: list[float], p: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+async def run_case(
+    client: httpx.AsyncClient,
+    build: Callable[[int], Request],
+    requests: int,
+    concurrency: int,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def send(i: int):
+        nonlocal errors
+        method, url, body = build(i)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "requests_per_s": round(requests / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+async def run_size(
+    directory: Path, habits: int, years: float, args: argparse.Namespace
+) -> list[dict]:
+    settings = DatabaseSettings.from_env()
+    engine = d.get_engine(
+        replace(
+            settings, url=f"sqlite:///{directory / f'{habits}x{years}.db'}", echo=False
+        )
+    )
+    with Session(engine) as session:
+        counts = synthetic.generate(session, habits, years, seed=args.seed)
+        fixture = load_fixture(session, args.requests + args.warmup)
+
+    app.db = sessionmaker(bind=engine)
+    cache.habits.clear()
+    results = []
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        for name in args.cases:
+            build = CASES[name]
+            # Warm up the caches and the connection pool, with requests of their own so
+            # nothing the measured run deletes is gone already
+            await run_case(
+                client,
+                lambda i, build=build: build(fixture, args.requests + i),
+                args.warmup,
+                args.concurrency,
+            )
+            result = await run_case(
+                client,
+                lambda i, build=build: build(fixture, i),
+                args.requests,
+                args.concurrency,
+            )
+            results.append(
+                {"size": f"{habits}x{years:g}", "case": name, **counts, **result}
+            )
+    engine.dispose()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> bool:
+    """
+    Print the p50 change of every case also in `baseline`, returns whether any regressed.
+    """
+    before = {(r["size"], r["case"]): r for r in baseline["results"]}
+    regressed = False
+    print(f"\n{'size':<8}{'case':<16}{'p50 before':>12}{'p50 after':>12}{'change':>10}")
+    for result in results:
+        old = before.get((result["size"], result["case"]))
+        if old is None:
+            continue
+        change = result["p50_ms"] / old["p50_ms"] - 1
+        flag = ""
+        if change > threshold:
+            regressed, flag = True, "  REGRESSED"
+        print(
+            f"{result['size']:<8}{result['case']:<16}{old['p50_ms']:>12.3f}"
+            f"{result['p50_ms']:>12.3f}{change:>+10.1%}{flag}"
+        )
+    return regressed
+
+
+def parse_size(size: str) -> tuple[int, float]:
+    habits, _, years = size.partition("x")
+    return int(habits), float(years or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", default=["1x1", "5x2", "20x5"])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="Earlier --output to compare to")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            habits, years = parse_size(size)
+            results += asyncio.run(run_size(Path(directory), habits, years, args))
+
+    print(
+        f"{'size':<8}{'case':<16}{'logs':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'errors':>8}"
+    )
+    for r in results:
+        print(
+            f"{r['size']:<8}{r['case']:<16}{r['logs']:>9}{r['requests_per_s']:>9.1f}"
+            f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>8}"
+        )
+
+    if args.output:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "settings": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "baseline")
+            },
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Per-row serialization cost of the list_habits and get_habit_logs responses.
+
+Compares the precompiled serializers against sqlalchemy_serializer's `SerializerMixin.to_dict`
+(the dev dependency), which the models used before. Run from the backend directory:
+
+    python benchmarks/serialization.py [--habits 300] [--logs 20000]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import cast
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, joinedload, selectinload, with_polymorphic
+from sqlalchemy_serializer import SerializerMixin
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db_models as d
+
+
+def install_legacy_serializer():
+    # Puts SerializerMixin back under the models, for `legacy_to_dict`
+    d.Base.__bases__ = (*d.Base.__bases__, SerializerMixin)
+
+
+def legacy_to_dict(obj: d.Base, rules: tuple[str, ...]) -> dict:
+    # Every model is a SerializerMixin once it's installed
+    return SerializerMixin.to_dict(cast(SerializerMixin, obj), rules=rules)
+
+
+# The rules the models used to pass to SerializerMixin.to_dict
+LEGACY_RULES = {
+    d.Habit: ("-logs", "-options.habit"),
+    d.LogEntry: ("-habit", "-option.habit"),
+}
+
+
+def populate(session: Session, habits: int, logs: int):
+    start = datetime(2020, 1, 1)
+    for i in range(habits):
+        kind = i % 3
+        if kind == 0:
+            habit = d.CompletionHabit(
+                name=f"Habit {i}", completion_target=1, target_timeframe=d.Timeframe.DAY
+            )
+        elif kind == 1:
+            habit = d.MeasureableHabit(
+                name=f"Habit {i}",
+                target=100,
+                completion_target=d.Timeframe.DAY,
+                unit="ml",
+            )
+        else:
+            habit = d.ChoiceHabit(
+                name=f"Habit {i}",
+                options=[d.ChoiceOption(option_text=f"Option {n}") for n in range(3)],
+            )
+        session.add(habit)
+    session.flush()
+
+    choice = session.scalars(select(d.ChoiceHabit).limit(1)).one()
+    option = choice.options[0]
+    for i in range(logs):
+        timestamp = start + timedelta(hours=i)
+        if i % 3 == 0:
+            entry = d.CompletionLogEntry(habit_id=1, timestamp=timestamp, status=True)
+        elif i % 3 == 1:
+            entry = d.MeasureableLogEntry(habit_id=2, timestamp=timestamp, value=i)
+        else:
+            entry = d.ChoiceLogEntry(
+                habit_id=choice.id, timestamp=timestamp, option_id=option.id
+            )
+        session.add(entry)
+    session.commit()
+
+
+def per_row(func, rows: int, repeat: int) -> float:
+    # Best of `repeat` runs, in microseconds per row
+    return min(timeit.repeat(func, number=1, repeat=repeat)) / rows * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--habits", type=int, default=300)
+    parser.add_argument("--logs", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    install_legacy_serializer()
+    engine = create_engine("sqlite://")
+    d.Base.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        populate(session, args.habits, args.logs)
+
+        habits_query = with_polymorphic(d.Habit, "*")
+        habits = session.scalars(
+            select(habits_query).options(selectinload(habits_query.ChoiceHabit.options))
+        ).all()
+        logs_query = with_polymorphic(d.LogEntry, "*")
+        logs = (
+            session.scalars(
+                select(logs_query).options(joinedload(logs_query.ChoiceLogEntry.option))
+            )
+            .unique()
+            .all()
+        )
+
+        # Both sides include the JSON encoding step FastAPI does with each return value
+        cases = {
+            "list_habits": (
+                habits,
+                lambda: jsonable_encoder(
+                    [legacy_to_dict(h, LEGACY_RULES[d.Habit]) for h in habits]
+                ),
+                lambda: json.dumps([h.to_dict() for h in habits]),
+            ),
+            "get_habit_logs": (
+                logs,
+                lambda: jsonable_encoder(
+                    [legacy_to_dict(log, LEGACY_RULES[d.LogEntry]) for log in logs]
+                ),
+                lambda: json.dumps([log.to_dict() for log in logs]),
+            ),
+        }
+
+        print(
+            f"{'endpoint':<16}{'rows':>8}{'before (us/row)':>18}{'after (us/row)':>18}{'speedup':>10}"
+        )
+        for name, (rows, before, after) in cases.items():
+            before_cost = per_row(before, len(rows), args.repeat)
+            after_cost = per_row(after, len(rows), args.repeat)
+            print(
+                f"{name:<16}{len(rows):>8}{before_cost:>18.2f}{after_cost:>18.2f}"
+                f"{before_cost / after_cost:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
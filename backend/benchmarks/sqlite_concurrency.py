@@ -0,0 +1,159 @@
+"""
+Read/write concurrency of the SQLite engine, before and after the tuning profile in `database`.
+
+Reader threads page through the logs of a habit while writer threads keep logging to it, like a
+busy server would. "before" is the plain engine `get_engine` used to create (rollback journal,
+default pool), "after" is `database.create_engine` with its defaults (WAL and pragmas). Run from
+the backend directory:
+
+    python benchmarks/sqlite_concurrency.py [--readers 8] [--writers 2] [--seconds 5]
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database
+import db_models as d
+import migrations
+from database import DatabaseSettings
+
+
+def populate(session: Session, logs: int):
+    habit = d.CompletionHabit(
+        name="Habit", completion_target=1, target_timeframe=d.Timeframe.DAY
+    )
+    session.add(habit)
+    session.flush()
+    start = datetime(2020, 1, 1)
+    session.add_all(
+        d.CompletionLogEntry(
+            habit_id=habit.id, timestamp=start + timedelta(hours=i), status=True
+        )
+        for i in range(logs)
+    )
+    session.commit()
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.read_latencies: list[float] = []
+        self.writes = 0
+        self.errors = 0
+
+
+def reader(db: sessionmaker[Session], counters: Counters, stop: threading.Event):
+    query = (
+        select(d.LogEntry)
+        .where(d.LogEntry.habit_id == 1)
+        .order_by(d.LogEntry.timestamp.desc())
+        .limit(500)
+    )
+    latencies = []
+    errors = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with db() as session:
+                session.scalars(query).all()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:  # database is locked
+            errors += 1
+    with counters.lock:
+        counters.read_latencies += latencies
+        counters.errors += errors
+
+
+def writer(db: sessionmaker[Session], counters: Counters, stop: threading.Event):
+    writes = errors = 0
+    timestamp = datetime(2030, 1, 1)
+    while not stop.is_set():
+        try:
+            with db() as session:
+                session.add(
+                    d.CompletionLogEntry(habit_id=1, timestamp=timestamp, status=True)
+                )
+                session.commit()
+            writes += 1
+        except OperationalError:
+            errors += 1
+    with counters.lock:
+        counters.writes += writes
+        counters.errors += errors
+
+
+def run(engine: sqlalchemy.engine.Engine, args: argparse.Namespace) -> dict:
+    db = sessionmaker(bind=engine)
+    counters = Counters()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=reader, args=(db, counters, stop))
+        for _ in range(args.readers)
+    ] + [
+        threading.Thread(target=writer, args=(db, counters, stop))
+        for _ in range(args.writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    latencies = sorted(counters.read_latencies)
+    return {
+        "reads/s": len(latencies) / args.seconds,
+        "writes/s": counters.writes / args.seconds,
+        "read p50 (ms)": statistics.median(latencies) * 1000 if latencies else 0,
+        "read p95 (ms)": latencies[int(len(latencies) * 0.95)] * 1000
+        if latencies
+        else 0,
+        "errors": counters.errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--logs", type=int, default=20_000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("before", "after"):
+            url = f"sqlite:///{Path(directory) / f'{name}.db'}"
+            if name == "before":
+                engine = sqlalchemy.create_engine(url)
+            else:
+                engine = database.create_engine(DatabaseSettings(url=url, echo=False))
+            # Also adds the default user, who owns the habit populate() creates
+            migrations.migrate(engine)
+            with Session(engine) as session:
+                populate(session, args.logs)
+            results[name] = run(engine, args)
+
+    print(f"{'':<16}{'before':>12}{'after':>12}")
+    for metric in results["before"]:
+        print(
+            f"{metric:<16}{results['before'][metric]:>12.1f}{results['after'][metric]:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
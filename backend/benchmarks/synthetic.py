@@ -0,0 +1,145 @@
+"""
+Synthetic data for benchmarks: `habits` habits of every `HabitType`, each with `years` of daily
+logs ending at `END`, generated from a fixed seed so every run gets the same database.
+
+Logs are inserted in batches with `dialects.insert_logs` (COPY on PostgreSQL) and the rollups
+and stats are rebuilt once per habit at the end, so the database looks like one the write paths
+kept up to date. Can be used on its own to fill a database file, run from the backend directory:
+
+    python benchmarks/synthetic.py habits.db [--habits 10] [--years 2] [--logs-per-day 1]
+"""
+
+import argparse
+import random
+import sys
+from collections.abc import Iterator
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from itertools import batched
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db_models as d
+import dialects
+import stats
+from database import DatabaseSettings
+
+END = date(2025, 1, 1)
+INSERT_BATCH_SIZE = 10_000
+OPTIONS = ("Happy", "Sad", "Neutral")
+
+
+def create_habits(session: Session, per_type: int) -> list[d.Habit]:
+    habits: list[d.Habit] = []
+    for i in range(per_type):
+        habits.append(
+            d.CompletionHabit(
+                name=f"Completion {i}",
+                completion_target=1 + i % 3,
+                target_timeframe=(d.Timeframe.DAY, d.Timeframe.WEEK)[i % 2],
+            )
+        )
+        habits.append(
+            d.MeasureableHabit(
+                name=f"Measurable {i}",
+                target=400,
+                completion_target=d.Timeframe.DAY,
+                unit="ml",
+            )
+        )
+        habits.append(
+            d.ChoiceHabit(
+                name=f"Choice {i}",
+                options=[d.ChoiceOption(option_text=text) for text in OPTIONS],
+            )
+        )
+    session.add_all(habits)
+    session.flush()
+    return habits
+
+
+def log_rows(
+    habit: d.Habit, days: int, logs_per_day: int, rng: random.Random
+) -> Iterator[dict]:
+    start = datetime.combine(END, datetime.min.time()) - timedelta(days=days)
+    option_ids = [option.id for option in getattr(habit, "options", ())]
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        for timestamp in sorted(
+            day_start + timedelta(seconds=rng.randrange(86400))
+            for _ in range(logs_per_day)
+        ):
+            row = {
+                "habit_id": habit.id,
+                "user_id": habit.user_id,
+                "timestamp": timestamp,
+                "habit_type": habit.habit_type,
+            }
+            if habit.habit_type == d.HabitType.COMPLETION:
+                row["status"] = rng.random() < 0.85
+            elif habit.habit_type == d.HabitType.MEASURABLE:
+                row["value"] = rng.randrange(50, 750)
+            else:
+                row["option_id"] = rng.choice(option_ids)
+            yield row
+
+
+def generate(
+    session: Session,
+    habits: int,
+    years: float,
+    logs_per_day: int = 1,
+    seed: int = 0,
+) -> dict:
+    """
+    Fill the (empty) database of `session` and commit. Returns how many habits and logs it created.
+    """
+    rng = random.Random(seed)
+    days = round(years * 365)
+    entities = {
+        d.HabitType.COMPLETION: d.CompletionLogEntry,
+        d.HabitType.MEASURABLE: d.MeasureableLogEntry,
+        d.HabitType.CHOICE: d.ChoiceLogEntry,
+    }
+
+    created = create_habits(session, habits)
+    logs = 0
+    for habit in created:
+        entity = entities[habit.habit_type]
+        for batch in batched(
+            log_rows(habit, days, logs_per_day, rng), INSERT_BATCH_SIZE
+        ):
+            dialects.insert_logs(session, entity, batch)
+            logs += len(batch)
+    for habit in created:
+        stats.rebuild(session, habit)
+    session.commit()
+    return {"habits": len(created), "logs": logs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", type=Path, help="SQLite database file to create")
+    parser.add_argument("--habits", type=int, default=10, help="Habits of each type")
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--logs-per-day", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.path.exists():
+        parser.error(f"{args.path} already exists")
+    engine = d.get_engine(
+        replace(DatabaseSettings.from_env(), url=f"sqlite:///{args.path}", echo=False)
+    )
+    with Session(engine) as session:
+        counts = generate(
+            session, args.habits, args.years, args.logs_per_day, args.seed
+        )
+    print(f"Created {counts['habits']} habits and {counts['logs']} logs in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Inserting many log entries at once, e.g. when importing history from another app.
+
+Rows are validated on their own so one bad row doesn't reject the whole import, habits and
+options are looked up once for the whole batch and the entries are inserted with one
+executemany per log type (a COPY for large batches on PostgreSQL, see `dialects`), all in a
+single transaction.
+"""
+
+from collections import defaultdict
+from collections.abc import AsyncIterable, Iterable
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session, with_polymorphic
+
+import api_models as a
+import changes
+import db_models as d
+import dialects
+import idempotency
+import rollups
+import stats
+
+MAX_ROWS = 50_000
+
+row_adapter = TypeAdapter(a.BulkHabitLog)
+
+# Index of the row in the request, so errors can point at it
+Row = tuple[int, a.BulkHabitLog]
+
+
+def row_error(index: int, detail: str, error: ValidationError | None = None) -> dict:
+    result: dict = {"row": index, "detail": detail}
+    if error is not None:
+        result["errors"] = error.errors(
+            include_url=False, include_context=False, include_input=False
+        )
+    return result
+
+
+def parse_rows(raw_rows: Iterable[object]) -> tuple[list[Row], list[dict]]:
+    """
+    Validate already decoded JSON rows. NDJSON lines can be passed as `str`/`bytes` and get decoded here.
+    """
+    rows, errors = [], []
+    for index, raw in enumerate(raw_rows):
+        try:
+            if isinstance(raw, (str, bytes)):
+                rows.append((index, row_adapter.validate_json(raw)))
+            else:
+                rows.append((index, row_adapter.validate_python(raw)))
+        except ValidationError as e:
+            errors.append(row_error(index, "Invalid log entry", e))
+    return rows, errors
+
+
+async def ndjson_lines(chunks: AsyncIterable[bytes]) -> AsyncIterable[bytes]:
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+def entry_values(habit: d.Habit, log: a.HabitLog) -> tuple[type[d.LogEntry], dict]:
+    # Inserted from dicts, so the user isn't filled in on flush like for ORM objects
+    values = {
+        "habit_id": habit.id,
+        "user_id": habit.user_id,
+        "timestamp": log.timestamp,
+        "client_id": log.client_id,
+        "habit_type": log.type,
+    }
+    if isinstance(log, a.CompletionHabitLog):
+        return d.CompletionLogEntry, values | {"status": log.status}
+    elif isinstance(log, a.MeasureableHabitLog):
+        return d.MeasureableLogEntry, values | {"value": log.amount}
+    else:
+        return d.ChoiceLogEntry, values | {"option_id": log.option_id}
+
+
+def log_amount(log: a.HabitLog) -> int:
+    # Same amounts as rollups.log_amount, but for API models
+    if isinstance(log, a.CompletionHabitLog):
+        return int(log.status)
+    elif isinstance(log, a.MeasureableHabitLog):
+        return log.amount
+    else:
+        return 1
+
+
+def insert_logs(session: Session, rows: list[Row]) -> tuple[int, list[dict]]:
+    """
+    Insert every valid row and return how many were inserted along with the errors of the others.
+    Doesn't commit.
+    """
+    habit_ids = {row.habit_id for _, row in rows}
+    habits = with_polymorphic(d.Habit, "*")
+    habits_by_id: dict[int, d.Habit] = {
+        habit.id: habit
+        for habit in session.scalars(select(habits).where(habits.id.in_(habit_ids)))
+    }
+    option_ids = {row.option_id for _, row in rows if isinstance(row, a.ChoiceHabitLog)}
+    option_owners: dict[int, int] = {
+        option_id: habit_id
+        for option_id, habit_id in session.execute(
+            select(d.ChoiceOption.id, d.ChoiceOption.habit_id).where(
+                d.ChoiceOption.id.in_(option_ids)
+            )
+        )
+    }
+
+    logged = idempotency.logged_client_ids(
+        session,
+        ((row.habit_id, row.client_id) for _, row in rows if row.client_id is not None),
+    )
+
+    errors = []
+    batches: dict[type[d.LogEntry], list[dict]] = defaultdict(list)
+    added: dict[int, list[rollups.LogPoint]] = defaultdict(list)
+    for index, row in rows:
+        habit = habits_by_id.get(row.habit_id)
+        if habit is None:
+            errors.append(row_error(index, "Habit not found"))
+            continue
+        if habit.habit_type != row.type:
+            errors.append(row_error(index, "Habit type mismatch"))
+            continue
+        if isinstance(row, a.ChoiceHabitLog):
+            owner = option_owners.get(row.option_id)
+            if owner is None:
+                errors.append(row_error(index, "Option not found"))
+                continue
+            if owner != row.habit_id:
+                errors.append(
+                    row_error(index, "Option does not belong to the specified habit")
+                )
+                continue
+        if row.client_id is not None:
+            # Retried imports skip what's already there, repeats within the import count once
+            if (row.habit_id, row.client_id) in logged:
+                errors.append(row_error(index, "Already logged"))
+                continue
+            logged.add((row.habit_id, row.client_id))
+
+        entity, values = entry_values(habit, row)
+        batches[entity].append(values)
+        added[row.habit_id].append((row.timestamp, log_amount(row)))
+
+    log_ids: dict[int, list[int]] = defaultdict(list)
+    for entity, batch in batches.items():
+        ids = dialects.insert_logs(session, entity, batch)
+        for values, id in zip(batch, ids):
+            log_ids[values["habit_id"]].append(id)
+    stats.lock_habits(session, added)
+    for habit_id, points in added.items():
+        stats.apply_log_batch(session, habits_by_id[habit_id], points)
+        changes.record_import(session, habit_id, log_ids[habit_id])
+
+    return sum(len(batch) for batch in batches.values()), errors
+
+
+def import_rows(session: Session, raw_rows: Iterable[object]) -> tuple[int, list[dict]]:
+    rows, errors = parse_rows(raw_rows)
+    inserted, insert_errors = insert_logs(session, rows)
+    return inserted, sorted(errors + insert_errors, key=lambda error: error["row"])
@@ -0,0 +1,145 @@
+"""
+In-process cache of habit definitions and their choice options.
+
+Definitions change rarely but are read on every log write and dashboard poll, so they are kept
+as detached ORM objects (with their options loaded) in a bounded LRU with a TTL. The endpoints
+changing a definition invalidate it after committing, the TTL only bounds staleness when several
+processes share a database. Log writes validate against the cached copy and `session.merge` it
+with `load=False`, which attaches it to their session without a query.
+
+Entries are keyed by the user of the session (see `ownership`) as well, so users never see each
+other's habits, even in tenant mode where every user's habit ids start at 1.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload, with_polymorphic
+
+import db_models as d
+import ownership
+
+MAX_ENTRIES = 1024
+TTL_SECONDS = 300
+
+# Key of the cached habit list (with the user id), habit ids are ints
+ALL_HABITS = "all"
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[object, tuple[float, object]] = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by every invalidation, so loads that raced with one don't store stale values
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load[T](self, key: object, load: Callable[[], T | None]) -> T | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]  # ty: ignore[invalid-return-type]
+            self.misses += 1
+            generation = self.generation
+
+        value = load()
+        if value is None:
+            return None  # Missing habits aren't cached, creating one doesn't invalidate its id
+
+        with self.lock:
+            if self.generation == generation:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys: object):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+            }
+
+
+@dataclass(frozen=True)
+class CachedHabit:
+    habit: d.Habit  # Detached, with every column and its options loaded
+    data: dict
+    option_ids: frozenset[int]
+
+
+habits = LRUCache(MAX_ENTRIES, TTL_SECONDS)
+
+
+# Subclass columns in the same statement, options of choice habits in one more
+polymorphic_habit = with_polymorphic(d.Habit, "*")
+habit_query = select(polymorphic_habit).options(
+    selectinload(polymorphic_habit.ChoiceHabit.options)
+)
+
+
+def load_habit(session: Session, habit_id: int) -> CachedHabit | None:
+    habit = session.scalar(habit_query.where(polymorphic_habit.id == habit_id))
+    if habit is None:
+        return None
+    session.expunge(habit)  # Cascades to the options
+    options = habit.options if isinstance(habit, d.ChoiceHabit) else []
+    return CachedHabit(habit, habit.to_dict(), frozenset(o.id for o in options))
+
+
+def get_habit(session: Session, habit_id: int) -> CachedHabit | None:
+    return habits.get_or_load(
+        (ownership.user_id(session), habit_id), lambda: load_habit(session, habit_id)
+    )
+
+
+def list_habits(session: Session) -> list[dict]:
+    def load():
+        query = habit_query.order_by(polymorphic_habit.id)
+        return [habit.to_dict() for habit in session.scalars(query)]
+
+    return habits.get_or_load((ownership.user_id(session), ALL_HABITS), load) or []
+
+
+def attach(session: Session, cached: CachedHabit) -> d.Habit:
+    """
+    Copy of the cached habit that belongs to `session`, without querying the database.
+    """
+    return session.merge(cached.habit, load=False)
+
+
+def habit_changed(session: Session, habit_id: int | None = None):
+    """
+    Forget a habit (and the habit list) of the session's user after a change to its definition or
+    options was committed.
+    """
+    user_id = ownership.user_id(session)
+    if habit_id is None:
+        habits.invalidate((user_id, ALL_HABITS))
+    else:
+        habits.invalidate((user_id, ALL_HABITS), (user_id, habit_id))
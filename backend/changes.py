@@ -0,0 +1,146 @@
+"""
+Bookkeeping every committed write goes through.
+
+`record` is called next to each habit, option and log mutation, in the same transaction. It bumps
+the version counters (see `versions`), marks the row in `sync_changes` for delta syncs and keeps a
+compact event for the change, which is published to `/events` subscribers once the transaction
+commits and dropped if it rolls back.
+"""
+
+from collections.abc import Iterable
+from enum import StrEnum
+
+from sqlalchemy import delete, event
+from sqlalchemy.orm import Session
+
+import db_models as d
+import dialects
+import events
+import ownership
+import versions
+from db_models import ChangeKind
+
+
+class ChangeAction(StrEnum):
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+    IMPORTED = "imported"  # Many logs of a habit at once, see `bulk`
+
+
+def record(
+    session: Session,
+    kind: ChangeKind,
+    action: ChangeAction,
+    habit_id: int,
+    id: int | None = None,
+    **extra,
+):
+    version = versions.bump(session, habit_id)
+    track(session, kind, action, habit_id, id, version)
+    change = {
+        "kind": kind,
+        "action": action,
+        "habit_id": habit_id,
+        "version": version,
+    }
+    if id is not None:
+        change["id"] = id
+    session.info.setdefault("changes", []).append(change | extra)
+
+
+def record_import(session: Session, habit_id: int, log_ids: Iterable[int]):
+    """
+    `record` for logs inserted in bulk, as one event for the habit.
+    """
+    version = versions.bump(session, habit_id)
+    user_id = ownership.user_id(session)
+    rows = [
+        {
+            "user_id": user_id,
+            "kind": ChangeKind.LOG,
+            "entity_id": id,
+            "habit_id": habit_id,
+            "seq": version,
+            "deleted": False,
+        }
+        for id in log_ids
+    ]
+    if rows:
+        # SQLite reuses the ids of deleted rows, which may have left tombstones behind
+        session.execute(mark_changed(session), rows)
+    session.info.setdefault("changes", []).append(
+        {
+            "kind": ChangeKind.LOG,
+            "action": ChangeAction.IMPORTED,
+            "habit_id": habit_id,
+            "version": version,
+            "count": len(rows),
+        }
+    )
+
+
+def mark_changed(session: Session):
+    """
+    Upsert of `sync_changes` rows, replacing the entity's earlier change.
+    """
+    sync_changes = d.SyncChange.__table__
+    upsert = dialects.insert(session, sync_changes)
+    return upsert.on_conflict_do_update(
+        index_elements=[
+            sync_changes.c.user_id,
+            sync_changes.c.kind,
+            sync_changes.c.entity_id,
+        ],
+        set_={
+            "habit_id": upsert.excluded.habit_id,
+            "seq": upsert.excluded.seq,
+            "deleted": upsert.excluded.deleted,
+        },
+    )
+
+
+def track(
+    session: Session,
+    kind: ChangeKind,
+    action: ChangeAction,
+    habit_id: int,
+    id: int | None,
+    version: int,
+):
+    if kind == ChangeKind.LOG:
+        key = (ChangeKind.LOG, id)
+    else:
+        # The habit carries its options, so syncing it syncs them
+        key = (ChangeKind.HABIT, habit_id)
+    deleted = action == ChangeAction.DELETED and kind != ChangeKind.OPTION
+    session.execute(
+        mark_changed(session).values(
+            user_id=ownership.user_id(session),
+            kind=key[0],
+            entity_id=key[1],
+            habit_id=habit_id,
+            seq=version,
+            deleted=deleted,
+        )
+    )
+    if deleted and kind == ChangeKind.HABIT:
+        # The habit's tombstone covers its logs
+        session.execute(
+            delete(d.SyncChange).where(
+                d.SyncChange.habit_id == habit_id,
+                d.SyncChange.kind != ChangeKind.HABIT,
+            )
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session: Session):
+    changes = session.info.pop("changes", None)
+    if changes:
+        events.broker.publish(changes, ownership.user_id(session))
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session: Session):
+    session.info.pop("changes", None)
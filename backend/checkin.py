@@ -0,0 +1,96 @@
+"""
+Checking in many habits for a day at once.
+
+Every entry is validated against the cached habit definitions (see `cache`) before anything is
+written, so a check-in either logs all of its entries or none. The entries are inserted with one
+executemany per log type and committed in one transaction by the caller.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+import api_models as a
+import bulk
+import cache
+import changes
+import db_models as d
+import dialects
+import rollups
+import stats
+from changes import ChangeAction, ChangeKind
+
+
+def validate(
+    session: Session, logs: list[a.CheckinLog]
+) -> tuple[dict[int, cache.CachedHabit], list[dict]]:
+    habits: dict[int, cache.CachedHabit] = {}
+    errors = []
+    for index, log in enumerate(logs):
+        cached = habits.get(log.habit_id) or cache.get_habit(session, log.habit_id)
+        if cached is None:
+            errors.append(bulk.row_error(index, "Habit not found"))
+            continue
+        habits[log.habit_id] = cached
+        if cached.habit.habit_type != log.type:
+            errors.append(bulk.row_error(index, "Habit type mismatch"))
+        elif (
+            isinstance(log, a.CheckinChoiceLog)
+            and log.option_id not in cached.option_ids
+        ):
+            errors.append(
+                bulk.row_error(index, "Option does not belong to the specified habit")
+            )
+    return habits, errors
+
+
+# The bulk import rows with the same fields, plus the timestamp
+BULK_ROWS: dict[type[a.CheckinLog], type[a.BulkHabitLog]] = {
+    a.CheckinCompletionLog: a.BulkCompletionHabitLog,
+    a.CheckinMeasureableLog: a.BulkMeasureableHabitLog,
+    a.CheckinChoiceLog: a.BulkChoiceHabitLog,
+}
+
+
+def check_in(session: Session, checkin: a.Checkin, at: datetime) -> dict | list[dict]:
+    """
+    Log every entry of `checkin` at `at` and return the ids of the new entries along with each
+    habit's refreshed target progress. If any entry is invalid nothing is logged and the errors
+    are returned instead. Doesn't commit.
+    """
+    cached_habits, errors = validate(session, checkin.logs)
+    if errors:
+        return errors
+
+    rows = [
+        BULK_ROWS[type(log)](**log.model_dump(), timestamp=at) for log in checkin.logs
+    ]
+    batches: dict[type[d.LogEntry], list[tuple[int, dict]]] = defaultdict(list)
+    for index, row in enumerate(rows):
+        entity, values = bulk.entry_values(cached_habits[row.habit_id].habit, row)
+        batches[entity].append((index, values))
+
+    ids = [0] * len(rows)
+    for entity, batch in batches.items():
+        inserted = dialects.insert_logs(
+            session, entity, [values for _, values in batch]
+        )
+        for (index, _), id in zip(batch, inserted):
+            ids[index] = id
+
+    added: dict[int, list[rollups.LogPoint]] = defaultdict(list)
+    for row, id in zip(rows, ids):
+        added[row.habit_id].append((row.timestamp, bulk.log_amount(row)))
+        changes.record(session, ChangeKind.LOG, ChangeAction.CREATED, row.habit_id, id)
+    stats.lock_habits(session, added)
+    progress = []
+    for habit_id, points in added.items():
+        habit = cache.attach(session, cached_habits[habit_id])
+        stats.apply_log_batch(session, habit, points)
+        progress.append(stats.summary(session, habit, at))
+
+    return {
+        "logs": [{"habit_id": row.habit_id, "id": id} for row, id in zip(rows, ids)],
+        "progress": progress,
+    }
@@ -0,0 +1,153 @@
+"""
+Engine configuration.
+
+Everything is read from the environment, so the same build can run against a scratch database in
+development and a tuned one in production:
+
+    HABITS_DATABASE_URL      sqlalchemy URL of the database (sqlite:///habits.db), SQLite or
+                             PostgreSQL (postgresql+psycopg2://user@host/habits, needs psycopg2,
+                             and asyncpg for HABITS_ASYNC_DB), see `dialects`
+    HABITS_DB_ECHO           SQLAlchemy's own logging of every statement, 1 or 0 (0), see
+                             `structured_logging` for cheaper SQL logging
+    HABITS_DB_POOL_SIZE      connections kept open (10)
+    HABITS_DB_MAX_OVERFLOW   extra connections opened under load (30)
+    HABITS_DB_POOL_TIMEOUT   seconds to wait for a free connection (30)
+    HABITS_SQLITE_WAL        use write-ahead logging, 1 or 0 (1)
+    HABITS_SQLITE_SYNCHRONOUS        synchronous pragma (NORMAL)
+    HABITS_SQLITE_BUSY_TIMEOUT       milliseconds a writer waits for the lock (5000)
+    HABITS_SQLITE_CACHE_SIZE         page cache, negative values are KiB (-64000)
+    HABITS_SQLITE_MMAP_SIZE          bytes of the file to memory map (268435456)
+"""
+
+import os
+from dataclasses import dataclass
+
+import sqlalchemy
+import sqlalchemy.ext.asyncio
+from sqlalchemy import event, make_url
+
+DEFAULT_URL = "sqlite:///habits.db"
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+def env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str = DEFAULT_URL
+    echo: bool = False
+    # 40 connections in total, the size of the threadpool sync endpoints run in
+    pool_size: int = 10
+    max_overflow: int = 30
+    pool_timeout: int = 30
+    wal: bool = True
+    synchronous: str = "NORMAL"
+    busy_timeout: int = 5000
+    cache_size: int = -64000
+    mmap_size: int = 256 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        synchronous = os.environ.get(
+            "HABITS_SQLITE_SYNCHRONOUS", cls.synchronous
+        ).upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid HABITS_SQLITE_SYNCHRONOUS: {synchronous}")
+        return cls(
+            url=os.environ.get("HABITS_DATABASE_URL", cls.url),
+            echo=env_flag("HABITS_DB_ECHO", cls.echo),
+            pool_size=env_int("HABITS_DB_POOL_SIZE", cls.pool_size),
+            max_overflow=env_int("HABITS_DB_MAX_OVERFLOW", cls.max_overflow),
+            pool_timeout=env_int("HABITS_DB_POOL_TIMEOUT", cls.pool_timeout),
+            wal=env_flag("HABITS_SQLITE_WAL", cls.wal),
+            synchronous=synchronous,
+            busy_timeout=env_int("HABITS_SQLITE_BUSY_TIMEOUT", cls.busy_timeout),
+            cache_size=env_int("HABITS_SQLITE_CACHE_SIZE", cls.cache_size),
+            mmap_size=env_int("HABITS_SQLITE_MMAP_SIZE", cls.mmap_size),
+        )
+
+    @property
+    def is_sqlite(self) -> bool:
+        return make_url(self.url).get_backend_name() == "sqlite"
+
+    @property
+    def async_url(self) -> str:
+        url = make_url(self.url)
+        if url.drivername == "sqlite":
+            url = url.set(drivername="sqlite+aiosqlite")
+        elif url.drivername in ("postgresql", "postgresql+psycopg2"):
+            url = url.set(drivername="postgresql+asyncpg")
+        return url.render_as_string(hide_password=False)
+
+
+def sqlite_pragmas(settings: DatabaseSettings) -> list[str]:
+    pragmas = [
+        f"PRAGMA busy_timeout = {settings.busy_timeout}",
+        f"PRAGMA synchronous = {settings.synchronous}",
+        f"PRAGMA cache_size = {settings.cache_size}",
+        f"PRAGMA mmap_size = {settings.mmap_size}",
+        "PRAGMA foreign_keys = ON",
+    ]
+    if settings.wal:
+        # Readers keep working off the last commit while a writer appends to the log
+        pragmas.insert(0, "PRAGMA journal_mode = WAL")
+    return pragmas
+
+
+def install_pragmas(engine: sqlalchemy.engine.Engine, settings: DatabaseSettings):
+    """
+    Apply the SQLite pragmas to every new connection of `engine`, they don't persist in the file
+    (except for the journal mode).
+    """
+    pragmas = sqlite_pragmas(settings)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def engine_options(settings: DatabaseSettings, url: str) -> dict:
+    options = {"echo": settings.echo}
+    database = make_url(url).database
+    # In-memory SQLite gets a single connection per thread, there is no pool to size
+    if not settings.is_sqlite or database not in (None, "", ":memory:"):
+        options |= {
+            "pool_size": settings.pool_size,
+            "max_overflow": settings.max_overflow,
+            "pool_timeout": settings.pool_timeout,
+            "pool_pre_ping": not settings.is_sqlite,
+        }
+    return options
+
+
+def create_engine(settings: DatabaseSettings) -> sqlalchemy.engine.Engine:
+    engine = sqlalchemy.create_engine(
+        settings.url, **engine_options(settings, settings.url)
+    )
+    if settings.is_sqlite:
+        install_pragmas(engine, settings)
+    return engine
+
+
+def create_async_engine(
+    settings: DatabaseSettings,
+) -> sqlalchemy.ext.asyncio.AsyncEngine:
+    url = settings.async_url
+    engine = sqlalchemy.ext.asyncio.create_async_engine(
+        url, **engine_options(settings, url)
+    )
+    if settings.is_sqlite:
+        install_pragmas(engine.sync_engine, settings)
+    return engine
@@ -1,15 +1,24 @@
 import sqlalchemy
 from sqlalchemy import (
+    BigInteger,
     String,
+    Date,
     DateTime,
     ForeignKey,
+    Index,
     Enum as SQLEnum,
+    text,
 )
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy_serializer import SerializerMixin
-from datetime import datetime
-from sqlalchemy import create_engine
+from typing import ClassVar
+from datetime import date, datetime
 from enum import StrEnum
+from time import perf_counter
+import database
+import metrics
+import serializers
+from database import DatabaseSettings
 
 
 class HabitType(StrEnum):
@@ -24,34 +33,95 @@ class Timeframe(StrEnum):
     MONTH = "month"
 
 
-class Base(DeclarativeBase, SerializerMixin):
-    pass
+class ChangeKind(StrEnum):
+    HABIT = "habit"
+    OPTION = "option"
+    LOG = "log"
 
 
-class Habit(Base):
+# Native ENUM types on PostgreSQL, shared by every column of the enum. Plain VARCHARs on SQLite.
+HABIT_TYPE = SQLEnum(HabitType, name="habit_type")
+TIMEFRAME = SQLEnum(Timeframe, name="timeframe")
+# Logged values and their sums. SQLite integers are 64-bit anyway, PostgreSQL's INTEGER is 32-bit.
+AMOUNT = BigInteger
+
+
+class Base(DeclarativeBase):
+    # Relationships to nest when serializing, only columns are included otherwise
+    __serialize__: ClassVar[tuple[str, ...]] = ()
+    # Always a Table here, DeclarativeBase only promises a FromClause
+    __table__: ClassVar[sqlalchemy.Table]  # ty: ignore[invalid-mutable-override]
+
+    def to_dict(self) -> dict:
+        stats = metrics.current_request.get()
+        if stats is None:
+            return serializers.serialize(self)
+        start = perf_counter()
+        try:
+            return serializers.serialize(self)
+        finally:
+            stats.serialize_seconds += perf_counter() - start
+
+
+# Owns everything in a database that predates users, and everything when auth isn't required
+DEFAULT_USER_ID = 1
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), unique=True)
+
+
+class AuthToken(Base):
+    __tablename__ = "auth_tokens"
+
+    # Only the SHA-256 of a token is stored, see `auth`
+    token_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), index=True
+    )
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class Owned:
+    """
+    Rows belonging to a user. Queries of a session with a user are scoped to it, see `ownership`.
+    """
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        default=DEFAULT_USER_ID,
+    )
+
+    # The API only ever shows a user their own rows
+    __serialize_exclude__: ClassVar[tuple[str, ...]] = ("user_id",)
+
+
+class Habit(Owned, Base):
     __tablename__ = "habits"
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(nullable=False)
-    habit_type: Mapped[HabitType] = mapped_column(SQLEnum(HabitType), nullable=False)
+    habit_type: Mapped[HabitType] = mapped_column(HABIT_TYPE, nullable=False)
 
     logs: Mapped[list["LogEntry"]] = relationship(
         back_populates="habit",
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (Index("ix_habits_user_id", "user_id", "id"),)
     __mapper_args__ = {"polymorphic_identity": None, "polymorphic_on": habit_type}
 
-    def to_dict(self):  # ty:ignore[invalid-method-override] #? Again, this is (probably) fine, why is there a type error?
-        return super().to_dict(rules=("-logs", "-options.habit"))
-
 
 class CompletionHabit(Habit):
     __tablename__ = "completion_habits"
 
     id: Mapped[int] = mapped_column(ForeignKey("habits.id"), primary_key=True)
     completion_target: Mapped[int] = mapped_column()
-    target_timeframe: Mapped[Timeframe] = mapped_column(SQLEnum(Timeframe))
+    target_timeframe: Mapped[Timeframe] = mapped_column(TIMEFRAME)
 
     __mapper_args__ = {"polymorphic_identity": HabitType.COMPLETION}
 
@@ -60,8 +130,8 @@ class MeasureableHabit(Habit):
     __tablename__ = "measureable_habits"
 
     id: Mapped[int] = mapped_column(ForeignKey("habits.id"), primary_key=True)
-    target: Mapped[int] = mapped_column()
-    completion_target: Mapped[Timeframe] = mapped_column(SQLEnum(Timeframe))
+    target: Mapped[int] = mapped_column(AMOUNT)
+    completion_target: Mapped[Timeframe] = mapped_column(TIMEFRAME)
     unit: Mapped[str] = mapped_column(String(50))
 
     __mapper_args__ = {"polymorphic_identity": HabitType.MEASURABLE}
@@ -72,7 +142,7 @@ class ChoiceOption(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     habit_id: Mapped[int] = mapped_column(
-        ForeignKey("choice_habits.id", ondelete="CASCADE"), nullable=False
+        ForeignKey("choice_habits.id", ondelete="CASCADE"), nullable=False, index=True
     )
 
     habit: Mapped["ChoiceHabit"] = relationship(back_populates="options")
@@ -81,9 +151,6 @@ class ChoiceOption(Base):
     color: Mapped[str] = mapped_column(String(20), nullable=True)
     icon: Mapped[str] = mapped_column(String(50), nullable=True)
 
-    def to_dict(self):  # ty:ignore[invalid-method-override]
-        return super().to_dict(rules=("-habit",))
-
 
 class ChoiceHabit(Habit):
     __tablename__ = "choice_habits"
@@ -94,10 +161,14 @@ class ChoiceHabit(Habit):
         cascade="all, delete-orphan",
     )
 
+    __serialize__ = ("options",)
     __mapper_args__ = {"polymorphic_identity": HabitType.CHOICE}
 
 
-class LogEntry(Base):
+CLIENT_ID_LENGTH = 64
+
+
+class LogEntry(Owned, Base):
     __tablename__ = "habit_logs"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -106,16 +177,32 @@ class LogEntry(Base):
     )
     habit: Mapped[Habit] = relationship(back_populates="logs")
     timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=False)
-    habit_type: Mapped[HabitType] = mapped_column(SQLEnum(HabitType), nullable=False)
-
+    habit_type: Mapped[HabitType] = mapped_column(HABIT_TYPE, nullable=False)
+    # Key chosen by the client (or its Idempotency-Key header), so a retried write isn't logged twice
+    client_id: Mapped[str | None] = mapped_column(String(CLIENT_ID_LENGTH))
+
+    __table_args__ = (
+        # Per-habit reads and keyset pagination on (habit_id, timestamp, id) are served straight from this index
+        Index("ix_habit_logs_habit_id_timestamp", "habit_id", "timestamp", "id"),
+        # Date range reads across every habit. BRIN on PostgreSQL, logs arrive in roughly
+        # timestamp order so a summary per block range is a fraction of a B-tree's size.
+        Index("ix_habit_logs_timestamp", "timestamp", postgresql_using="brin"),
+        # The same for one user, logs carry their habit's user_id so this needs no join
+        Index("ix_habit_logs_user_id_timestamp", "user_id", "timestamp"),
+        # NULLs never conflict, so logs without a client id aren't affected. On PostgreSQL they
+        # aren't indexed at all.
+        Index(
+            "ux_habit_logs_habit_id_client_id",
+            "habit_id",
+            "client_id",
+            unique=True,
+            postgresql_where=text("client_id IS NOT NULL"),
+        ),
+        # Ids of deleted rows are never handed out again, logs moved to an archive keep theirs
+        {"sqlite_autoincrement": True},
+    )
     __mapper_args__ = {"polymorphic_identity": None, "polymorphic_on": habit_type}
 
-    def to_dict(self):  # ty:ignore[invalid-method-override] #? ditto
-        base_dict = super().to_dict(rules=("-habit", "-option.habit"))
-        # if self.habit_type == HabitType.CHOICE:
-        #     base_dict["option"] = self.option.to_dict()
-        return base_dict
-
 
 class CompletionLogEntry(LogEntry):
     __tablename__ = "completion_logs"
@@ -130,7 +217,7 @@ class MeasureableLogEntry(LogEntry):
     __tablename__ = "measureable_logs"
 
     id: Mapped[int] = mapped_column(ForeignKey("habit_logs.id"), primary_key=True)
-    value: Mapped[int] = mapped_column()
+    value: Mapped[int] = mapped_column(AMOUNT)
 
     __mapper_args__ = {"polymorphic_identity": HabitType.MEASURABLE}
 
@@ -141,14 +228,99 @@ class ChoiceLogEntry(LogEntry):
     id: Mapped[int] = mapped_column(ForeignKey("habit_logs.id"), primary_key=True)
 
     option_id: Mapped[int] = mapped_column(
-        ForeignKey("choice_options.id"), nullable=False
+        ForeignKey("choice_options.id"), nullable=False, index=True
     )
     option: Mapped[ChoiceOption] = relationship()
 
+    __serialize__ = ("option",)
     __mapper_args__ = {"polymorphic_identity": HabitType.CHOICE}
 
 
-def get_engine() -> sqlalchemy.engine.Engine:
-    engine = create_engine("sqlite:///habits.db", echo=True)
-    Base.metadata.create_all(engine)
+class PeriodRollup(Base):
+    """
+    Aggregate of a habit's logs over one day, week or month, kept up to date by the log write paths.
+    Amounts are 1 per completed log, the value of measurable logs and 1 per choice log,
+    so `total` is the progress towards the habit's target.
+    """
+
+    __tablename__ = "period_rollups"
+
+    habit_id: Mapped[int] = mapped_column(
+        ForeignKey("habits.id", ondelete="CASCADE"), primary_key=True
+    )
+    timeframe: Mapped[Timeframe] = mapped_column(TIMEFRAME, primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
+    total: Mapped[int] = mapped_column(AMOUNT, default=0)
+    min_value: Mapped[int | None] = mapped_column(AMOUNT, nullable=True)
+    max_value: Mapped[int | None] = mapped_column(AMOUNT, nullable=True)
+
+
+class HabitStats(Base):
+    """
+    Streak summary of a habit, so reading stats doesn't need to replay its history.
+    """
+
+    __tablename__ = "habit_stats"
+
+    habit_id: Mapped[int] = mapped_column(
+        ForeignKey("habits.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_logs: Mapped[int] = mapped_column(default=0)
+    periods_met: Mapped[int] = mapped_column(default=0)
+    best_streak: Mapped[int] = mapped_column(default=0)
+    # The most recent run of consecutive periods that met the target
+    last_run_end: Mapped[date | None] = mapped_column(Date, nullable=True)
+    last_run_length: Mapped[int] = mapped_column(default=0)
+
+
+class HabitVersion(Base):
+    """
+    Version of a habit's definition, options and logs, bumped by every write touching them.
+    Rows outlive their habit, so a deleted habit never serves a stale 304.
+    """
+
+    __tablename__ = "habit_versions"
+
+    habit_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+class SyncChange(Owned, Base):
+    """
+    Latest change to each habit and log entry, for delta syncs. Deleted rows stay as tombstones.
+    Option changes are tracked as changes of their habit, which carries its options.
+    """
+
+    __tablename__ = "sync_changes"
+
+    # Part of the key, ids reused by SQLite must not clash with another user's tombstones
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        default=DEFAULT_USER_ID,
+    )
+    kind: Mapped[ChangeKind] = mapped_column(SQLEnum(ChangeKind), primary_key=True)
+    entity_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    habit_id: Mapped[int] = mapped_column(index=True)
+    # Global version (see HabitVersion) of the change
+    seq: Mapped[int] = mapped_column(index=True)
+    deleted: Mapped[bool] = mapped_column(default=False)
+
+    __table_args__ = (Index("ix_sync_changes_user_id_seq", "user_id", "seq"),)
+
+
+def get_engine(settings: DatabaseSettings | None = None) -> sqlalchemy.engine.Engine:
+    # Imported here since migrations depends on this module
+    from migrations import migrate
+
+    engine = database.create_engine(settings or DatabaseSettings.from_env())
+    migrate(engine)
     return engine
+
+
+def get_async_engine(settings: DatabaseSettings | None = None) -> AsyncEngine:
+    """
+    Async engine on the same database as `get_engine`, which has to be called first to migrate it.
+    """
+    return database.create_async_engine(settings or DatabaseSettings.from_env())
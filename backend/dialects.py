@@ -0,0 +1,126 @@
+"""
+The parts of the write paths that differ between SQLite and PostgreSQL.
+
+SQLite is the default, PostgreSQL (e.g. `HABITS_DATABASE_URL=postgresql+psycopg2://...`) can
+serve as the production store. Everything else goes through SQLAlchemy unchanged, this module
+holds what is worth doing differently:
+
+- `insert` is the dialect's own INSERT, so counters and change markers are single-statement
+  `ON CONFLICT DO UPDATE` upserts instead of a read and a write (which would also race between
+  PostgreSQL's concurrent writers, where SQLite has only one).
+- `insert_logs` inserts large batches on PostgreSQL with `COPY`, after taking their ids from the
+  sequence in one query. Smaller batches, and SQLite, use an executemany with RETURNING, which
+  SQLAlchemy sends as multi-row INSERTs.
+- `sync_sequence` moves a PostgreSQL sequence past rows inserted with explicit ids.
+"""
+
+import io
+from collections.abc import Sequence
+
+import sqlalchemy
+from sqlalchemy import Connection, Table, func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import db_models as d
+
+# Below this many rows a COPY saves less than its extra round trips cost
+COPY_MIN_ROWS = 1000
+
+INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def insert(session: Session, table: Table):
+    """
+    INSERT of the session's dialect, which supports `on_conflict_do_update`.
+    """
+    return INSERTS[session.get_bind().dialect.name](table)
+
+
+def supports_copy(session: Session) -> bool:
+    dialect = session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def copy_value(value: object) -> str:
+    # COPY's text format: tab separated, \N for NULL, backslash escapes
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(session: Session, table: Table, rows: Sequence[dict]):
+    columns = [table.c[key] for key in rows[0]]
+    # The same conversions (enum members to their names, ...) as for bound parameters
+    dialect = session.get_bind().dialect
+    processors = [column.type.bind_processor(dialect) for column in columns]
+    buffer = io.StringIO()
+    for row in rows:
+        values = (
+            row[column.key] if process is None else process(row[column.key])
+            for column, process in zip(columns, processors)
+        )
+        buffer.write("\t".join(map(copy_value, values)) + "\n")
+    buffer.seek(0)
+
+    names = ", ".join(column.name for column in columns)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({names}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def insert_logs(
+    session: Session, entity: type[d.LogEntry], rows: Sequence[dict]
+) -> list[int]:
+    """
+    Insert log entries of one type from dicts of their columns, returns their ids in order.
+    """
+    if len(rows) < COPY_MIN_ROWS or not supports_copy(session):
+        query = sqlalchemy.insert(entity).returning(
+            entity.id, sort_by_parameter_order=True
+        )
+        return list(session.scalars(query, rows))
+
+    logs = d.LogEntry.__table__
+    entries = entity.__table__
+    sequence = func.pg_get_serial_sequence(logs.name, "id")
+    ids = session.scalars(
+        select(func.nextval(sequence)).select_from(func.generate_series(1, len(rows)))
+    ).all()
+    copy_rows(
+        session,
+        logs,
+        [
+            {"id": id} | {key: value for key, value in row.items() if key in logs.c}
+            for id, row in zip(ids, rows)
+        ],
+    )
+    copy_rows(
+        session,
+        entries,
+        [
+            {"id": id} | {key: value for key, value in row.items() if key in entries.c}
+            for id, row in zip(ids, rows)
+        ],
+    )
+    return list(ids)
+
+
+def sync_sequence(conn: Connection, table: Table):
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 1)) FROM {table.name}"
+            )
+        )
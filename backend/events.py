@@ -0,0 +1,120 @@
+"""
+In-process pub/sub for change events, streamed to clients as Server-Sent Events.
+
+Every subscriber gets its own bounded queue. Publishing never blocks a write: a subscriber that
+falls `QUEUE_SIZE` events behind is dropped and told to `reset`, i.e. re-fetch what it shows and
+subscribe again. Events only reach subscribers of the same process and user.
+"""
+
+import asyncio
+import json
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+import db_models as d
+
+QUEUE_SIZE = 256
+KEEPALIVE_SECONDS = 15
+
+# Sent instead of the next event when a subscriber couldn't keep up
+RESET = {"kind": "reset"}
+
+
+class Subscriber:
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        habit_id: int | None = None,
+        user_id: int = d.DEFAULT_USER_ID,
+    ):
+        self.loop = loop
+        self.habit_id = habit_id
+        self.user_id = user_id
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        return self.habit_id is None or event.get("habit_id") == self.habit_id
+
+    def deliver(self, event: dict):
+        # Runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # The client re-fetches anyway, so what's still queued is of no use
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESET)
+
+
+class Broker:
+    def __init__(self):
+        self.subscribers: set[Subscriber] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(
+        self, habit_id: int | None = None, user_id: int = d.DEFAULT_USER_ID
+    ) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), habit_id, user_id)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, events: list[dict], user_id: int = d.DEFAULT_USER_ID):
+        """
+        Hand events of `user_id` to every interested subscriber of theirs, callable from any thread.
+        """
+        with self.lock:
+            subscribers = [s for s in self.subscribers if s.user_id == user_id]
+        for subscriber in subscribers:
+            for event in events:
+                if subscriber.wants(event):
+                    try:
+                        subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+                    except RuntimeError:  # The subscriber's loop is gone
+                        self.unsubscribe(subscriber)
+                        break
+
+
+broker = Broker()
+
+
+def encode(event: dict) -> str:
+    lines = [f"event: {event['kind']}"]
+    if "version" in event:
+        lines.insert(0, f"id: {event['version']}")
+    lines.append(f"data: {json.dumps(event, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream(
+    subscriber: Subscriber, disconnected: Callable[[], Awaitable[bool]]
+) -> AsyncIterator[str]:
+    """
+    SSE stream of a subscriber's events, with a comment every `KEEPALIVE_SECONDS` so proxies keep
+    the connection open. Ends when the client disconnects or the subscriber is reset.
+    """
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscriber.queue.get(), KEEPALIVE_SECONDS
+                )
+            except TimeoutError:
+                if await disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
+            yield encode(event)
+            if event is RESET:
+                return
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,194 @@
+"""
+Streaming export of every habit, choice option and log entry.
+
+Rows are read with plain column queries in batches of `BATCH_SIZE` (no ORM objects, no `to_dict`)
+and encoded as they arrive, so memory use doesn't depend on the size of the database. Only the
+rows of the session's user are exported, archived logs (see `partitions`) before the others.
+"""
+
+import csv
+import io
+import json
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from enum import StrEnum
+from itertools import batched
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import ownership
+import partitions
+import serializers
+
+BATCH_SIZE = 1000
+
+# Fields of every record kind, in the order they show up in CSV exports
+CSV_FIELDS = [
+    "kind",
+    "id",
+    "habit_id",
+    "name",
+    "habit_type",
+    "completion_target",
+    "target_timeframe",
+    "target",
+    "unit",
+    "option_text",
+    "color",
+    "icon",
+    "timestamp",
+    "status",
+    "value",
+    "option_id",
+]
+
+
+class ExportFormat(StrEnum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+def habit_records(session: Session) -> Iterator[dict]:
+    habits = d.Habit.__table__
+    completion = d.CompletionHabit.__table__
+    measurable = d.MeasureableHabit.__table__
+    query = (
+        select(
+            habits.c.id,
+            habits.c.name,
+            habits.c.habit_type,
+            completion.c.completion_target,
+            completion.c.target_timeframe,
+            measurable.c.target,
+            measurable.c.completion_target.label("measurable_timeframe"),
+            measurable.c.unit,
+        )
+        .select_from(
+            habits.outerjoin(completion, completion.c.id == habits.c.id).outerjoin(
+                measurable, measurable.c.id == habits.c.id
+            )
+        )
+        .where(habits.c.user_id == ownership.user_id(session))
+        .order_by(habits.c.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for row in session.execute(query):
+        record = {
+            "kind": "habit",
+            "id": row.id,
+            "name": row.name,
+            "habit_type": row.habit_type,
+        }
+        if row.habit_type == d.HabitType.COMPLETION:
+            record |= {
+                "completion_target": row.completion_target,
+                "target_timeframe": row.target_timeframe,
+            }
+        elif row.habit_type == d.HabitType.MEASURABLE:
+            record |= {
+                "target": row.target,
+                "completion_target": row.measurable_timeframe,
+                "unit": row.unit,
+            }
+        yield record
+
+
+def option_records(session: Session) -> Iterator[dict]:
+    options = d.ChoiceOption.__table__
+    habits = d.Habit.__table__
+    query = (
+        select(options)
+        .where(
+            options.c.habit_id.in_(
+                select(habits.c.id).where(
+                    habits.c.user_id == ownership.user_id(session)
+                )
+            )
+        )
+        .order_by(options.c.habit_id, options.c.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for row in session.execute(query):
+        yield {"kind": "option", **row._asdict()}
+
+
+def log_records(session: Session) -> Iterator[dict]:
+    logs = d.LogEntry.__table__
+    completion = d.CompletionLogEntry.__table__
+    measurable = d.MeasureableLogEntry.__table__
+    choice = d.ChoiceLogEntry.__table__
+    query = (
+        select(
+            logs,
+            completion.c.status,
+            measurable.c.value,
+            choice.c.option_id,
+        )
+        .select_from(
+            logs.outerjoin(completion, completion.c.id == logs.c.id)
+            .outerjoin(measurable, measurable.c.id == logs.c.id)
+            .outerjoin(choice, choice.c.id == logs.c.id)
+        )
+        .where(logs.c.user_id == ownership.user_id(session))
+        # Walks the (habit_id, timestamp, id) index instead of sorting the whole table
+        .order_by(logs.c.habit_id, logs.c.timestamp, logs.c.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    fields = {
+        d.HabitType.COMPLETION: "status",
+        d.HabitType.MEASURABLE: "value",
+        d.HabitType.CHOICE: "option_id",
+    }
+    for row in session.execute(query):
+        field = fields[row.habit_type]
+        yield {
+            "kind": "log",
+            "id": row.id,
+            "habit_id": row.habit_id,
+            "timestamp": serializers.format_datetime(row.timestamp),
+            "habit_type": row.habit_type,
+            field: getattr(row, field),
+        }
+
+
+def records(session: Session) -> Iterator[dict]:
+    yield from habit_records(session)
+    yield from option_records(session)
+    for archive in partitions.archives(session):
+        yield from log_records(archive)
+    yield from log_records(session)
+
+
+def encode_ndjson(batch: tuple[dict, ...]) -> str:
+    return "".join(json.dumps(record) + "\n" for record in batch)
+
+
+def stream(db: Callable[[], Session], format: ExportFormat) -> Iterator[str]:
+    """
+    Encoded export, one chunk per batch of records. The session lives as long as the stream does.
+    """
+    with db() as session:
+        if format == ExportFormat.CSV:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, CSV_FIELDS)
+
+            def drain() -> str:
+                chunk = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                return chunk
+
+            writer.writeheader()
+            yield drain()
+            for batch in batched(records(session), BATCH_SIZE):
+                writer.writerows(batch)
+                yield drain()
+        else:
+            for batch in batched(records(session), BATCH_SIZE):
+                yield encode_ndjson(batch)
+
+
+def filename(format: ExportFormat, now: datetime) -> str:
+    return f"habits-{now:%Y%m%d-%H%M%S}.{format}"
@@ -0,0 +1,138 @@
+"""
+Per-day calendar grid of every habit, in compact encodings.
+
+One grouped query over the logs in range gives a row per habit, day (and option, for choice
+habits), which is packed into one base64 string per habit:
+
+- completion habits: a bitset, bit `i` (least significant first) set when day `i` has a completed log
+- measurable habits: little-endian int64s, the sum of the values logged on each day, which can
+  outgrow 32 bits like the values themselves
+- choice habits: little-endian int32s, the option logged last on each day (0 for none)
+"""
+
+import base64
+import struct
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import BigInteger, Date, Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+import cache
+import db_models as d
+import ownership
+import partitions
+
+# About 5 years, so a single request stays small
+MAX_DAYS = 5 * 366
+
+ENCODINGS = {
+    d.HabitType.COMPLETION: "bitset",
+    d.HabitType.MEASURABLE: "int64",
+    d.HabitType.CHOICE: "int32",
+}
+
+
+def encode_bitset(days: int, set_days: set[int]) -> str:
+    bits = bytearray((days + 7) // 8)
+    for day in set_days:
+        bits[day // 8] |= 1 << (day % 8)
+    return base64.b64encode(bits).decode()
+
+
+def encode_int32(values: list[int]) -> str:
+    return base64.b64encode(struct.pack(f"<{len(values)}i", *values)).decode()
+
+
+def encode_int64(values: list[int]) -> str:
+    return base64.b64encode(struct.pack(f"<{len(values)}q", *values)).decode()
+
+
+def day_query(start: date, end: date, user_id: int):
+    logs = d.LogEntry.__table__
+    completion = d.CompletionLogEntry.__table__
+    measurable = d.MeasureableLogEntry.__table__
+    choice = d.ChoiceLogEntry.__table__
+    day = func.date(logs.c.timestamp, type_=Date)
+    return (
+        select(
+            logs.c.habit_id,
+            day.label("day"),
+            choice.c.option_id,
+            # PostgreSQL has no max() of booleans
+            func.max(cast(completion.c.status, Integer)).label("completed"),
+            # PostgreSQL sums BIGINTs into NUMERICs
+            cast(func.coalesce(func.sum(measurable.c.value), 0), BigInteger).label(
+                "total"
+            ),
+            func.max(logs.c.timestamp).label("last_logged"),
+        )
+        .select_from(
+            logs.outerjoin(completion, completion.c.id == logs.c.id)
+            .outerjoin(measurable, measurable.c.id == logs.c.id)
+            .outerjoin(choice, choice.c.id == logs.c.id)
+        )
+        # Range on the raw column so the (user_id, timestamp) index is used
+        .where(
+            logs.c.user_id == user_id,
+            logs.c.timestamp >= datetime.combine(start, time.min),
+            logs.c.timestamp < datetime.combine(end + timedelta(days=1), time.min),
+        )
+        .group_by(logs.c.habit_id, day, choice.c.option_id)
+    )
+
+
+def build(session: Session, start: date, end: date) -> dict:
+    """
+    Heatmap of every habit for the days from `start` to `end`, both included.
+    """
+    days = (end - start).days + 1
+    completed: dict[int, set[int]] = {}
+    totals: dict[int, list[int]] = {}
+    # Per habit and day, the option logged last and when
+    choices: dict[int, dict[int, tuple[datetime, int]]] = {}
+
+    query = day_query(start, end, ownership.user_id(session))
+    since = datetime.combine(start, time.min)
+    until = datetime.combine(end + timedelta(days=1), time.min)
+    # ? Rows of the same habit and day from an archive and the main database add up like any others
+    rows = partitions.read(
+        session, since, until, lambda archive: archive.execute(query).all()
+    )
+    for row in [*rows, *session.execute(query)]:
+        index = (row.day - start).days
+        if row.option_id is not None:
+            latest = choices.setdefault(row.habit_id, {}).get(index)
+            if latest is None or row.last_logged > latest[0]:
+                choices[row.habit_id][index] = (row.last_logged, row.option_id)
+        elif row.completed is not None:
+            if row.completed:
+                completed.setdefault(row.habit_id, set()).add(index)
+        else:
+            totals.setdefault(row.habit_id, [0] * days)[index] += row.total
+
+    habits = []
+    for habit in cache.list_habits(session):
+        habit_id, habit_type = habit["id"], habit["habit_type"]
+        if habit_type == d.HabitType.COMPLETION:
+            data = encode_bitset(days, completed.get(habit_id, set()))
+        elif habit_type == d.HabitType.MEASURABLE:
+            data = encode_int64(totals.get(habit_id, [0] * days))
+        else:
+            by_day = choices.get(habit_id, {})
+            data = encode_int32(
+                [by_day[i][1] if i in by_day else 0 for i in range(days)]
+            )
+        habits.append(
+            {
+                "habit_id": habit_id,
+                "habit_type": habit_type,
+                "encoding": ENCODINGS[habit_type],
+                "data": data,
+            }
+        )
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "days": days,
+        "habits": habits,
+    }
@@ -0,0 +1,67 @@
+"""
+Making log writes safe to retry.
+
+A log can carry a client id (its `client_id` field or the request's `Idempotency-Key` header),
+unique per habit, so logging it again finds the entry from the first attempt instead of adding
+a duplicate. Completion habits can also be logged as an upsert on `(habit_id, day)`, which
+updates the day's completion log if there already is one.
+"""
+
+from collections.abc import Iterable
+from datetime import date, datetime, time, timedelta
+from itertools import batched
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import db_models as d
+
+# Client ids per IN (...) when looking up many at once
+ID_BATCH_SIZE = 500
+
+
+def find_logged(session: Session, habit_id: int, client_id: str) -> int | None:
+    return session.scalar(
+        select(d.LogEntry.id).where(
+            d.LogEntry.habit_id == habit_id, d.LogEntry.client_id == client_id
+        )
+    )
+
+
+def logged_client_ids(
+    session: Session, keys: Iterable[tuple[int, str]]
+) -> set[tuple[int, str]]:
+    """
+    The `(habit_id, client_id)` pairs among `keys` that are already logged.
+    """
+    keys = set(keys)
+    logged = set()
+    for batch in batched({client_id for _, client_id in keys}, ID_BATCH_SIZE):
+        rows = session.execute(
+            select(d.LogEntry.habit_id, d.LogEntry.client_id).where(
+                d.LogEntry.client_id.in_(batch)
+            )
+        )
+        logged |= {(habit_id, client_id) for habit_id, client_id in rows}
+    return logged & keys
+
+
+def completion_on_day(
+    session: Session, habit_id: int, day: date
+) -> d.CompletionLogEntry | None:
+    """
+    The first completion log of `habit_id` on `day`, found with a range on the (habit_id, timestamp) index.
+    Nothing makes `(habit_id, day)` unique, so an upsert takes `stats.lock_habits` first, or two
+    concurrent ones could both find nothing and both insert.
+    """
+    start = datetime.combine(day, time.min)
+    return session.scalars(
+        select(d.CompletionLogEntry)
+        .where(
+            d.CompletionLogEntry.habit_id == habit_id,
+            d.CompletionLogEntry.timestamp >= start,
+            d.CompletionLogEntry.timestamp < start + timedelta(days=1),
+        )
+        .order_by(d.CompletionLogEntry.timestamp, d.CompletionLogEntry.id)
+        .limit(1)
+    ).first()
@@ -0,0 +1,109 @@
+"""
+Maintenance commands for an existing database, e.g. `python manage.py rebuild-rollups`.
+"""
+
+import argparse
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import auth
+import db_models as d
+import partitions
+import stats
+
+
+def rebuild_rollups(session: Session, habit_id: int | None = None) -> int:
+    query = select(d.Habit)
+    if habit_id is not None:
+        query = query.where(d.Habit.id == habit_id)
+
+    rebuilt = 0
+    for habit in session.scalars(query):
+        stats.rebuild(session, habit)
+        rebuilt += 1
+    session.commit()
+    return rebuilt
+
+
+def create_user(session: Session, name: str) -> tuple[d.User, str]:
+    user = auth.create_user(session, name)
+    token = auth.create_token(session, user.id)
+    session.commit()
+    return user, token
+
+
+def create_token(session: Session, user_id: int) -> str | None:
+    if session.get(d.User, user_id) is None:
+        return None
+    token = auth.create_token(session, user_id)
+    session.commit()
+    return token
+
+
+def compact(session: Session, before: int, vacuum: bool = False) -> dict[int, int]:
+    moved = partitions.compact(session, before)
+    if vacuum:
+        # Deleted rows only free pages for reuse, VACUUM gives them back to the file system
+        with session.get_bind().engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql(
+                "VACUUM"
+            )
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser(
+        "rebuild-rollups", help="Recompute rollups and stats from the logs"
+    )
+    rebuild.add_argument("--habit", type=int, help="Only rebuild this habit")
+
+    user = commands.add_parser("create-user", help="Add a user and print their token")
+    user.add_argument("name")
+
+    token = commands.add_parser(
+        "create-token", help="Print a new token for an existing user"
+    )
+    token.add_argument("--user", type=int, required=True)
+
+    archive = commands.add_parser(
+        "compact", help="Move old logs to per-year archive databases"
+    )
+    archive.add_argument(
+        "--before",
+        type=int,
+        required=True,
+        help="Archive the logs of the years before this one",
+    )
+    archive.add_argument(
+        "--vacuum", action="store_true", help="Shrink the database file afterwards"
+    )
+
+    args = parser.parse_args()
+    with Session(d.get_engine()) as session:
+        if args.command == "rebuild-rollups":
+            rebuilt = rebuild_rollups(session, args.habit)
+            print(f"Rebuilt rollups for {rebuilt} habit(s)")
+        elif args.command == "create-user":
+            user, token = create_user(session, args.name)
+            print(f"Created user {user.id}, token (shown only once): {token}")
+        elif args.command == "create-token":
+            token = create_token(session, args.user)
+            if token is None:
+                parser.error(f"User {args.user} not found")
+            print(f"Token (shown only once): {token}")
+        elif args.command == "compact":
+            try:
+                moved = compact(session, args.before, args.vacuum)
+            except ValueError as e:
+                parser.error(str(e))
+            for year, count in moved.items():
+                print(f"Archived {count} log(s) from {year}")
+            print(f"Archived {sum(moved.values())} log(s) in total")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Opt-in request metrics, exposed in the Prometheus text format at GET /metrics.
+
+`MetricsMiddleware` is always installed but does nothing until `enable` is called (see
+`HABITS_METRICS` in app.py). Once enabled, every request records:
+
+- its latency, in a histogram per method, route template and status
+- how many SQL statements it ran and how long they took, from the engine's cursor events
+- how long it spent serializing rows with `to_dict`
+
+Responses also get a `Server-Timing` header with the same numbers. With a `profile_dir`, a
+request sent with `X-Profile: 1` additionally gets a JSON dump of every statement it ran, with
+its duration, written to that directory.
+"""
+
+import json
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import Engine, event
+
+import structured_logging
+
+# Seconds, close to the Prometheus client defaults
+# fmt: off
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# fmt: on
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+PROFILE_HEADER = b"x-profile"
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    sql_seconds: float = 0.0
+    serialize_seconds: float = 0.0
+    # Only collected for requests being profiled
+    statements: list[dict] | None = None
+
+
+# Stats of the request being handled. Endpoints run in the threadpool with a copy of the context,
+# which still refers to the same RequestStats object.
+current_request: ContextVar[RequestStats | None] = ContextVar(
+    "current_request", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Counts are per bucket here, the exposition format wants them cumulative
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+@dataclass
+class RouteMetrics:
+    latency: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    queries: Histogram = field(default_factory=lambda: Histogram(QUERY_BUCKETS))
+    sql_seconds: float = 0.0
+    serialize_seconds: float = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.profile_dir: Path | None = None
+        # Keyed by (method, route template, status)
+        self.routes: dict[tuple[str, str, int], RouteMetrics] = {}
+
+    def record(
+        self, method: str, route: str, status: int, seconds: float, stats: RequestStats
+    ):
+        with self.lock:
+            metrics = self.routes.get((method, route, status))
+            if metrics is None:
+                metrics = self.routes[method, route, status] = RouteMetrics()
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(stats.queries)
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.serialize_seconds += stats.serialize_seconds
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self, cache_stats: dict) -> str:
+        """
+        Everything recorded, plus the counters of the habit cache, in the Prometheus text format.
+        """
+        with self.lock:
+            routes = sorted(self.routes.items())
+
+        def labels(method: str, route: str, status: int) -> str:
+            return f'method="{method}",route="{route}",status="{status}"'
+
+        def section(name: str, kind: str, help: str, samples: list[str]) -> list[str]:
+            return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", *samples]
+
+        lines = section(
+            "habits_request_duration_seconds",
+            "histogram",
+            "Request latency",
+            [
+                line
+                for key, metrics in routes
+                for line in metrics.latency.lines(
+                    "habits_request_duration_seconds", labels(*key)
+                )
+            ],
+        )
+        lines += section(
+            "habits_request_sql_queries",
+            "histogram",
+            "SQL statements per request",
+            [
+                line
+                for key, metrics in routes
+                for line in metrics.queries.lines(
+                    "habits_request_sql_queries", labels(*key)
+                )
+            ],
+        )
+        lines += section(
+            "habits_request_sql_seconds_total",
+            "counter",
+            "Time spent running SQL statements",
+            [
+                f"habits_request_sql_seconds_total{{{labels(*key)}}} {metrics.sql_seconds:.6f}"
+                for key, metrics in routes
+            ],
+        )
+        lines += section(
+            "habits_request_serialize_seconds_total",
+            "counter",
+            "Time spent serializing rows with to_dict",
+            [
+                f"habits_request_serialize_seconds_total{{{labels(*key)}}} {metrics.serialize_seconds:.6f}"
+                for key, metrics in routes
+            ],
+        )
+        lines += section(
+            "habits_cache_hits_total",
+            "counter",
+            "Habit cache hits",
+            [f"habits_cache_hits_total {cache_stats['hits']}"],
+        )
+        lines += section(
+            "habits_cache_misses_total",
+            "counter",
+            "Habit cache misses",
+            [f"habits_cache_misses_total {cache_stats['misses']}"],
+        )
+        lines += section(
+            "habits_cache_entries",
+            "gauge",
+            "Entries in the habit cache",
+            [f"habits_cache_entries {cache_stats['entries']}"],
+        )
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    stats = current_request.get()
+    # Statements already running when metrics got enabled have no start
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    if stats.statements is not None:
+        stats.statements.append(
+            {"statement": statement, "ms": round(elapsed * 1000, 3)}
+        )
+
+
+def enable(engine: Engine, profile_dir: Path | None = None):
+    """
+    Start recording requests, with the SQL statements run on `engine`.
+    """
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    registry.profile_dir = profile_dir
+    registry.enabled = True
+
+
+def disable(engine: Engine):
+    if event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", after_cursor_execute)
+    registry.enabled = False
+    registry.profile_dir = None
+
+
+def server_timing(stats: RequestStats, seconds: float) -> bytes:
+    return (
+        f'sql;dur={stats.sql_seconds * 1000:.3f};desc="{stats.queries} queries", '
+        f"serialize;dur={stats.serialize_seconds * 1000:.3f}, "
+        f"total;dur={seconds * 1000:.3f}"
+    ).encode()
+
+
+def write_profile(
+    directory: Path,
+    method: str,
+    path: str,
+    route: str,
+    status: int,
+    seconds: float,
+    stats: RequestStats,
+) -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now()
+    name = (
+        route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    )
+    file = directory / f"{now:%Y%m%dT%H%M%S%f}-{method}-{name}.json"
+    file.write_text(
+        json.dumps(
+            {
+                "time": now.isoformat(),
+                "request_id": structured_logging.request_id.get(),
+                "method": method,
+                "path": path,
+                "route": route,
+                "status": status,
+                "ms": round(seconds * 1000, 3),
+                "sql_ms": round(stats.sql_seconds * 1000, 3),
+                "serialize_ms": round(stats.serialize_seconds * 1000, 3),
+                "queries": stats.statements,
+            },
+            indent=2,
+        )
+    )
+    return file
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware, so streamed responses (like /events) pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not registry.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile_dir = (
+            registry.profile_dir if (PROFILE_HEADER, b"1") in scope["headers"] else None
+        )
+        stats = RequestStats(statements=[] if profile_dir is not None else None)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (
+                        b"server-timing",
+                        server_timing(stats, time.perf_counter() - start),
+                    )
+                )
+                message = message | {"headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            seconds = time.perf_counter() - start
+            # The template, so ids in the path don't make a series each
+            route = getattr(scope.get("route"), "path", "unmatched")
+            registry.record(scope["method"], route, status, seconds, stats)
+            if profile_dir is not None:
+                write_profile(
+                    profile_dir,
+                    scope["method"],
+                    scope["path"],
+                    route,
+                    status,
+                    seconds,
+                    stats,
+                )
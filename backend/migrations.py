@@ -0,0 +1,261 @@
+"""
+Versioned schema migrations for existing databases.
+
+`Base.metadata.create_all` only creates tables that are missing, it never alters existing ones.
+Anything that changes an existing table (new indexes, new columns) gets a migration appended to
+`MIGRATIONS`, the applied version is stored in the `schema_version` table.
+"""
+
+from collections.abc import Callable
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    Engine,
+    Index,
+    Integer,
+    MetaData,
+    Table,
+    inspect,
+    select,
+    text,
+)
+
+import db_models as d
+import dialects
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, nullable=False),
+)
+
+
+def create_index(conn: Connection, name: str, table: str, *columns: str, **kwargs):
+    """
+    Create an index as it was when its migration was written. The models' own `Index` objects
+    can't be used, they describe the latest schema, which can name columns a database being
+    migrated doesn't have yet.
+    """
+    stub = Table(table, MetaData(), *(Column(column, Integer) for column in columns))
+    Index(name, *(stub.c[column] for column in columns), **kwargs).create(
+        conn, checkfirst=True
+    )
+
+
+def add_log_indexes(conn: Connection):
+    create_index(
+        conn,
+        "ix_habit_logs_habit_id_timestamp",
+        "habit_logs",
+        "habit_id",
+        "timestamp",
+        "id",
+    )
+    create_index(conn, "ix_habit_logs_timestamp", "habit_logs", "timestamp")
+    create_index(conn, "ix_choice_logs_option_id", "choice_logs", "option_id")
+    create_index(conn, "ix_choice_options_habit_id", "choice_options", "habit_id")
+
+
+def add_rollup_extremes(conn: Connection):
+    columns = {column["name"] for column in inspect(conn).get_columns("period_rollups")}
+    for name in ("min_value", "max_value"):
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE period_rollups ADD COLUMN {name} INTEGER"))
+    # Rollups used to be kept for the target timeframe only. Dropping the stats makes every habit
+    # rebuild its rollups from the logs the next time it's used (or through `manage.py rebuild-rollups`).
+    conn.execute(d.PeriodRollup.__table__.delete())
+    conn.execute(d.HabitStats.__table__.delete())
+
+
+def add_log_client_ids(conn: Connection):
+    columns = {column["name"] for column in inspect(conn).get_columns("habit_logs")}
+    if "client_id" not in columns:
+        conn.execute(
+            text(
+                f"ALTER TABLE habit_logs ADD COLUMN client_id VARCHAR({d.CLIENT_ID_LENGTH})"
+            )
+        )
+    create_index(
+        conn,
+        "ux_habit_logs_habit_id_client_id",
+        "habit_logs",
+        "habit_id",
+        "client_id",
+        unique=True,
+        postgresql_where=text("client_id IS NOT NULL"),
+    )
+
+
+def add_users(conn: Connection):
+    # The users and auth_tokens tables come from create_all, existing rows go to the default user.
+    # SQLite can't add a column with a REFERENCES clause while foreign keys are enforced, so the
+    # constraint only exists on databases created with it.
+    for name in ("habits", "habit_logs"):
+        columns = {column["name"] for column in inspect(conn).get_columns(name)}
+        if "user_id" not in columns:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {name} ADD COLUMN user_id INTEGER NOT NULL DEFAULT {d.DEFAULT_USER_ID}"
+                )
+            )
+    create_index(conn, "ix_habits_user_id", "habits", "user_id", "id")
+    create_index(
+        conn, "ix_habit_logs_user_id_timestamp", "habit_logs", "user_id", "timestamp"
+    )
+
+    # The user is part of the primary key of sync_changes, which means rebuilding the table
+    sync_changes = d.SyncChange.__table__
+    columns = [column["name"] for column in inspect(conn).get_columns("sync_changes")]
+    if "user_id" not in columns:
+        conn.execute(text("ALTER TABLE sync_changes RENAME TO sync_changes_old"))
+        for index in sync_changes.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        sync_changes.create(conn)
+        names = ", ".join(columns)
+        conn.execute(
+            text(
+                f"INSERT INTO sync_changes ({names}, user_id) "
+                f"SELECT {names}, {d.DEFAULT_USER_ID} FROM sync_changes_old"
+            )
+        )
+        conn.execute(text("DROP TABLE sync_changes_old"))
+
+
+def add_default_user(conn: Connection):
+    if (
+        conn.execute(select(d.User.id).where(d.User.id == d.DEFAULT_USER_ID)).first()
+        is None
+    ):
+        conn.execute(
+            d.User.__table__.insert().values(id=d.DEFAULT_USER_ID, name="default")
+        )
+        dialects.sync_sequence(conn, d.User.__table__)
+
+
+def add_log_autoincrement(conn: Connection):
+    # Plain rowids reuse the ids of the highest rows once they're deleted, e.g. by `manage.py
+    # compact`, and a new log would then share its id with an archived one. Only AUTOINCREMENT
+    # changes that, which SQLite can't add to an existing table, so it's rebuilt (`migrate` turns
+    # foreign keys off for this).
+    if conn.dialect.name != "sqlite":
+        return
+    sql = conn.execute(
+        text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'habit_logs'"
+        )
+    ).scalar_one()
+    if "AUTOINCREMENT" in sql:
+        return
+    conn.execute(
+        text(
+            "CREATE TABLE habit_logs_new ("
+            "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, "
+            "habit_id INTEGER NOT NULL REFERENCES habits (id) ON DELETE CASCADE, "
+            "timestamp DATETIME NOT NULL, "
+            "habit_type VARCHAR(10) NOT NULL, "
+            f"client_id VARCHAR({d.CLIENT_ID_LENGTH}), "
+            f"user_id INTEGER NOT NULL DEFAULT {d.DEFAULT_USER_ID} "
+            "REFERENCES users (id) ON DELETE CASCADE)"
+        )
+    )
+    columns = "id, habit_id, timestamp, habit_type, client_id, user_id"
+    conn.execute(
+        text(f"INSERT INTO habit_logs_new ({columns}) SELECT {columns} FROM habit_logs")
+    )
+    conn.execute(text("DROP TABLE habit_logs"))
+    conn.execute(text("ALTER TABLE habit_logs_new RENAME TO habit_logs"))
+    # The indexes went with the old table
+    create_index(
+        conn,
+        "ix_habit_logs_habit_id_timestamp",
+        "habit_logs",
+        "habit_id",
+        "timestamp",
+        "id",
+    )
+    create_index(conn, "ix_habit_logs_timestamp", "habit_logs", "timestamp")
+    create_index(
+        conn, "ix_habit_logs_user_id_timestamp", "habit_logs", "user_id", "timestamp"
+    )
+    create_index(
+        conn,
+        "ux_habit_logs_habit_id_client_id",
+        "habit_logs",
+        "habit_id",
+        "client_id",
+        unique=True,
+    )
+
+
+def widen_amounts(conn: Connection):
+    # SQLite's INTEGER already holds 64 bits
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column in (
+        ("measureable_habits", "target"),
+        ("measureable_logs", "value"),
+        ("period_rollups", "total"),
+        ("period_rollups", "min_value"),
+        ("period_rollups", "max_value"),
+    ):
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT"))
+
+
+# ! Append only, never reorder or remove entries since the position is the version number
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    add_log_indexes,
+    add_rollup_extremes,
+    add_log_client_ids,
+    add_users,
+    add_log_autoincrement,
+    widen_amounts,
+]
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(select(schema_version.c.version)).scalar_one_or_none() or 0
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Bring the database up to date and return the schema version it ended up at.
+    """
+    with engine.connect() as conn:
+        # Rebuilding a table others reference needs foreign keys off, which SQLite only allows
+        # outside of a transaction
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.commit()
+        try:
+            with conn.begin():
+                version = apply_migrations(conn)
+                if sqlite and conn.exec_driver_sql("PRAGMA foreign_key_check").first():
+                    raise RuntimeError("Migrating broke foreign key references")
+        finally:
+            if sqlite:
+                conn.exec_driver_sql(f"PRAGMA foreign_keys = {foreign_keys}")
+                conn.commit()
+        return version
+
+
+def apply_migrations(conn: Connection) -> int:
+    # A database without any tables gets the latest schema from create_all, so it has nothing to replay
+    fresh = not inspect(conn).has_table(d.Habit.__tablename__)
+
+    d.Base.metadata.create_all(conn)
+    metadata.create_all(conn)
+
+    version = len(MIGRATIONS) if fresh else current_version(conn)
+    for migration in MIGRATIONS[version:]:
+        migration(conn)
+    # Fresh databases need it too, it owns everything logged without a token
+    add_default_user(conn)
+
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert().values(version=len(MIGRATIONS)))
+    return len(MIGRATIONS)
@@ -0,0 +1,136 @@
+"""
+How often each option of a choice habit gets picked, and what tends to follow what.
+
+Frequencies come from one query grouping the logs by day and option, rolled up into the requested
+timeframe. Transitions count consecutive logs (in timestamp order) going from one option to the
+next, with NumPy over the whole sequence of option ids.
+"""
+
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import Date, func, select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import partitions
+import rollups
+
+
+def logs_in_range(query, since: datetime | None, until: datetime | None):
+    if since is not None:
+        query = query.where(d.ChoiceLogEntry.timestamp >= since)
+    if until is not None:
+        query = query.where(d.ChoiceLogEntry.timestamp < until)
+    return query
+
+
+def daily_counts(
+    session: Session,
+    habit_id: int,
+    since: datetime | None,
+    until: datetime | None,
+) -> list[tuple[date, int, int]]:
+    day = func.date(d.ChoiceLogEntry.timestamp, type_=Date)
+    query = (
+        select(day, d.ChoiceLogEntry.option_id, func.count())
+        .where(d.ChoiceLogEntry.habit_id == habit_id)
+        .group_by(day, d.ChoiceLogEntry.option_id)
+        .order_by(day)
+    )
+    query = logs_in_range(query, since, until)
+    rows = partitions.read(
+        session, since, until, lambda archive: archive.execute(query)
+    )
+    return [tuple(row) for row in [*rows, *session.execute(query)]]
+
+
+def option_sequence(
+    session: Session,
+    habit_id: int,
+    since: datetime | None,
+    until: datetime | None,
+) -> np.ndarray:
+    query = logs_in_range(
+        select(d.ChoiceLogEntry.option_id)
+        .where(d.ChoiceLogEntry.habit_id == habit_id)
+        .order_by(d.ChoiceLogEntry.timestamp, d.ChoiceLogEntry.id),
+        since,
+        until,
+    )
+    # Logs can be added to archived years later on, so archives are merged in by timestamp
+    timed = query.add_columns(d.ChoiceLogEntry.timestamp, d.ChoiceLogEntry.id)
+    archived = partitions.read(
+        session, since, until, lambda archive: archive.execute(timed).all()
+    )
+    if not archived:
+        return np.fromiter(session.scalars(query), dtype=np.int64)
+    hot = session.execute(timed).all()
+    rows = sorted([*archived, *hot], key=lambda row: (row[1], row[2]))
+    return np.array([row[0] for row in rows], dtype=np.int64)
+
+
+def transition_counts(sequence: np.ndarray, option_ids: list[int]) -> np.ndarray:
+    """
+    `counts[i, j]` is how many times a log of `option_ids[i]` was directly followed by one of
+    `option_ids[j]`.
+    """
+    size = len(option_ids)
+    if len(sequence) < 2:
+        return np.zeros((size, size), dtype=np.int64)
+    # option_ids is sorted, so searchsorted maps every id to its row/column
+    index = np.searchsorted(option_ids, sequence)
+    pairs = index[:-1] * size + index[1:]
+    return np.bincount(pairs, minlength=size * size).reshape(size, size)
+
+
+def summary(
+    session: Session,
+    habit: d.ChoiceHabit,
+    timeframe: d.Timeframe,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> dict:
+    days = daily_counts(session, habit.id, since, until)
+    sequence = option_sequence(session, habit.id, since, until)
+
+    texts = {option.id: option.option_text for option in habit.options}
+    option_ids = sorted(texts.keys() | {option_id for _, option_id, _ in days})
+    column = {option_id: i for i, option_id in enumerate(option_ids)}
+
+    totals = [0] * len(option_ids)
+    periods: dict[date, list[int]] = {}
+    for day, option_id, count in days:
+        start = rollups.period_start(day, timeframe)
+        periods.setdefault(start, [0] * len(option_ids))[column[option_id]] += count
+        totals[column[option_id]] += count
+    total = sum(totals)
+
+    counts = transition_counts(sequence, option_ids)
+    outgoing = counts.sum(axis=1, keepdims=True)
+    probabilities = np.divide(
+        counts, outgoing, out=np.zeros(counts.shape), where=outgoing > 0
+    )
+
+    return {
+        "habit_id": habit.id,
+        "timeframe": timeframe,
+        "options": [
+            {
+                "id": option_id,
+                "option_text": texts.get(option_id),
+                "count": count,
+                "share": round(count / total, 4) if total else 0.0,
+            }
+            for option_id, count in zip(option_ids, totals)
+        ],
+        # Counts per period, in the order of `options`
+        "periods": [
+            {"period_start": start.isoformat(), "counts": period_counts}
+            for start, period_counts in sorted(periods.items())
+        ],
+        "transitions": {
+            "counts": counts.tolist(),
+            "probabilities": np.round(probabilities, 4).tolist(),
+        },
+    }
@@ -0,0 +1,49 @@
+"""
+Scoping sessions to one user.
+
+A session whose `info["user_id"]` is set (see `scope`) only sees that user's rows: every ORM
+select, update and delete of an `Owned` entity gets `user_id = ?` criteria, served by the user_id
+indexes. That includes polymorphic, column-only and `session.get` loads. New `Owned` objects are
+given the user on flush. Rows inserted from dicts (`insert(entity)` with a list of values) skip
+the flush, so the bulk write paths set `user_id` themselves.
+
+Statements on `Table` objects aren't ORM statements and aren't scoped, the modules using them
+(`heatmap`, `export`) filter by `user_id(session)` themselves.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session, with_loader_criteria
+
+import db_models as d
+
+
+def scope(session: Session, user_id: int) -> Session:
+    session.info["user_id"] = user_id
+    return session
+
+
+def user_id(session: Session) -> int:
+    return session.info.get("user_id", d.DEFAULT_USER_ID)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def add_owner_criteria(state: ORMExecuteState):
+    owner = state.session.info.get("user_id")
+    if owner is None or state.is_column_load or state.is_relationship_load:
+        return
+    if state.is_select or state.is_update or state.is_delete:
+        state.statement = state.statement.options(
+            with_loader_criteria(
+                d.Owned, lambda cls: cls.user_id == owner, include_aliases=True
+            )
+        )
+
+
+@event.listens_for(Session, "before_flush")
+def set_owner(session: Session, flush_context, instances):
+    owner = session.info.get("user_id")
+    if owner is None:
+        return
+    for obj in session.new:
+        if isinstance(obj, d.Owned) and obj.user_id is None:
+            obj.user_id = owner
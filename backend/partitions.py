@@ -0,0 +1,217 @@
+"""
+Per-year archives of old log entries, for SQLite databases.
+
+Nearly every read is about the last few weeks, but the log tables and their indexes hold the
+whole history. `manage.py compact --before YEAR` moves the logs from before that year out of the
+database into one file per year (`<database>-archive/logs-<year>.db`, with the same four log
+tables), leaving the hot database small.
+
+Reads that can reach back that far (log pages, rollup refreshes and rebuilds, analytics, option
+stats, the heatmap and exports) also run their query in the archives through `read`, which only
+opens the archives of years overlapping the requested time window. A read of recent logs never
+touches one. Rollups, stats, versions and sync markers stay in the hot database, so streaks and
+progress are unaffected by compaction.
+
+Archived logs are history: they can be read but not edited or deleted one by one (endpoints
+taking a log id only look in the hot database), they aren't part of full syncs, and their client
+ids no longer make retries idempotent. Deleting a habit deletes its archived logs too, and an
+option stays in use as long as archived logs are.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
+from itertools import batched
+from pathlib import Path
+
+import sqlalchemy
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+
+import db_models as d
+import ownership
+
+BATCH_SIZE = 5000
+MAX_OPEN_ARCHIVES = 32
+
+# Subclass tables first, they reference habit_logs
+LOG_TABLES = [
+    d.CompletionLogEntry.__table__,
+    d.MeasureableLogEntry.__table__,
+    d.ChoiceLogEntry.__table__,
+    d.LogEntry.__table__,
+]
+
+lock = threading.Lock()
+# Directory -> (its mtime, archived years), rescanned when a compaction changed the directory
+listings: dict[Path, tuple[int, list[int]]] = {}
+engines: OrderedDict[Path, sessionmaker[Session]] = OrderedDict()
+
+
+def archive_dir(session: Session) -> Path | None:
+    """
+    Where the archives of the session's database are, None for databases that can't have any.
+    """
+    url = session.get_bind().engine.url
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    path = Path(url.database)
+    return path.parent / f"{path.stem}-archive"
+
+
+def archive_path(directory: Path, year: int) -> Path:
+    return directory / f"logs-{year}.db"
+
+
+def years(session: Session) -> list[int]:
+    directory = archive_dir(session)
+    if directory is None:
+        return []
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    with lock:
+        listing = listings.get(directory)
+        if listing is not None and listing[0] == mtime:
+            return listing[1]
+    found = sorted(
+        int(path.stem.removeprefix("logs-")) for path in directory.glob("logs-*.db")
+    )
+    with lock:
+        listings[directory] = (mtime, found)
+    return found
+
+
+def open_archive(path: Path) -> sessionmaker[Session]:
+    with lock:
+        db = engines.get(path)
+        if db is not None:
+            engines.move_to_end(path)
+            return db
+    # Without the foreign key pragma, the habits and options the logs point to are elsewhere
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    d.Base.metadata.create_all(engine, tables=LOG_TABLES)
+    evicted = []
+    with lock:
+        db = engines.get(path)
+        if db is None:
+            db = engines[path] = sessionmaker(bind=engine)
+        else:
+            evicted.append(engine)
+        while len(engines) > MAX_OPEN_ARCHIVES:
+            evicted.append(engines.popitem(last=False)[1].kw["bind"])
+    for old in evicted:
+        old.dispose()
+    return db
+
+
+def archives(
+    session: Session, since: datetime | None = None, until: datetime | None = None
+) -> Iterator[Session]:
+    """
+    Sessions on the archives with logs in [since, until), oldest first, scoped to the same user
+    as `session`. Each one is closed once the next one is requested.
+    """
+    directory = archive_dir(session)
+    if directory is None:
+        return
+    # Logs are stored without a timezone and compared by their wall-clock time, so is the window
+    if until is not None:
+        until = until.replace(tzinfo=None)
+    for year in years(session):
+        if (since is not None and year < since.year) or (
+            until is not None and datetime(year, 1, 1) >= until
+        ):
+            continue
+        with open_archive(archive_path(directory, year))() as archive:
+            if "user_id" in session.info:
+                ownership.scope(archive, session.info["user_id"])
+            yield archive
+
+
+def read[T](
+    session: Session,
+    since: datetime | None,
+    until: datetime | None,
+    query: Callable[[Session], Iterable[T]],
+) -> list[T]:
+    """
+    Results of `query` in every archive with logs in [since, until). ORM objects come back
+    detached.
+    """
+    results: list[T] = []
+    for archive in archives(session, since, until):
+        results.extend(query(archive))
+        archive.expunge_all()
+    return results
+
+
+def attach_options(session: Session, entries: Iterable[d.LogEntry]):
+    """
+    Set the option of archived choice logs from the hot database, where options live.
+    """
+    choices = [entry for entry in entries if isinstance(entry, d.ChoiceLogEntry)]
+    option_ids = {entry.option_id for entry in choices}
+    options = {
+        option.id: option
+        for option in session.scalars(
+            select(d.ChoiceOption).where(d.ChoiceOption.id.in_(option_ids))
+        )
+    }
+    for entry in choices:
+        set_committed_value(entry, "option", options.get(entry.option_id))
+
+
+def delete_habit(session: Session, habit_id: int):
+    for archive in archives(session):
+        ids = select(d.LogEntry.id).where(d.LogEntry.habit_id == habit_id)
+        for table in LOG_TABLES:
+            archive.execute(delete(table).where(table.c.id.in_(ids)))
+        archive.commit()
+
+
+def compact(session: Session, before: int) -> dict[int, int]:
+    """
+    Move the logs from before January 1st of `before` to the archive of their year, returns how
+    many were moved per year. Every batch is committed to the archive before it's deleted from
+    the database, so an interrupted compaction loses nothing, it can leave the last batch in both
+    (which log pages skip, but aggregates count twice) until it's run again.
+    """
+    directory = archive_dir(session)
+    if directory is None:
+        raise ValueError("Only SQLite database files can be compacted")
+    logs = d.LogEntry.__table__
+    oldest = session.scalar(select(func.min(logs.c.timestamp)))
+    moved: dict[int, int] = {}
+    if oldest is None:
+        return moved
+
+    directory.mkdir(exist_ok=True)
+    for year in range(oldest.year, before):
+        in_year = select(logs.c.id).where(
+            logs.c.timestamp >= datetime(year, 1, 1),
+            logs.c.timestamp < datetime(year + 1, 1, 1),
+        )
+        ids = session.scalars(in_year.order_by(logs.c.id)).all()
+        if not ids:
+            continue
+        db = open_archive(archive_path(directory, year))
+        for batch in batched(ids, BATCH_SIZE):
+            with db() as archive:
+                for table in reversed(LOG_TABLES):
+                    rows = session.execute(
+                        select(table).where(table.c.id.in_(batch))
+                    ).mappings()
+                    rows = [dict(row) for row in rows]
+                    if rows:
+                        archive.execute(insert(table).prefix_with("OR REPLACE"), rows)
+                archive.commit()
+            for table in LOG_TABLES:
+                session.execute(delete(table).where(table.c.id.in_(batch)))
+            session.commit()
+        moved[year] = len(ids)
+    return moved
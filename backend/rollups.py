@@ -0,0 +1,221 @@
+"""
+Per-period aggregates of habit logs.
+
+Every habit has a `PeriodRollup` row for each day, week and month it was logged in, holding the
+count, sum, min and max of the logged amounts. The log write paths keep them up to date in the
+same transaction, so charts and target progress read a handful of rows instead of the logs.
+"""
+
+from collections.abc import Iterable
+from collections.abc import Set as AbstractSet
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import partitions
+
+# A log as far as rollups are concerned: when it happened and how much it counts
+LogPoint = tuple[datetime, int]
+
+
+def period_start(timestamp: datetime | date, timeframe: d.Timeframe) -> date:
+    day = timestamp.date() if isinstance(timestamp, datetime) else timestamp
+    if timeframe == d.Timeframe.DAY:
+        return day
+    elif timeframe == d.Timeframe.WEEK:
+        return day - timedelta(days=day.weekday())  # Weeks start on Monday
+    else:
+        return day.replace(day=1)
+
+
+def next_period(start: date, timeframe: d.Timeframe) -> date:
+    if timeframe == d.Timeframe.DAY:
+        return start + timedelta(days=1)
+    elif timeframe == d.Timeframe.WEEK:
+        return start + timedelta(weeks=1)
+    else:
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_period(start: date, timeframe: d.Timeframe) -> date:
+    return period_start(start - timedelta(days=1), timeframe)
+
+
+def log_amount(entry: d.LogEntry) -> int:
+    if isinstance(entry, d.CompletionLogEntry):
+        return int(entry.status)
+    elif isinstance(entry, d.MeasureableLogEntry):
+        return entry.value
+    else:
+        return 1
+
+
+def log_point(entry: d.LogEntry) -> LogPoint:
+    return entry.timestamp, log_amount(entry)
+
+
+def log_points(
+    session: Session,
+    habit: d.Habit,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterable[LogPoint]:
+    """
+    Logs of a habit as plain rows, without building ORM objects, archived ones included.
+    """
+    if habit.habit_type == d.HabitType.COMPLETION:
+        columns = (d.CompletionLogEntry.timestamp, d.CompletionLogEntry.status)
+    elif habit.habit_type == d.HabitType.MEASURABLE:
+        columns = (d.MeasureableLogEntry.timestamp, d.MeasureableLogEntry.value)
+    else:
+        columns = (d.ChoiceLogEntry.timestamp,)
+
+    entity = columns[0].class_
+    query = select(*columns).where(entity.habit_id == habit.id)
+    if since is not None:
+        query = query.where(entity.timestamp >= since)
+    if until is not None:
+        query = query.where(entity.timestamp < until)
+    for source in chain(partitions.archives(session, since, until), [session]):
+        for row in source.execute(query):
+            yield row[0], int(row[1]) if len(row) > 1 else 1
+
+
+def new_rollup(habit_id: int, timeframe: d.Timeframe, start: date) -> d.PeriodRollup:
+    return d.PeriodRollup(
+        habit_id=habit_id,
+        timeframe=timeframe,
+        period_start=start,
+        count=0,
+        total=0,
+        min_value=None,
+        max_value=None,
+    )
+
+
+def add_to(rollup: d.PeriodRollup, amount: int):
+    rollup.count += 1
+    rollup.total += amount
+    rollup.min_value = (
+        amount if rollup.min_value is None else min(rollup.min_value, amount)
+    )
+    rollup.max_value = (
+        amount if rollup.max_value is None else max(rollup.max_value, amount)
+    )
+
+
+def get_total(
+    session: Session, habit_id: int, timeframe: d.Timeframe, start: date
+) -> int:
+    rollup = session.get(d.PeriodRollup, (habit_id, timeframe, start))
+    return rollup.total if rollup is not None else 0
+
+
+def refresh(session: Session, habit: d.Habit, timeframe: d.Timeframe, start: date):
+    """
+    Recompute a single rollup from the logs of its period.
+    """
+    rollup = session.get(d.PeriodRollup, (habit.id, timeframe, start))
+    if rollup is None:
+        rollup = new_rollup(habit.id, timeframe, start)
+        session.add(rollup)
+    else:
+        rollup.count, rollup.total = 0, 0
+        rollup.min_value = rollup.max_value = None
+
+    end = next_period(start, timeframe)
+    for _, amount in log_points(
+        session,
+        habit,
+        since=datetime.combine(start, datetime.min.time()),
+        until=datetime.combine(end, datetime.min.time()),
+    ):
+        add_to(rollup, amount)
+
+    if rollup.count == 0:
+        session.delete(rollup)
+    session.flush()
+
+
+def apply(
+    session: Session,
+    habit: d.Habit,
+    point: LogPoint,
+    sign: int,
+    skip: AbstractSet[tuple[d.Timeframe, date]] = frozenset(),
+) -> set[tuple[d.Timeframe, date]]:
+    """
+    Add (`sign=1`) or remove (`sign=-1`) a log from the rollups of every timeframe.
+    Rollups that had to be recomputed from the logs are returned, those already reflect the
+    current state of the database and can be passed as `skip` for the rest of the same change.
+    """
+    timestamp, amount = point
+    refreshed = set()
+    for timeframe in d.Timeframe:
+        start = period_start(timestamp, timeframe)
+        if (timeframe, start) in skip:
+            continue
+        rollup = session.get(d.PeriodRollup, (habit.id, timeframe, start))
+        if sign > 0:
+            if rollup is None:
+                rollup = new_rollup(habit.id, timeframe, start)
+                session.add(rollup)
+            add_to(rollup, amount)
+        elif rollup is None or rollup.count <= 1:
+            if rollup is not None:
+                session.delete(rollup)
+        elif amount in (rollup.min_value, rollup.max_value):
+            # The removed amount might have been the only one at the extreme, which can't be undone
+            # from the aggregate alone. The logs of one period are a short indexed range though.
+            session.flush()
+            refresh(session, habit, timeframe, start)
+            refreshed.add((timeframe, start))
+        else:
+            rollup.count -= 1
+            rollup.total -= amount
+    session.flush()
+    return refreshed
+
+
+def rebuild_habit(session: Session, habit: d.Habit):
+    """
+    Recompute every rollup of a habit from its full history.
+    """
+    session.execute(delete(d.PeriodRollup).where(d.PeriodRollup.habit_id == habit.id))
+
+    rollups: dict[tuple[d.Timeframe, date], d.PeriodRollup] = {}
+    for timestamp, amount in log_points(session, habit):
+        for timeframe in d.Timeframe:
+            key = (timeframe, period_start(timestamp, timeframe))
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = new_rollup(habit.id, *key)
+            add_to(rollup, amount)
+    session.add_all(rollups.values())
+    session.flush()
+
+
+def get_rollups(
+    session: Session,
+    habit_id: int,
+    timeframe: d.Timeframe,
+    since: date | None = None,
+    until: date | None = None,
+) -> list[d.PeriodRollup]:
+    query = (
+        select(d.PeriodRollup)
+        .where(
+            d.PeriodRollup.habit_id == habit_id, d.PeriodRollup.timeframe == timeframe
+        )
+        .order_by(d.PeriodRollup.period_start)
+    )
+    if since is not None:
+        query = query.where(
+            d.PeriodRollup.period_start >= period_start(since, timeframe)
+        )
+    if until is not None:
+        query = query.where(d.PeriodRollup.period_start < until)
+    return list(session.scalars(query))
@@ -0,0 +1,76 @@
+"""
+Precompiled serializers for the ORM models.
+
+Which columns a class has, how to format them and which relationships to nest is worked out
+once per class and kept in a closure, so serializing a row is a plain attribute walk. Output
+only contains JSON types (enums are `StrEnum`s) so it can be encoded without `jsonable_encoder`.
+"""
+
+from collections.abc import Callable
+from datetime import date, datetime
+from operator import attrgetter
+
+from sqlalchemy import Date, DateTime
+from sqlalchemy.orm import class_mapper
+
+# Formats the API has always used
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+Serializer = Callable[[object], dict]
+
+_serializers: dict[type, Serializer] = {}
+
+
+def format_datetime(value: datetime | None) -> str | None:
+    return None if value is None else value.strftime(DATETIME_FORMAT)
+
+
+def format_date(value: date | None) -> str | None:
+    return None if value is None else value.strftime(DATE_FORMAT)
+
+
+def compile_serializer(cls: type) -> Serializer:
+    mapper = class_mapper(cls)
+    excluded = getattr(cls, "__serialize_exclude__", ())
+    columns = [prop for prop in mapper.column_attrs if prop.key not in excluded]
+    keys = [prop.key for prop in columns]
+    get_columns = (
+        attrgetter(*keys) if len(keys) > 1 else lambda obj: (getattr(obj, keys[0]),)
+    )
+
+    converters = []
+    for prop in columns:
+        column_type = prop.columns[0].type
+        if isinstance(column_type, DateTime):
+            converters.append((prop.key, format_datetime))
+        elif isinstance(column_type, Date):
+            converters.append((prop.key, format_date))
+
+    # Relationships are left out unless the class lists them in `__serialize__`
+    nested = [
+        (name, mapper.relationships[name].uselist)
+        for name in getattr(cls, "__serialize__", ())
+    ]
+
+    def serializer(obj: object) -> dict:
+        result = dict(zip(keys, get_columns(obj)))
+        for key, convert in converters:
+            result[key] = convert(result[key])
+        for name, uselist in nested:
+            value = getattr(obj, name)
+            if uselist:
+                result[name] = [serialize(item) for item in value]
+            else:
+                result[name] = None if value is None else serialize(value)
+        return result
+
+    return serializer
+
+
+def serialize(obj: object) -> dict:
+    # Looked up by the concrete class, so polymorphic rows get their subclass columns
+    serializer = _serializers.get(type(obj))
+    if serializer is None:
+        serializer = _serializers[type(obj)] = compile_serializer(type(obj))
+    return serializer(obj)
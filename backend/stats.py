@@ -0,0 +1,210 @@
+"""
+Streak and target tracking for habits.
+
+Every log write updates the rollups of the periods it falls into (see `rollups`) and the habit's
+`HabitStats` row, so reading stats is a couple of primary key lookups instead of a replay of the
+whole history. Streaks only need recomputing (from the rollups, not the logs) when a write flips
+whether a period met its target.
+"""
+
+from collections.abc import Iterable
+from datetime import datetime
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import rollups
+from rollups import LogPoint
+
+# Past this many logs for one habit, a batch is cheaper to apply by rebuilding the habit
+INCREMENTAL_BATCH_LIMIT = 50
+
+
+def habit_target(habit: d.Habit) -> tuple[d.Timeframe, int]:
+    if isinstance(habit, d.CompletionHabit):
+        return habit.target_timeframe, habit.completion_target
+    elif isinstance(habit, d.MeasureableHabit):
+        # ! completion_target is the timeframe on measurable habits
+        return habit.completion_target, habit.target
+    else:
+        # Choice habits have no target, a day counts once anything was logged
+        return d.Timeframe.DAY, 1
+
+
+def lock_habits(session: Session, habit_ids: Iterable[int]):
+    """
+    Make transactions updating the rollups and stats of the same habits take turns, until commit.
+    Those updates read and then write (counters, new periods, streaks), which PostgreSQL's READ
+    COMMITTED would let concurrent writers interleave: increments get lost and two inserts of the
+    same new period fail. Rows are locked in id order, so writers to several habits can't
+    deadlock, and with NO KEY UPDATE, which doesn't wait for the key share locks inserting logs
+    takes. SQLite has a single writer at a time already.
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        return
+    session.execute(
+        select(d.Habit.id)
+        .where(d.Habit.id.in_(sorted(set(habit_ids))))
+        .order_by(d.Habit.id)
+        .with_for_update(key_share=True)
+    )
+
+
+def recompute_streaks(session: Session, habit: d.Habit, stats: d.HabitStats):
+    timeframe, target = habit_target(habit)
+    met_periods = session.scalars(
+        select(d.PeriodRollup.period_start)
+        .where(
+            d.PeriodRollup.habit_id == habit.id,
+            d.PeriodRollup.timeframe == timeframe,
+            d.PeriodRollup.total >= target,
+        )
+        .order_by(d.PeriodRollup.period_start)
+    )
+
+    stats.periods_met = stats.best_streak = stats.last_run_length = 0
+    stats.last_run_end = None
+    for start in met_periods:
+        stats.periods_met += 1
+        if stats.last_run_end is not None and start == rollups.next_period(
+            stats.last_run_end, timeframe
+        ):
+            stats.last_run_length += 1
+        else:
+            stats.last_run_length = 1
+        stats.last_run_end = start
+        stats.best_streak = max(stats.best_streak, stats.last_run_length)
+
+
+def refresh_stats(session: Session, habit: d.Habit) -> d.HabitStats:
+    """
+    Recompute the stats of a habit from its (already up to date) rollups.
+    """
+    stats = session.get(d.HabitStats, habit.id)
+    if stats is None:
+        stats = d.HabitStats(habit_id=habit.id)
+        session.add(stats)
+    stats.total_logs = sum(
+        rollup.count
+        for rollup in rollups.get_rollups(session, habit.id, d.Timeframe.MONTH)
+    )
+    session.flush()
+    recompute_streaks(session, habit, stats)
+    return stats
+
+
+def rebuild(session: Session, habit: d.Habit) -> d.HabitStats:
+    """
+    Recompute the rollups and stats of a habit from its full history.
+    """
+    rollups.rebuild_habit(session, habit)
+    return refresh_stats(session, habit)
+
+
+def target_changed(session: Session, habit: d.Habit):
+    lock_habits(session, [habit.id])
+    if session.get(d.HabitStats, habit.id) is None:
+        rebuild(session, habit)
+    else:
+        # Rollups are kept for every timeframe, so only the streaks depend on the target
+        refresh_stats(session, habit)
+
+
+def get_stats(session: Session, habit: d.Habit) -> d.HabitStats:
+    stats = session.get(d.HabitStats, habit.id)
+    if stats is None:
+        # Habits logged before stats existed get caught up on first use
+        lock_habits(session, [habit.id])
+        stats = session.get(d.HabitStats, habit.id) or rebuild(session, habit)
+    return stats
+
+
+def apply_log_change(
+    session: Session,
+    habit: d.Habit,
+    removed: LogPoint | None = None,
+    added: LogPoint | None = None,
+):
+    """
+    Update the rollups and stats of `habit` after one of its logs was added, removed or changed.
+    Must be called after the log change has been flushed.
+    """
+    lock_habits(session, [habit.id])
+    stats = session.get(d.HabitStats, habit.id)
+    if stats is None:
+        rebuild(session, habit)  # Already includes the flushed change
+        return
+
+    timeframe, target = habit_target(habit)
+    starts = {
+        rollups.period_start(point[0], timeframe)
+        for point in (removed, added)
+        if point is not None
+    }
+
+    def met():
+        return {
+            start: rollups.get_total(session, habit.id, timeframe, start) >= target
+            for start in starts
+        }
+
+    met_before = met()
+    refreshed = set()
+    if removed is not None:
+        refreshed = rollups.apply(session, habit, removed, -1)
+        stats.total_logs -= 1
+    if added is not None:
+        rollups.apply(session, habit, added, 1, skip=refreshed)
+        stats.total_logs += 1
+
+    if met() != met_before:
+        recompute_streaks(session, habit, stats)
+
+
+def apply_log_batch(session: Session, habit: d.Habit, added: list[LogPoint]):
+    """
+    Like `apply_log_change` for many added logs at once. Large batches rebuild the habit from
+    its history in one pass, which beats updating the rollups one log at a time.
+    """
+    lock_habits(session, [habit.id])
+    if (
+        len(added) > INCREMENTAL_BATCH_LIMIT
+        or session.get(d.HabitStats, habit.id) is None
+    ):
+        rebuild(session, habit)
+        return
+    for point in added:
+        apply_log_change(session, habit, added=point)
+
+
+def forget(session: Session, habit_id: int):
+    session.execute(delete(d.PeriodRollup).where(d.PeriodRollup.habit_id == habit_id))
+    session.execute(delete(d.HabitStats).where(d.HabitStats.habit_id == habit_id))
+
+
+def summary(session: Session, habit: d.Habit, at: datetime) -> dict:
+    stats = get_stats(session, habit)
+    timeframe, target = habit_target(habit)
+    current = rollups.period_start(at, timeframe)
+
+    # The current period may still be in progress, so a run ending in the previous one is still alive
+    current_streak = 0
+    if stats.last_run_end in (current, rollups.previous_period(current, timeframe)):
+        current_streak = stats.last_run_length
+
+    progress = rollups.get_total(session, habit.id, timeframe, current)
+    return {
+        "habit_id": habit.id,
+        "timeframe": timeframe,
+        "target": target,
+        "current_streak": current_streak,
+        "best_streak": stats.best_streak,
+        "periods_met": stats.periods_met,
+        "total_logs": stats.total_logs,
+        "current_period": {
+            "start": current.isoformat(),
+            "progress": progress,
+            "met": progress >= target,
+        },
+    }
@@ -0,0 +1,190 @@
+"""
+Structured logging, replacing the engine's `echo=True` output.
+
+Records are JSON objects, one per line, carrying the id of the request they were logged in
+(from its `X-Request-ID` header, or a generated one sent back in the response). Handlers only
+put records on a queue. A `QueueListener` thread formats and writes them, so a request never
+waits on stdout.
+
+SQL statements are logged by cursor event listeners instead of `echo`, based on how long they
+took:
+
+    HABITS_LOG_LEVEL          level of the "habits" loggers (INFO), DEBUG logs every statement
+    HABITS_SQL_SLOW_MS        statements taking at least this long are logged as warnings (100)
+    HABITS_SQL_SAMPLE_RATE    fraction of the other statements logged at INFO, 0 to 1 (0)
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO
+
+from sqlalchemy import Engine, event
+
+from database import env_int
+
+logger = logging.getLogger("habits")
+sql_logger = logging.getLogger("habits.sql")
+
+REQUEST_ID_HEADER = b"x-request-id"
+# Ids from clients are only reused when they're short and can't break a log line
+VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._-]{1,128}")
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+STANDARD_ATTRIBUTES = set(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None))
+) | {"message", "asctime", "taskName"}
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return default if value is None else float(value)
+
+
+@dataclass(frozen=True)
+class LogSettings:
+    level: str = "INFO"
+    sql_slow_ms: int = 100
+    sql_sample_rate: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LogSettings":
+        level = os.environ.get("HABITS_LOG_LEVEL", cls.level).upper()
+        if level not in logging.getLevelNamesMapping():
+            raise ValueError(f"Invalid HABITS_LOG_LEVEL: {level}")
+        sample_rate = env_float("HABITS_SQL_SAMPLE_RATE", cls.sql_sample_rate)
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Invalid HABITS_SQL_SAMPLE_RATE: {sample_rate}")
+        return cls(
+            level=level,
+            sql_slow_ms=env_int("HABITS_SQL_SLOW_MS", cls.sql_slow_ms),
+            sql_sample_rate=sample_rate,
+        )
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data |= {
+            key: value
+            for key, value in vars(record).items()
+            if key not in STANDARD_ATTRIBUTES
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs in the thread that logged, where the request's context is
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+def configure(settings: LogSettings, stream: IO[str] | None = None) -> QueueListener:
+    """
+    Send the "habits" loggers to `stream` (stdout) through a queue. Stop the returned listener on
+    shutdown, which writes out whatever is still queued.
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(RequestIdFilter())
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(settings.level)
+    logger.propagate = False
+    listener = QueueListener(records, handler)
+    listener.start()
+    return listener
+
+
+def install_sql_logging(engine: Engine, settings: LogSettings):
+    """
+    Log the statements of `engine` that are slow, sampled, or all of them at DEBUG.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("log_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("log_query_start")
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000
+        if duration_ms >= settings.sql_slow_ms:
+            level, message = logging.WARNING, "Slow query"
+        elif sql_logger.isEnabledFor(logging.DEBUG):
+            level, message = logging.DEBUG, "Query"
+        elif settings.sql_sample_rate and random.random() < settings.sql_sample_rate:
+            level, message = logging.INFO, "Sampled query"
+        else:
+            return
+        # Parameters are left out, they hold user data
+        sql_logger.log(
+            level,
+            message,
+            extra={
+                "statement": statement,
+                "duration_ms": round(duration_ms, 3),
+                "executemany": executemany,
+            },
+        )
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request an id for its log records and sends it back in `X-Request-ID`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        id = dict(scope["headers"]).get(REQUEST_ID_HEADER, b"").decode("latin-1")
+        if not VALID_REQUEST_ID.fullmatch(id):
+            id = uuid.uuid4().hex
+        token = request_id.set(id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = [
+                    *message.get("headers", []),
+                    (REQUEST_ID_HEADER, id.encode()),
+                ]
+                message = message | {"headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
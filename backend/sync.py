@@ -0,0 +1,123 @@
+"""
+Delta sync for offline-first clients.
+
+`changes_since` answers with the habits and log entries changed after a client's last sync,
+plus tombstones for deleted ones, found through the `seq` index of `sync_changes`. A client that
+has never synced (`since=0`) gets everything. Either way the response carries the `seq` to pass
+next time. `push` applies the writes a client queued while offline, in one transaction.
+"""
+
+from collections.abc import Iterable
+from itertools import batched
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload, with_polymorphic
+
+import bulk
+import cache
+import changes
+import db_models as d
+import rollups
+import stats
+import versions
+from changes import ChangeAction, ChangeKind
+
+# Ids per IN (...) when loading changed rows, well below SQLite's bound parameter limit
+ID_BATCH_SIZE = 500
+
+polymorphic_log = with_polymorphic(d.LogEntry, "*")
+log_query = select(polymorphic_log).options(
+    joinedload(polymorphic_log.ChoiceLogEntry.option)
+)
+
+
+def load_habits(session: Session, ids: list[int]) -> list[dict]:
+    habits = []
+    for batch in batched(ids, ID_BATCH_SIZE):
+        query = cache.habit_query.where(cache.polymorphic_habit.id.in_(batch)).order_by(
+            cache.polymorphic_habit.id
+        )
+        habits += [habit.to_dict() for habit in session.scalars(query)]
+    return habits
+
+
+def load_logs(session: Session, ids: list[int]) -> list[dict]:
+    logs = []
+    for batch in batched(ids, ID_BATCH_SIZE):
+        query = log_query.where(polymorphic_log.id.in_(batch))
+        logs += [log.to_dict() for log in session.scalars(query).unique()]
+    return logs
+
+
+def changes_since(session: Session, since: int) -> dict:
+    # Read first, in the same transaction as the rows, so nothing committed later is skipped
+    seq = versions.current(session)
+    if since <= 0:
+        habits = session.scalars(cache.habit_query.order_by(cache.polymorphic_habit.id))
+        logs = session.scalars(
+            log_query.order_by(polymorphic_log.habit_id, polymorphic_log.timestamp)
+        ).unique()
+        return {
+            "seq": seq,
+            "full": True,
+            "habits": [habit.to_dict() for habit in habits],
+            "logs": [log.to_dict() for log in logs],
+            "deleted": {"habits": [], "logs": []},
+        }
+
+    changed = session.execute(
+        select(d.SyncChange.kind, d.SyncChange.entity_id, d.SyncChange.deleted)
+        .where(d.SyncChange.seq > since)
+        .order_by(d.SyncChange.seq)
+    )
+    ids: dict[tuple[ChangeKind, bool], list[int]] = {
+        (kind, deleted): []
+        for kind in (ChangeKind.HABIT, ChangeKind.LOG)
+        for deleted in (False, True)
+    }
+    for kind, entity_id, deleted in changed:
+        ids[kind, deleted].append(entity_id)
+
+    return {
+        "seq": seq,
+        "full": False,
+        "habits": load_habits(session, ids[ChangeKind.HABIT, False]),
+        "logs": load_logs(session, ids[ChangeKind.LOG, False]),
+        "deleted": {
+            "habits": ids[ChangeKind.HABIT, True],
+            "logs": ids[ChangeKind.LOG, True],
+        },
+    }
+
+
+def delete_logs(session: Session, ids: list[int]) -> int:
+    """
+    Delete log entries like DELETE /log/{id} does. Ids that are already gone are skipped, so a
+    client can safely replay its queue.
+    """
+    deleted = 0
+    for batch in batched(ids, ID_BATCH_SIZE):
+        entries = session.scalars(
+            select(d.LogEntry).where(d.LogEntry.id.in_(batch))
+        ).all()
+        stats.lock_habits(session, [entry.habit_id for entry in entries])
+        for entry in entries:
+            habit, removed = entry.habit, rollups.log_point(entry)
+            session.delete(entry)
+            session.flush()
+            stats.apply_log_change(session, habit, removed=removed)
+            changes.record(
+                session, ChangeKind.LOG, ChangeAction.DELETED, habit.id, entry.id
+            )
+            deleted += 1
+    return deleted
+
+
+def push(session: Session, created: Iterable[object], deleted: list[int]) -> dict:
+    """
+    Apply a client's queued writes. Deletions go first, so a queue that deleted and re-created
+    a log (the way offline edits are sent) ends up with the new one. Doesn't commit.
+    """
+    deleted_count = delete_logs(session, deleted)
+    inserted, errors = bulk.import_rows(session, created)
+    return {"inserted": inserted, "deleted": deleted_count, "errors": errors}
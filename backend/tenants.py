@@ -0,0 +1,92 @@
+"""
+A database file per tenant.
+
+With `HABITS_TENANT_DATABASE_URL` set to a URL containing `{user_id}` (for example
+`sqlite:///tenants/{user_id}.db`), every user's habits and logs live in a database of their own.
+Users and tokens stay in the main database. A user's queries then never read another user's
+pages or indexes, and a tenant can be backed up or deleted as a file.
+
+Engines are opened (and their database migrated) on first use and kept in an LRU of
+`HABITS_TENANT_MAX_ENGINES` (64). The least recently used engine is disposed when a new one
+doesn't fit, so thousands of tenants don't mean thousands of open connection pools.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import replace
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+import db_models as d
+from database import DatabaseSettings
+
+MAX_ENGINES = 64
+# Per tenant, a single user rarely has many requests in flight
+POOL_SIZE = 2
+MAX_OVERFLOW = 8
+
+
+class EngineCache:
+    def __init__(
+        self,
+        url_template: str,
+        settings: DatabaseSettings,
+        max_engines: int = MAX_ENGINES,
+        on_open: Callable[[Engine], None] | None = None,
+    ):
+        if "{user_id}" not in url_template:
+            raise ValueError("The tenant database URL needs a {user_id} placeholder")
+        self.url_template = url_template
+        self.settings = settings
+        self.max_engines = max_engines
+        self.on_open = on_open
+        self.lock = threading.Lock()
+        self.engines: OrderedDict[int, sessionmaker[Session]] = OrderedDict()
+
+    def open(self, user_id: int) -> sessionmaker[Session]:
+        settings = replace(
+            self.settings,
+            url=self.url_template.format(user_id=user_id),
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+        )
+        engine = d.get_engine(settings)
+        with Session(engine) as session:
+            # Only there for the foreign keys, the user's name is in the main database
+            if session.get(d.User, user_id) is None:
+                session.add(d.User(id=user_id, name=str(user_id)))
+                session.commit()
+        if self.on_open is not None:
+            self.on_open(engine)
+        return sessionmaker(bind=engine)
+
+    def get(self, user_id: int) -> sessionmaker[Session]:
+        with self.lock:
+            db = self.engines.get(user_id)
+            if db is not None:
+                self.engines.move_to_end(user_id)
+                return db
+        # ? Opened outside the lock so a slow migration doesn't hold up every tenant. Two requests
+        # ? racing to open the same tenant both migrate, which is idempotent, and one engine wins.
+        opened = self.open(user_id)
+        evicted = []
+        with self.lock:
+            db = self.engines.get(user_id)
+            if db is None:
+                db = self.engines[user_id] = opened
+            else:
+                evicted.append(opened)
+            while len(self.engines) > self.max_engines:
+                evicted.append(self.engines.popitem(last=False)[1])
+        for old in evicted:
+            # Connections still checked out are closed once they're returned
+            old.kw["bind"].dispose()
+        return db
+
+    def dispose(self):
+        with self.lock:
+            engines, self.engines = list(self.engines.values()), OrderedDict()
+        for db in engines:
+            db.kw["bind"].dispose()
@@ -1,26 +1,52 @@
+from contextlib import contextmanager
+import os
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 import app
+import cache
+import migrations
 import pytest
 
 
-@pytest.fixture(autouse=True)
-def monkeypatch_db(monkeypatch: pytest.MonkeyPatch):
+@pytest.fixture
+def db_engine():
+    """
+    In-memory SQLite, or the (empty, scratch) database at HABITS_TEST_DATABASE_URL, e.g. a local
+    PostgreSQL, to run the suite against another backend.
+    """
     from sqlalchemy import create_engine, StaticPool
+
+    url = os.environ.get("HABITS_TEST_DATABASE_URL")
+    if url:
+        engine = create_engine(url)
+    else:
+        engine = create_engine(
+            "sqlite:///:memory:",
+            echo=False,
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False},
+        )
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def monkeypatch_db(monkeypatch: pytest.MonkeyPatch, db_engine):
     from sqlalchemy.orm import sessionmaker
+
     from db_models import Base
 
-    # Create an in-memory SQLite database for testing
-    engine = create_engine(
-        "sqlite:///:memory:",
-        echo=False,
-        poolclass=StaticPool,
-        connect_args={"check_same_thread": False},
-    )
-    Base.metadata.create_all(engine)  # Create tables
-    db = sessionmaker(bind=engine)
+    # Every test starts from empty tables, which only matters for HABITS_TEST_DATABASE_URL
+    Base.metadata.drop_all(db_engine)
+    Base.metadata.create_all(db_engine)
+    with db_engine.begin() as conn:
+        migrations.add_default_user(conn)
+    db = sessionmaker(bind=db_engine)
 
     # Monkeypatch the db variable in the app module
     monkeypatch.setattr(app, "db", db)
+    # Every test starts with an empty database, so nothing cached can carry over
+    cache.habits.clear()
 
 
 test_client = TestClient(app.app)
@@ -31,6 +57,29 @@ def client() -> TestClient:
     return test_client
 
 
+@pytest.fixture
+def count_queries():
+    """
+    Context manager collecting the SQL statements run against the test database.
+    """
+
+    @contextmanager
+    def count():
+        engine = app.db.kw["bind"]
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return count
+
+
 @pytest.fixture
 def example_habits(client):
     """
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import analytics
+
+
+def arrays(logs):
+    timestamps = np.array([timestamp for timestamp, _ in logs], dtype="datetime64[s]")
+    return timestamps, np.array([value for _, value in logs], dtype=np.int64)
+
+
+def test_daily_totals_fill_gaps_and_roll():
+    # Monday 2024-01-01 to Monday 2024-01-08
+    logs = [(datetime(2024, 1, day, 9), 100 * day) for day in range(1, 9) if day != 4]
+    logs.append((datetime(2024, 1, 1, 21), 50))
+    summary = analytics.summarize(*arrays(logs))
+
+    daily = summary["daily"]
+    assert daily["start"] == "2024-01-01"
+    assert daily["totals"] == [150, 200, 300, 0, 500, 600, 700, 800]
+    assert daily["rolling_7"] == [None] * 6 + [350.0, 442.857]
+    assert daily["rolling_30"] == [None] * 8
+    assert summary["trend"]["slope_per_day"] == pytest.approx(
+        np.polyfit(range(8), daily["totals"], 1)[0]
+    )
+
+
+def test_distributions():
+    logs = [
+        (datetime(2024, 1, 1, 9), 10),  # Monday
+        (datetime(2024, 1, 1, 21), 30),
+        (datetime(2024, 1, 7, 9), 20),  # Sunday
+    ]
+    summary = analytics.summarize(*arrays(logs))
+
+    assert summary["total_logs"] == 3
+    assert summary["weekday"]["count"] == [2, 0, 0, 0, 0, 0, 1]
+    assert summary["weekday"]["total"] == [40, 0, 0, 0, 0, 0, 20]
+    assert summary["weekday"]["mean_daily_total"] == [40, 0, 0, 0, 0, 0, 20]
+    assert summary["hour"]["count"][9] == 2
+    assert summary["hour"]["total"][21] == 30
+    assert summary["percentiles"]["value"]["p50"] == 20
+    assert summary["percentiles"]["daily_total"] == {
+        "p10": 22.0,
+        "p25": 25.0,
+        "p50": 30.0,
+        "p75": 35.0,
+        "p90": 38.0,
+    }
+
+
+def test_empty_history():
+    summary = analytics.summarize(*arrays([]))
+    assert summary["total_logs"] == 0
+    assert summary["daily"]["totals"] == []
+    assert summary["trend"] is None
+    assert summary["percentiles"] == {"value": None, "daily_total": None}
+    assert summary["weekday"]["count"] == [0] * 7
+
+
+def test_analytics_endpoint(client, example_habits):
+    for day, amount in ((1, 500), (2, 1500), (3, 1000)):
+        client.post(
+            "/log/4", json={"timestamp": f"2024-01-0{day} 08:00:00", "amount": amount}
+        )
+
+    response = client.get("/habits/4/analytics")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["habit_id"] == 4
+    assert body["unit"] == "ml"
+    assert body["daily"]["totals"] == [500, 1500, 1000]
+
+    response = client.get(
+        "/habits/4/analytics", params={"since": "2024-01-02T00:00:00"}
+    )
+    assert response.json()["daily"]["totals"] == [1500, 1000]
+
+
+def test_analytics_only_for_measurable_habits(client, example_habits):
+    assert client.get("/habits/1/analytics").status_code == 400
+    assert client.get("/habits/42/analytics").status_code == 404
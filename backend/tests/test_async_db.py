@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import NullPool, create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app
+import migrations
+
+
+@pytest.fixture(autouse=True)
+def async_db(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    path = tmp_path / "habits.db"
+    engine = create_engine(f"sqlite:///{path}")
+    migrations.migrate(engine)
+    monkeypatch.setattr(app, "db", sessionmaker(bind=engine))
+
+    # The test client runs every request on a fresh event loop, so don't keep connections around
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", poolclass=NullPool
+    )
+    monkeypatch.setattr(app, "async_db", async_sessionmaker(async_engine))
+
+
+def test_habits_round_trip(client, example_habits):
+    response = client.get("/habits")
+    assert response.status_code == 200
+    assert [habit["name"] for habit in response.json()] == [
+        "Medicine",
+        "Exercise",
+        "Flossing",
+        "Water Intake",
+        "Pages Read",
+        "Mood",
+    ]
+    assert [option["option_text"] for option in response.json()[5]["options"]] == [
+        "Happy",
+        "Sad",
+        "Neutral",
+    ]
+
+
+def test_log_and_stats(client, example_habits):
+    for timestamp in ("2024-01-01 08:00:00", "2024-01-02 08:00:00"):
+        response = client.post(
+            "/log/1",
+            json={"timestamp": timestamp, "status": True},
+        )
+        assert response.status_code == 201
+
+    response = client.get("/log/1")
+    assert response.status_code == 200
+    assert [log["timestamp"] for log in response.json()] == [
+        "2024-01-01 08:00:00",
+        "2024-01-02 08:00:00",
+    ]
+
+    response = client.get("/habits/1/stats", params={"at": "2024-01-02T12:00:00"})
+    assert response.json()["current_streak"] == 2
+
+
+def test_errors_are_raised_from_the_session(client, example_habits):
+    response = client.get("/habits/42")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Habit not found"}
+
+
+def test_bulk_import(client, example_habits):
+    response = client.post(
+        "/log/bulk",
+        json=[
+            {
+                "habit_id": 4,
+                "timestamp": "2024-01-01 08:00:00",
+                "amount": 500,
+            },
+            {
+                "habit_id": 6,
+                "timestamp": "2024-01-01 08:00:00",
+                "option_id": 2,
+            },
+        ],
+    )
+    assert response.status_code == 201
+    assert response.json()["inserted"] == 2
+    assert len(client.get("/log/4").json()) == 1
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+import bulk
+import stats
+
+
+def test_bulk_import_mixed_habits(client, example_habits):
+    response = client.post(
+        "/log/bulk",
+        json=[
+            {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True},
+            {"habit_id": 4, "timestamp": "2024-01-01 09:00:00", "amount": 500},
+            {"habit_id": 6, "timestamp": "2024-01-01 10:00:00", "option_id": 2},
+            {"habit_id": 1, "timestamp": "2024-01-02 08:00:00", "status": True},
+        ],
+    )
+    assert response.status_code == 201
+    assert response.json() == {"message": "Logs imported", "inserted": 4, "errors": []}
+
+    assert [log["timestamp"] for log in client.get("/log/1").json()] == [
+        "2024-01-01 08:00:00",
+        "2024-01-02 08:00:00",
+    ]
+    assert client.get("/log/4").json()[0]["value"] == 500
+    assert client.get("/log/6").json()[0]["option"]["option_text"] == "Sad"
+
+
+def test_bulk_import_ndjson(client, example_habits):
+    rows = [
+        {"habit_id": 4, "timestamp": f"2024-01-{day:02} 09:00:00", "amount": day}
+        for day in range(1, 11)
+    ]
+    response = client.post(
+        "/log/bulk",
+        content="\n".join(json.dumps(row) for row in rows) + "\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 201
+    assert response.json()["inserted"] == 10
+    assert len(client.get("/log/4").json()) == 10
+
+
+def test_bulk_import_reports_errors_per_row(client, example_habits):
+    # Option 1 belongs to habit 6, so a second choice habit can't use it
+    client.post(
+        "/habits/new",
+        json={"type": "choice", "name": "Other", "options": [{"option_text": "A"}]},
+    )
+
+    response = client.post(
+        "/log/bulk",
+        json=[
+            {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True},
+            {"habit_id": 999, "timestamp": "2024-01-01 08:00:00", "status": True},
+            {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "amount": 5},
+            {"habit_id": 6, "timestamp": "2024-01-01 08:00:00", "option_id": 999},
+            {"habit_id": 7, "timestamp": "2024-01-01 08:00:00", "option_id": 1},
+            {"habit_id": 1, "timestamp": "not a timestamp", "status": True},
+            {"habit_id": 6, "timestamp": "2024-01-01 08:00:00", "option_id": 1},
+        ],
+    )
+    assert response.status_code == 201
+    body = response.json()
+    assert body["inserted"] == 2
+    assert [(error["row"], error["detail"]) for error in body["errors"]] == [
+        (1, "Habit not found"),
+        (2, "Habit type mismatch"),
+        (3, "Option not found"),
+        (4, "Option does not belong to the specified habit"),
+        (5, "Invalid log entry"),
+    ]
+
+
+def test_bulk_import_stops_reading_too_many_rows(client, example_habits, monkeypatch):
+    monkeypatch.setattr(bulk, "MAX_ROWS", 3)
+    read = []
+    ndjson_lines = bulk.ndjson_lines
+
+    async def counted_lines(chunks):
+        async for line in ndjson_lines(chunks):
+            read.append(line)
+            yield line
+
+    monkeypatch.setattr(bulk, "ndjson_lines", counted_lines)
+    row = {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True}
+    response = client.post(
+        "/log/bulk",
+        content=(json.dumps(row) + "\n") * 10,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 413
+    assert len(read) == 4
+
+
+def test_bulk_import_invalid_ndjson_line(client, example_habits):
+    response = client.post(
+        "/log/bulk",
+        content='{"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": true}\n{oops\n',
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 201
+    assert response.json()["inserted"] == 1
+    assert [error["row"] for error in response.json()["errors"]] == [1]
+
+
+@pytest.mark.parametrize("body", ['{"habit_id": 1}', "not json"])
+def test_bulk_import_rejects_non_list_body(client, example_habits, body):
+    response = client.post(
+        "/log/bulk", content=body, headers={"Content-Type": "application/json"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("days", [3, 28])
+def test_bulk_import_updates_stats(client, example_habits, days, monkeypatch):
+    # Small batches are applied incrementally, large ones rebuild the habit
+    monkeypatch.setattr(stats, "INCREMENTAL_BATCH_LIMIT", 10)
+    client.post("/log/1", json={"timestamp": "2024-01-15 08:00:00", "status": True})
+
+    response = client.post(
+        "/log/bulk",
+        json=[
+            {"habit_id": 1, "timestamp": f"2024-02-{day:02} 08:00:00", "status": True}
+            for day in range(1, days + 1)
+        ],
+    )
+    assert response.json()["inserted"] == days
+
+    result = client.get("/habits/1/stats", params={"at": f"2024-02-{days:02} 20:00:00"})
+    assert result.json()["total_logs"] == days + 1
+    assert result.json()["best_streak"] == days
+    assert result.json()["current_streak"] == days
@@ -0,0 +1,104 @@
+import pytest
+
+import cache
+
+
+def test_reads_are_served_from_cache(client, example_habits):
+    client.get("/habits/6")
+    before = client.get("/cache/stats").json()
+
+    assert client.get("/habits/6").json()["name"] == "Mood"
+    assert len(client.get("/habits/6/options").json()) == 3
+
+    after = client.get("/cache/stats").json()
+    assert after["hits"] == before["hits"] + 2
+    assert after["misses"] == before["misses"]
+
+
+def test_log_write_validates_without_loading_the_habit(
+    client, example_habits, count_queries
+):
+    client.get("/habits/6")
+    with count_queries() as statements:
+        response = client.post(
+            "/log/6", json={"timestamp": "2024-01-01 08:00:00", "option_id": 2}
+        )
+    assert response.status_code == 201
+    # On PostgreSQL the habit's row is locked for the stats update, but nothing is loaded
+    assert not any(
+        ("FROM habits" in statement and "FOR NO KEY UPDATE" not in statement)
+        or "FROM choice_options" in statement
+        for statement in statements
+    )
+
+
+def test_option_errors_still_tell_missing_from_foreign(client, example_habits):
+    client.post(
+        "/habits/new",
+        json={"type": "choice", "name": "Other", "options": [{"option_text": "A"}]},
+    )
+    response = client.post(
+        "/log/6", json={"timestamp": "2024-01-01 08:00:00", "option_id": 4}
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/log/6", json={"timestamp": "2024-01-01 08:00:00", "option_id": 99}
+    )
+    assert response.status_code == 404
+
+
+def test_definition_changes_invalidate(client, example_habits):
+    assert client.get("/habits/6").json()["name"] == "Mood"
+    assert len(client.get("/habits").json()) == 6
+
+    client.patch("/habits/6", json={"name": "Feeling"})
+    assert client.get("/habits/6").json()["name"] == "Feeling"
+    assert client.get("/habits").json()[5]["name"] == "Feeling"
+
+    client.post("/habits/6/options", json={"option_text": "Tired"})
+    assert len(client.get("/habits/6/options").json()) == 4
+    response = client.post(
+        "/log/6", json={"timestamp": "2024-01-01 08:00:00", "option_id": 4}
+    )
+    assert response.status_code == 201
+
+    client.delete(f"/log/{response.json()['id']}")
+    client.delete("/habits/6/options/4")
+    assert len(client.get("/habits/6/options").json()) == 3
+
+    client.delete("/habits/6")
+    assert client.get("/habits/6").status_code == 404
+    assert len(client.get("/habits").json()) == 5
+
+
+def test_lru_evicts_least_recently_used():
+    lru = cache.LRUCache(max_entries=2, ttl=60)
+    lru.get_or_load(1, lambda: "one")
+    lru.get_or_load(2, lambda: "two")
+    lru.get_or_load(1, pytest.fail)  # Hit, makes 2 the oldest
+    lru.get_or_load(3, lambda: "three")
+
+    assert list(lru.entries) == [1, 3]
+    assert lru.stats()["hits"] == 1
+    assert lru.stats()["misses"] == 3
+
+
+def test_entries_expire(monkeypatch: pytest.MonkeyPatch):
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now)
+    lru = cache.LRUCache(max_entries=2, ttl=60)
+    lru.get_or_load(1, lambda: "old")
+
+    now += 61
+    assert lru.get_or_load(1, lambda: "new") == "new"
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    lru = cache.LRUCache(max_entries=2, ttl=60)
+
+    def load():
+        lru.invalidate(1)  # A write committed while the value was being read
+        return "stale"
+
+    assert lru.get_or_load(1, load) == "stale"
+    assert 1 not in lru.entries
@@ -0,0 +1,80 @@
+def test_checkin_logs_every_habit(client, example_habits):
+    response = client.post(
+        "/checkin",
+        json={
+            "date": "2024-01-01",
+            "logs": [
+                {"habit_id": 1},
+                {"habit_id": 3, "status": True},
+                {"habit_id": 4, "amount": 1500},
+                {"habit_id": 6, "option_id": 2},
+            ],
+        },
+    )
+    assert response.status_code == 201
+    body = response.json()
+    assert body["message"] == "Checked in"
+    assert [log["habit_id"] for log in body["logs"]] == [1, 3, 4, 6]
+
+    for log in body["logs"]:
+        [entry] = client.get(f"/log/{log['habit_id']}").json()
+        assert entry["id"] == log["id"]
+        assert entry["timestamp"].startswith("2024-01-01")
+    assert client.get("/log/4").json()[0]["value"] == 1500
+
+    progress = {summary["habit_id"]: summary for summary in body["progress"]}
+    assert progress[1]["current_period"] == {
+        "start": "2024-01-01",
+        "progress": 1,
+        "met": True,
+    }
+    assert progress[1]["current_streak"] == 1
+    assert progress[3]["current_period"]["met"] is False
+    assert progress[4]["current_period"]["progress"] == 1500
+    assert progress[6]["total_logs"] == 1
+
+
+def test_checkin_progress_matches_stats(client, example_habits):
+    for day in ("2024-01-01", "2024-01-02"):
+        response = client.post(
+            "/checkin",
+            json={"date": day, "logs": [{"habit_id": 3}, {"habit_id": 3}]},
+        )
+    progress = response.json()["progress"]
+    assert len(progress) == 1
+    assert progress[0]["current_streak"] == 2
+    assert progress[0]["total_logs"] == 4
+
+    stats = client.get("/habits/3/stats", params={"at": "2024-01-02T12:00:00"})
+    assert stats.json() == progress[0]
+
+
+def test_invalid_checkin_logs_nothing(client, example_habits):
+    client.post(
+        "/habits/new",
+        json={"type": "choice", "name": "Other", "options": [{"option_text": "A"}]},
+    )
+    response = client.post(
+        "/checkin",
+        json={
+            "date": "2024-01-01",
+            "logs": [
+                {"habit_id": 1},
+                {"habit_id": 999},
+                {"habit_id": 1, "amount": 5},
+                {"habit_id": 6, "option_id": 4},
+            ],
+        },
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == [
+        {"row": 1, "detail": "Habit not found"},
+        {"row": 2, "detail": "Habit type mismatch"},
+        {"row": 3, "detail": "Option does not belong to the specified habit"},
+    ]
+    assert client.get("/log/1").json() == []
+
+
+def test_checkin_needs_logs(client, example_habits):
+    response = client.post("/checkin", json={"date": "2024-01-01", "logs": []})
+    assert response.status_code == 422
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import QueuePool, text
+
+import database
+from database import DatabaseSettings
+
+
+def pragma(engine, name):
+    with engine.connect() as conn:
+        return conn.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_settings_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("HABITS_DATABASE_URL", "sqlite:///other.db")
+    monkeypatch.setenv("HABITS_DB_ECHO", "0")
+    monkeypatch.setenv("HABITS_DB_POOL_SIZE", "4")
+    monkeypatch.setenv("HABITS_SQLITE_SYNCHRONOUS", "full")
+
+    settings = DatabaseSettings.from_env()
+    assert settings.url == "sqlite:///other.db"
+    assert settings.echo is False
+    assert settings.pool_size == 4
+    assert settings.synchronous == "FULL"
+    assert settings.wal is True
+    assert settings.async_url == "sqlite+aiosqlite:///other.db"
+
+
+def test_invalid_synchronous_mode(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("HABITS_SQLITE_SYNCHRONOUS", "sometimes")
+    with pytest.raises(ValueError):
+        DatabaseSettings.from_env()
+
+
+def test_pragmas_are_applied_to_every_connection(tmp_path):
+    settings = DatabaseSettings(
+        url=f"sqlite:///{tmp_path / 'habits.db'}", echo=False, busy_timeout=1234
+    )
+    engine = database.create_engine(settings)
+
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 1  # NORMAL
+    assert pragma(engine, "foreign_keys") == 1
+    assert pragma(engine, "busy_timeout") == 1234
+    assert pragma(engine, "cache_size") == settings.cache_size
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == settings.pool_size
+
+
+def test_wal_can_be_turned_off(tmp_path):
+    settings = DatabaseSettings(
+        url=f"sqlite:///{tmp_path / 'habits.db'}", echo=False, wal=False
+    )
+    assert pragma(database.create_engine(settings), "journal_mode") == "delete"
+
+
+def test_in_memory_database_has_no_pool_settings():
+    engine = database.create_engine(DatabaseSettings(url="sqlite://", echo=False))
+    assert pragma(engine, "foreign_keys") == 1
@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import app
+import db_models as d
+import dialects
+import rollups
+import stats
+import versions
+
+
+def postgres_ddl(element) -> str:
+    return str(element.compile(dialect=postgresql.dialect()))
+
+
+def test_postgres_schema():
+    indexes = {str(index.name): index for index in d.LogEntry.__table__.indexes}
+    assert "USING brin (timestamp)" in postgres_ddl(
+        CreateIndex(indexes["ix_habit_logs_timestamp"])
+    )
+    assert postgres_ddl(
+        CreateIndex(indexes["ux_habit_logs_habit_id_client_id"])
+    ).endswith("WHERE client_id IS NOT NULL")
+    assert "habit_type habit_type NOT NULL" in postgres_ddl(
+        CreateTable(d.LogEntry.__table__)
+    )
+    assert "target_timeframe timeframe" in postgres_ddl(
+        CreateTable(d.CompletionHabit.__table__)
+    )
+    assert "value BIGINT NOT NULL" in postgres_ddl(
+        CreateTable(d.MeasureableLogEntry.__table__)
+    )
+    assert "total BIGINT NOT NULL" in postgres_ddl(
+        CreateTable(d.PeriodRollup.__table__)
+    )
+
+
+def test_amounts_past_32_bits(client, example_habits):
+    for hour in (8, 20):
+        response = client.post(
+            "/log/4",
+            json={"timestamp": f"2024-01-01 {hour:02}:00:00", "amount": 2_000_000_000},
+        )
+        assert response.status_code == 201
+    summary = client.get("/habits/4/stats?at=2024-01-01T12:00:00").json()
+    assert summary["current_period"]["progress"] == 4_000_000_000
+
+
+def test_bump_upserts_versions(client, example_habits):
+    with app.db() as session:
+        first = versions.bump(session, 1, 2)
+        second = versions.bump(session, 2)
+        session.commit()
+        assert second == first + 1
+        assert versions.current(session, 1) == first
+        assert versions.current(session, 2) == second
+
+
+def test_large_bulk_imports(client, example_habits, monkeypatch):
+    # Through COPY on PostgreSQL (HABITS_TEST_DATABASE_URL), RETURNING otherwise
+    monkeypatch.setattr(dialects, "COPY_MIN_ROWS", 2)
+    rows = [
+        {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True},
+        {
+            "habit_id": 1,
+            "timestamp": "2024-01-02 08:00:00",
+            "status": False,
+            "client_id": "a\tb\\c",
+        },
+        {"habit_id": 4, "timestamp": "2024-01-01 09:00:00", "amount": 500},
+        {"habit_id": 4, "timestamp": "2024-01-02 09:00:00", "amount": 250},
+        {"habit_id": 6, "timestamp": "2024-01-01 10:00:00", "option_id": 2},
+        {"habit_id": 6, "timestamp": "2024-01-02 10:00:00", "option_id": 3},
+    ]
+    response = client.post("/log/bulk", json=rows)
+    assert response.json()["inserted"] == 6
+
+    completion = client.get("/log/1").json()
+    assert [(log["status"], log["client_id"]) for log in completion] == [
+        (True, None),
+        (False, "a\tb\\c"),
+    ]
+    assert [log["value"] for log in client.get("/log/4").json()] == [500, 250]
+    assert [log["option"]["id"] for log in client.get("/log/6").json()] == [2, 3]
+    # Logged after the import, so the ids were taken from the sequence
+    response = client.post(
+        "/log/1", json={"timestamp": "2024-01-03 08:00:00", "status": True}
+    )
+    assert response.status_code == 201
+    assert (
+        client.get("/habits/4/stats?at=2024-01-01T12:00:00").json()["current_period"][
+            "progress"
+        ]
+        == 500
+    )
+
+
+@pytest.mark.skipif(
+    not os.environ.get("HABITS_TEST_DATABASE_URL", "").startswith("postgresql"),
+    reason="SQLite has a single writer",
+)
+def test_concurrent_logs_keep_stats_exact(client, example_habits):
+    def log(_):
+        with app.db() as session:
+            habit = session.get_one(d.Habit, 4)
+            entry = d.MeasureableLogEntry(
+                habit_id=4, timestamp=datetime(2024, 1, 1, 8), value=1
+            )
+            session.add(entry)
+            session.flush()
+            stats.apply_log_change(session, habit, added=rollups.log_point(entry))
+            session.commit()
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(log, range(40)))
+
+    summary = client.get("/habits/4/stats?at=2024-01-01T12:00:00").json()
+    assert summary["total_logs"] == 40
+    assert summary["current_period"]["progress"] == 40
+
+
+@pytest.mark.skipif(
+    not os.environ.get("HABITS_TEST_DATABASE_URL", "").startswith("postgresql"),
+    reason="SQLite has a single writer",
+)
+def test_concurrent_upserts_log_once(client, example_habits):
+    def upsert(hour):
+        log = {"timestamp": f"2024-01-01 {hour:02}:00:00", "status": True}
+        return client.post("/log/1?upsert=true", json=log).status_code
+
+    with ThreadPoolExecutor(8) as pool:
+        assert sorted(set(pool.map(upsert, range(16)))) == [200, 201]
+
+    assert len(client.get("/log/1").json()) == 1
+    assert (
+        client.get("/habits/1/stats?at=2024-01-01T12:00:00").json()["total_logs"] == 1
+    )
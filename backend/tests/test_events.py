@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import events
+
+
+def collect(client, requests, habit_id=None):
+    """
+    Subscribe, make `requests` (method, url, body) from a worker thread like a real client would
+    and return the events that were published meanwhile.
+    """
+
+    async def run():
+        subscriber = events.broker.subscribe(habit_id)
+        try:
+            for method, url, body in requests:
+                await asyncio.to_thread(client.request, method, url, json=body)
+            await asyncio.sleep(0)  # Let the deliveries scheduled by the writes run
+            received = []
+            while not subscriber.queue.empty():
+                received.append(subscriber.queue.get_nowait())
+            return received
+        finally:
+            events.broker.unsubscribe(subscriber)
+
+    return asyncio.run(run())
+
+
+def test_writes_publish_compact_events(client, example_habits):
+    received = collect(
+        client,
+        [
+            ("post", "/log/6", {"timestamp": "2024-01-01 08:00:00", "option_id": 1}),
+            ("patch", "/habits/6/options/1", {"color": "orange"}),
+            ("delete", "/habits/2", None),
+        ],
+    )
+    assert [(e["kind"], e["action"], e["habit_id"], e.get("id")) for e in received] == [
+        ("log", "created", 6, 1),
+        ("option", "updated", 6, 1),
+        ("habit", "deleted", 2, None),
+    ]
+    versions = [event["version"] for event in received]
+    assert versions == sorted(versions)
+
+
+def test_failed_writes_publish_nothing(client, example_habits):
+    received = collect(
+        client,
+        [
+            ("post", "/log/42", {"timestamp": "2024-01-01 08:00:00", "status": True}),
+            ("delete", "/log/42", None),
+        ],
+    )
+    assert received == []
+
+
+def test_bulk_import_publishes_one_event_per_habit(client, example_habits):
+    rows = [
+        {"habit_id": 1, "timestamp": f"2024-01-0{day} 08:00:00", "status": True}
+        for day in range(1, 4)
+    ]
+    received = collect(client, [("post", "/log/bulk", rows)])
+    assert [(e["kind"], e["action"], e["count"]) for e in received] == [
+        ("log", "imported", 3)
+    ]
+
+
+def test_subscribers_can_follow_one_habit(client, example_habits):
+    received = collect(
+        client,
+        [
+            ("post", "/log/1", {"timestamp": "2024-01-01 08:00:00", "status": True}),
+            ("post", "/log/3", {"timestamp": "2024-01-01 08:00:00", "status": True}),
+        ],
+        habit_id=3,
+    )
+    assert [event["habit_id"] for event in received] == [3]
+
+
+def test_slow_subscriber_is_reset(monkeypatch):
+    monkeypatch.setattr(events, "QUEUE_SIZE", 2)
+
+    async def run():
+        subscriber = events.broker.subscribe()
+        events.broker.publish([{"kind": "log", "version": n} for n in range(5)])
+        await asyncio.sleep(0)
+        chunks = [
+            chunk
+            async for chunk in events.stream(
+                subscriber, lambda: asyncio.sleep(0, False)
+            )
+        ]
+        return subscriber, chunks
+
+    subscriber, chunks = asyncio.run(run())
+    assert subscriber.overflowed
+    assert subscriber not in events.broker.subscribers
+    assert chunks == [
+        ": connected\n\n",
+        'event: reset\ndata: {"kind":"reset"}\n\n',
+    ]
+
+
+def test_encode_is_valid_sse():
+    event = {"kind": "habit", "action": "created", "habit_id": 7, "version": 12}
+    lines = events.encode(event).splitlines()
+    assert lines[:2] == ["id: 12", "event: habit"]
+    assert json.loads(lines[2].removeprefix("data: ")) == event
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+
+import pytest
+
+import app
+import export
+
+
+@pytest.fixture
+def example_logs(client, example_habits):
+    for log in [
+        {"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True},
+        {"habit_id": 4, "timestamp": "2024-01-01 09:00:00", "amount": 500},
+        {"habit_id": 6, "timestamp": "2024-01-01 10:00:00", "option_id": 2},
+    ]:
+        assert client.post("/log/bulk", json=[log]).json()["inserted"] == 1
+
+
+def test_export_ndjson(client, example_logs):
+    response = client.get("/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.headers["content-disposition"].startswith("attachment;")
+
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [record["kind"] for record in records] == ["habit"] * 6 + ["option"] * 3 + [
+        "log"
+    ] * 3
+
+    # Habits and options match what the API returns for them
+    habits = client.get("/habits").json()
+    assert [
+        {k: v for k, v in record.items() if k != "kind"} for record in records[:6]
+    ] == [{k: v for k, v in habit.items() if k != "options"} for habit in habits]
+    assert {k: v for k, v in records[6].items() if k != "kind"} == habits[5]["options"][
+        0
+    ]
+
+    assert records[9:] == [
+        {
+            "kind": "log",
+            "id": 1,
+            "habit_id": 1,
+            "timestamp": "2024-01-01 08:00:00",
+            "habit_type": "completion",
+            "status": True,
+        },
+        {
+            "kind": "log",
+            "id": 2,
+            "habit_id": 4,
+            "timestamp": "2024-01-01 09:00:00",
+            "habit_type": "measurable",
+            "value": 500,
+        },
+        {
+            "kind": "log",
+            "id": 3,
+            "habit_id": 6,
+            "timestamp": "2024-01-01 10:00:00",
+            "habit_type": "choice",
+            "option_id": 2,
+        },
+    ]
+
+
+def test_export_csv(client, example_logs):
+    response = client.get("/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 12
+    assert rows[3]["name"] == "Water Intake"
+    assert rows[3]["unit"] == "ml"
+    assert rows[-2]["value"] == "500"
+    assert rows[-1]["option_id"] == "2"
+
+
+def test_export_streams_in_batches(client, example_habits, monkeypatch):
+    monkeypatch.setattr(export, "BATCH_SIZE", 4)
+    client.post(
+        "/log/bulk",
+        json=[
+            {"habit_id": 4, "timestamp": f"2024-01-{day:02} 09:00:00", "amount": day}
+            for day in range(1, 21)
+        ],
+    )
+
+    chunks = list(export.stream(app.db, export.ExportFormat.NDJSON))
+    # 6 habits, 3 options and 20 logs in batches of 4
+    assert len(chunks) == 8
+    assert sum(chunk.count("\n") for chunk in chunks) == 29
+
+
+def test_export_empty_database(client):
+    assert client.get("/export").text == ""
+    assert client.get("/export", params={"format": "csv"}).text.startswith("kind,id,")
@@ -0,0 +1,91 @@
+import base64
+import struct
+
+
+def decode_bitset(data, days):
+    bits = base64.b64decode(data)
+    return [bool(bits[i // 8] & (1 << (i % 8))) for i in range(days)]
+
+
+def decode_int32(data, days):
+    return list(struct.unpack(f"<{days}i", base64.b64decode(data)))
+
+
+def decode_int64(data, days):
+    return list(struct.unpack(f"<{days}q", base64.b64decode(data)))
+
+
+def test_heatmap_encodes_every_habit(client, example_habits):
+    logs = [
+        (1, {"timestamp": "2024-01-01 08:00:00", "status": True}),
+        (1, {"timestamp": "2024-01-03 08:00:00", "status": False}),
+        (1, {"timestamp": "2024-01-10 08:00:00", "status": True}),
+        (4, {"timestamp": "2024-01-02 08:00:00", "amount": 500}),
+        (4, {"timestamp": "2024-01-02 20:00:00", "amount": 250}),
+        (6, {"timestamp": "2024-01-01 20:00:00", "option_id": 2}),
+        (6, {"timestamp": "2024-01-01 08:00:00", "option_id": 1}),
+        (6, {"timestamp": "2024-01-04 08:00:00", "option_id": 3}),
+        # Outside the range
+        (1, {"timestamp": "2024-01-11 00:00:00", "status": True}),
+    ]
+    for habit_id, body in logs:
+        assert client.post(f"/log/{habit_id}", json=body).status_code == 201
+
+    response = client.get(
+        "/habits/heatmap", params={"from": "2024-01-01", "to": "2024-01-10"}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["from"], body["to"], body["days"]) == ("2024-01-01", "2024-01-10", 10)
+    by_id = {habit["habit_id"]: habit for habit in body["habits"]}
+    assert sorted(by_id) == [1, 2, 3, 4, 5, 6]
+
+    assert by_id[1]["encoding"] == "bitset"
+    assert decode_bitset(by_id[1]["data"], 10) == [True] + [False] * 8 + [True]
+    assert decode_bitset(by_id[2]["data"], 10) == [False] * 10
+    assert by_id[4]["encoding"] == "int64"
+    assert decode_int64(by_id[4]["data"], 10) == [0, 750] + [0] * 8
+    # The option logged last that day wins
+    assert decode_int32(by_id[6]["data"], 10) == [2, 0, 0, 3] + [0] * 6
+
+
+def test_heatmap_sums_past_32_bits(client, example_habits):
+    for hour in (8, 20):
+        client.post(
+            "/log/4",
+            json={"timestamp": f"2024-01-01 {hour:02}:00:00", "amount": 2_000_000_000},
+        )
+    response = client.get(
+        "/habits/heatmap", params={"from": "2024-01-01", "to": "2024-01-01"}
+    )
+    by_id = {habit["habit_id"]: habit for habit in response.json()["habits"]}
+    assert decode_int64(by_id[4]["data"], 1) == [4_000_000_000]
+
+
+def test_heatmap_uses_one_log_query(client, example_habits, count_queries):
+    for day in range(1, 29):
+        client.post(
+            "/log/1", json={"timestamp": f"2024-02-{day:02} 08:00:00", "status": True}
+        )
+    client.get("/habits")  # Warms up the habit cache
+
+    with count_queries() as statements:
+        client.get("/habits/heatmap", params={"from": "2024-01-01", "to": "2024-12-31"})
+    assert len(statements) == 1
+
+
+def test_heatmap_rejects_bad_ranges(client, example_habits):
+    response = client.get(
+        "/habits/heatmap", params={"from": "2024-02-01", "to": "2024-01-01"}
+    )
+    assert response.status_code == 400
+    response = client.get(
+        "/habits/heatmap", params={"from": "2000-01-01", "to": "2024-01-01"}
+    )
+    assert response.status_code == 400
+
+
+def test_heatmap_defaults_to_last_year(client, example_habits):
+    body = client.get("/habits/heatmap").json()
+    assert body["days"] == 365
+    assert len(base64.b64decode(body["habits"][0]["data"])) == 46
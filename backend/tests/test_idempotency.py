@@ -0,0 +1,109 @@
+def log_water(client, **kwargs):
+    return client.post(
+        "/log/4", json={"timestamp": "2024-01-01 08:00:00", "amount": 250}, **kwargs
+    )
+
+
+def test_retry_with_idempotency_key_logs_once(client, example_habits):
+    headers = {"Idempotency-Key": "phone-1"}
+    first = log_water(client, headers=headers)
+    assert first.status_code == 201
+
+    retry = log_water(client, headers=headers)
+    assert retry.status_code == 200
+    assert retry.json() == {"message": "Already logged", "id": first.json()["id"]}
+
+    logs = client.get("/log/4").json()
+    assert len(logs) == 1
+    assert logs[0]["client_id"] == "phone-1"
+    stats = client.get("/habits/4/stats", params={"at": "2024-01-01T12:00:00"})
+    assert stats.json()["current_period"]["progress"] == 250
+
+
+def test_retry_with_client_id_logs_once(client, example_habits):
+    log = {"timestamp": "2024-01-01 08:00:00", "status": True, "client_id": "abc"}
+    first = client.post("/log/1", json=log)
+    assert client.post("/log/1", json=log).json()["id"] == first.json()["id"]
+    assert len(client.get("/log/1").json()) == 1
+
+    # Client ids are unique per habit
+    assert client.post("/log/2", json=log).status_code == 201
+
+
+def test_client_id_must_match_header(client, example_habits):
+    response = client.post(
+        "/log/1",
+        json={"timestamp": "2024-01-01 08:00:00", "status": True, "client_id": "a"},
+        headers={"Idempotency-Key": "b"},
+    )
+    assert response.status_code == 400
+
+
+def test_client_id_cant_be_patched(client, example_habits):
+    id = log_water(client, headers={"Idempotency-Key": "phone-1"}).json()["id"]
+    response = client.patch(f"/log/{id}", json={"client_id": "other"})
+    assert response.status_code == 422
+
+
+def test_completion_upsert_updates_the_days_log(client, example_habits):
+    first = client.post(
+        "/log/1",
+        params={"upsert": True},
+        json={"timestamp": "2024-01-01 08:00:00", "status": False},
+    )
+    assert first.status_code == 201
+    second = client.post(
+        "/log/1",
+        params={"upsert": True},
+        json={"timestamp": "2024-01-01 21:00:00", "status": True},
+    )
+    assert second.status_code == 200
+    assert second.json() == {"message": "Habit log updated", "id": first.json()["id"]}
+
+    [log] = client.get("/log/1").json()
+    assert (log["timestamp"], log["status"]) == ("2024-01-01 21:00:00", True)
+    stats = client.get("/habits/1/stats", params={"at": "2024-01-01T22:00:00"}).json()
+    assert stats["current_period"]["met"] is True
+    assert stats["total_logs"] == 1
+
+    # Another day gets its own log
+    client.post(
+        "/log/1",
+        params={"upsert": True},
+        json={"timestamp": "2024-01-02 08:00:00", "status": True},
+    )
+    assert len(client.get("/log/1").json()) == 2
+
+
+def test_upsert_only_for_completion_habits(client, example_habits):
+    assert log_water(client, params={"upsert": True}).status_code == 400
+
+
+def test_bulk_import_skips_logged_client_ids(client, example_habits):
+    rows = [
+        {
+            "habit_id": 4,
+            "timestamp": "2024-01-01 08:00:00",
+            "amount": 1,
+            "client_id": "a",
+        },
+        {
+            "habit_id": 4,
+            "timestamp": "2024-01-01 09:00:00",
+            "amount": 2,
+            "client_id": "b",
+        },
+        {
+            "habit_id": 4,
+            "timestamp": "2024-01-01 09:00:00",
+            "amount": 2,
+            "client_id": "b",
+        },
+    ]
+    response = client.post("/log/bulk", json=rows)
+    assert response.json()["inserted"] == 2
+    assert response.json()["errors"] == [{"row": 2, "detail": "Already logged"}]
+
+    retry = client.post("/log/bulk", json=rows)
+    assert retry.json()["inserted"] == 0
+    assert len(client.get("/log/4").json()) == 2
@@ -17,6 +17,7 @@ def test_correct_completion_log_entry_creation(client, example_habits):
         "id": 1,
         "habit_id": 1,
         "timestamp": "2024-01-01 00:00:00",
+        "client_id": None,
         "status": True,
         "habit_type": "completion",
     }
@@ -38,6 +39,7 @@ def test_correct_measureable_log_entry_creation(client, example_habits):
         "id": 1,
         "habit_id": 4,
         "timestamp": "2024-01-01 00:00:00",
+        "client_id": None,
         "value": 1500,
         "habit_type": "measurable",
     }
@@ -59,6 +61,7 @@ def test_correct_choice_log_entry_creation(client, example_habits):
         "id": 1,
         "habit_id": 6,
         "timestamp": "2024-01-01 00:00:00",
+        "client_id": None,
         "option_id": 1,
         "option": {
             "id": 1,
@@ -190,3 +193,70 @@ def test_get_logs_for_nonexistent_habit(client):
     response = client.get("/log/999")
     assert response.status_code == 404
     assert response.json()["detail"] == "Habit not found"
+
+
+def test_get_logs_time_window(client, example_habits):
+    for day in range(1, 6):
+        response = client.post(
+            "/log/1", json={"timestamp": f"2024-01-0{day} 08:00:00", "status": True}
+        )
+        assert response.status_code == 201
+
+    response = client.get(
+        "/log/1",
+        params={"since": "2024-01-02 00:00:00", "until": "2024-01-04 08:00:00"},
+    )
+    assert response.status_code == 200
+    assert [log["timestamp"] for log in response.json()] == [
+        "2024-01-02 08:00:00",
+        "2024-01-03 08:00:00",
+    ]
+
+
+def test_get_logs_keyset_pagination(client, example_habits):
+    # Several entries share a timestamp, so the cursor has to break ties on id
+    timestamps = ["2024-01-02 00:00:00"] * 3 + ["2024-01-01 00:00:00"] * 2
+    for timestamp in timestamps:
+        response = client.post("/log/4", json={"timestamp": timestamp, "amount": 100})
+        assert response.status_code == 201
+
+    seen = []
+    cursor = None
+    for _ in range(10):
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/log/4", params=params)
+        assert response.status_code == 200
+        seen.extend((log["timestamp"], log["id"]) for log in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert seen == [
+        ("2024-01-01 00:00:00", 4),
+        ("2024-01-01 00:00:00", 5),
+        ("2024-01-02 00:00:00", 1),
+        ("2024-01-02 00:00:00", 2),
+        ("2024-01-02 00:00:00", 3),
+    ]
+
+
+def test_get_logs_no_cursor_on_last_page(client, example_habits):
+    client.post("/log/1", json={"timestamp": "2024-01-01 00:00:00", "status": True})
+    response = client.get("/log/1", params={"limit": 1})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_logs_empty_window_for_existing_habit(client, example_habits):
+    response = client.get("/log/1", params={"since": "2030-01-01 00:00:00"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@pytest.mark.parametrize("params", [{"cursor": "not-a-cursor"}, {"limit": 0}])
+def test_get_logs_invalid_page_parameters(client, example_habits, params):
+    response = client.get("/log/1", params=params)
+    assert response.status_code == 400
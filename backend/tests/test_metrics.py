@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import app
+import metrics
+
+
+@pytest.fixture
+def enabled(tmp_path):
+    engine = app.db.kw["bind"]
+    metrics.registry.clear()
+    metrics.enable(engine, profile_dir=tmp_path)
+    yield tmp_path
+    metrics.disable(engine)
+    metrics.registry.clear()
+
+
+def sample(text: str, name: str, labels: str = "") -> float:
+    key = f"{name}{{{labels}}}" if labels else name
+    for line in text.splitlines():
+        if line.rsplit(" ", 1)[0] == key:
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{key} not in metrics")
+
+
+HABIT_OK = 'method="GET",route="/habits/{id}",status="200"'
+
+
+def test_metrics_disabled_by_default(client):
+    assert client.get("/metrics").status_code == 404
+    assert "server-timing" not in client.get("/habits").headers
+
+
+def test_requests_are_recorded_per_route(client, example_habits, enabled):
+    client.get("/habits/1")
+    client.get("/habits/2")
+    client.get("/habits/999")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert "# TYPE habits_request_duration_seconds histogram" in text
+
+    # Ids are folded into the route template
+    assert sample(text, "habits_request_duration_seconds_count", HABIT_OK) == 2
+    assert (
+        sample(text, "habits_request_duration_seconds_bucket", HABIT_OK + ',le="+Inf"')
+        == 2
+    )
+    assert sample(text, "habits_request_sql_queries_count", HABIT_OK) == 2
+    assert sample(text, "habits_request_sql_queries_sum", HABIT_OK) > 0
+    not_found = 'method="GET",route="/habits/{id}",status="404"'
+    assert sample(text, "habits_request_duration_seconds_count", not_found) == 1
+    assert sample(text, "habits_cache_misses_total") >= 2
+
+
+def test_serialization_time_is_recorded(client, example_habits, enabled):
+    client.post("/log/4", json={"timestamp": "2024-01-01 08:00:00", "amount": 5})
+    client.get("/log/4")
+    text = client.get("/metrics").text
+    labels = 'method="GET",route="/log/{habit_id}",status="200"'
+    assert sample(text, "habits_request_serialize_seconds_total", labels) > 0
+
+
+def test_server_timing_header(client, example_habits, enabled, count_queries):
+    with count_queries() as statements:
+        timing = client.get("/log/1").headers["server-timing"]
+    assert timing.startswith("sql;dur=")
+    assert f'desc="{len(statements)} queries"' in timing
+    assert "total;dur=" in timing
+
+
+def test_profile_dump(client, example_habits, enabled, count_queries):
+    client.get("/habits/1")
+    assert list(enabled.iterdir()) == []
+
+    with count_queries() as statements:
+        client.get("/log/1", headers={"X-Profile": "1", "X-Request-ID": "abc"})
+    [dump] = enabled.iterdir()
+    profile = json.loads(dump.read_text())
+    assert profile["route"] == "/log/{habit_id}"
+    assert profile["request_id"] == "abc"
+    assert profile["path"] == "/log/1"
+    assert profile["status"] == 200
+    assert [query["statement"] for query in profile["queries"]] == statements
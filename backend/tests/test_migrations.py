@@ -0,0 +1,249 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+import database
+import db_models as d
+import migrations
+from database import DatabaseSettings
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'habits.db'}")
+
+
+# The schema of the first release, before any migration existed
+BASELINE_SCHEMA = [
+    (
+        "CREATE TABLE habits (id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+        "habit_type VARCHAR(10) NOT NULL, PRIMARY KEY (id))"
+    ),
+    (
+        "CREATE TABLE completion_habits (id INTEGER NOT NULL, completion_target INTEGER NOT NULL, "
+        "target_timeframe VARCHAR(5) NOT NULL, PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES habits (id))"
+    ),
+    (
+        "CREATE TABLE measureable_habits (id INTEGER NOT NULL, target INTEGER NOT NULL, "
+        "completion_target VARCHAR(5) NOT NULL, unit VARCHAR(50) NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(id) REFERENCES habits (id))"
+    ),
+    (
+        "CREATE TABLE choice_habits (id INTEGER NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(id) REFERENCES habits (id))"
+    ),
+    (
+        "CREATE TABLE habit_logs (id INTEGER NOT NULL, habit_id INTEGER NOT NULL, "
+        "timestamp DATETIME NOT NULL, habit_type VARCHAR(10) NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(habit_id) REFERENCES habits (id) ON DELETE CASCADE)"
+    ),
+    (
+        "CREATE TABLE choice_options (id INTEGER NOT NULL, habit_id INTEGER NOT NULL, "
+        "option_text VARCHAR(255) NOT NULL, color VARCHAR(20), icon VARCHAR(50), PRIMARY KEY (id), "
+        "FOREIGN KEY(habit_id) REFERENCES choice_habits (id) ON DELETE CASCADE)"
+    ),
+    (
+        "CREATE TABLE completion_logs (id INTEGER NOT NULL, status BOOLEAN NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES habit_logs (id))"
+    ),
+    (
+        "CREATE TABLE measureable_logs (id INTEGER NOT NULL, value INTEGER NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES habit_logs (id))"
+    ),
+    (
+        "CREATE TABLE choice_logs (id INTEGER NOT NULL, option_id INTEGER NOT NULL, "
+        "PRIMARY KEY (id), FOREIGN KEY(id) REFERENCES habit_logs (id), "
+        "FOREIGN KEY(option_id) REFERENCES choice_options (id))"
+    ),
+]
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_fresh_database_is_stamped_with_latest_version(engine):
+    assert migrations.migrate(engine) == len(migrations.MIGRATIONS)
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == len(migrations.MIGRATIONS)
+    assert "ix_habit_logs_habit_id_timestamp" in index_names(engine, "habit_logs")
+
+
+def test_existing_database_picks_up_log_indexes(engine):
+    # Simulate a database created before the indexes existed
+    d.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for table in ("habit_logs", "choice_logs", "choice_options"):
+            for name in index_names(engine, table):
+                conn.execute(text(f"DROP INDEX {name}"))
+    assert index_names(engine, "habit_logs") == set()
+
+    migrations.migrate(engine)
+
+    assert index_names(engine, "habit_logs") == {
+        "ix_habit_logs_habit_id_timestamp",
+        "ix_habit_logs_timestamp",
+        "ix_habit_logs_user_id_timestamp",
+        "ux_habit_logs_habit_id_client_id",
+    }
+    assert index_names(engine, "choice_logs") == {"ix_choice_logs_option_id"}
+    assert index_names(engine, "choice_options") == {"ix_choice_options_habit_id"}
+
+
+@pytest.mark.parametrize("version", [0, 2])
+def test_baseline_database_upgrades(engine, version):
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        # Stamped by a release that only ran the first migrations
+        migrations.metadata.create_all(conn)
+        d.Base.metadata.create_all(
+            conn, tables=[d.PeriodRollup.__table__, d.HabitStats.__table__]
+        )
+        conn.execute(migrations.schema_version.insert().values(version=version))
+        for migration in migrations.MIGRATIONS[:version]:
+            migration(conn)
+        conn.execute(text("INSERT INTO habits VALUES (1, 'Medicine', 'COMPLETION')"))
+        conn.execute(text("INSERT INTO completion_habits VALUES (1, 1, 'DAY')"))
+        conn.execute(
+            text(
+                "INSERT INTO habit_logs VALUES (1, 1, '2024-01-01 08:00:00', 'COMPLETION')"
+            )
+        )
+        conn.execute(text("INSERT INTO completion_logs VALUES (1, 1)"))
+
+    assert migrations.migrate(engine) == len(migrations.MIGRATIONS)
+
+    with engine.connect() as conn:
+        log = conn.execute(text("SELECT user_id, client_id FROM habit_logs")).one()
+    assert tuple(log) == (d.DEFAULT_USER_ID, None)
+    assert index_names(engine, "habit_logs") == {
+        index.name for index in d.LogEntry.__table__.indexes
+    }
+
+
+def test_log_ids_are_never_reused(tmp_path):
+    # With foreign keys enforced, as on every engine the app creates
+    engine = database.create_engine(
+        DatabaseSettings(url=f"sqlite:///{tmp_path / 'habits.db'}")
+    )
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO habits VALUES (1, 'Medicine', 'COMPLETION')"))
+        conn.execute(text("INSERT INTO completion_habits VALUES (1, 1, 'DAY')"))
+        for id in (1, 2):
+            conn.execute(
+                text(
+                    f"INSERT INTO habit_logs VALUES ({id}, 1, '2024-01-0{id} 08:00:00', 'COMPLETION')"
+                )
+            )
+            conn.execute(text(f"INSERT INTO completion_logs VALUES ({id}, 1)"))
+
+    migrations.migrate(engine)
+
+    with engine.begin() as conn:
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+        # The children still reference the rebuilt table
+        conn.execute(text("DELETE FROM completion_logs WHERE id = 2"))
+        conn.execute(text("DELETE FROM habit_logs WHERE id = 2"))
+        with pytest.raises(IntegrityError), conn.begin_nested():
+            conn.execute(text("DELETE FROM habit_logs WHERE id = 1"))
+        conn.execute(
+            text(
+                "INSERT INTO habit_logs (habit_id, timestamp, habit_type) "
+                "VALUES (1, '2024-01-03 08:00:00', 'COMPLETION')"
+            )
+        )
+        ids = conn.execute(text("SELECT id FROM habit_logs")).scalars().all()
+    assert ids == [1, 3]
+    engine.dispose()
+
+
+def test_migrate_is_idempotent(engine):
+    migrations.migrate(engine)
+    migrations.migrate(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(migrations.schema_version.select()).all()
+    assert len(rows) == 1
+
+
+def test_rollups_gain_min_max_columns(engine):
+    # Simulate a database from before rollups tracked min and max
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE period_rollups"))
+        conn.execute(
+            text(
+                "CREATE TABLE period_rollups (habit_id INTEGER, timeframe VARCHAR(5), period_start DATE, "
+                "count INTEGER, total INTEGER, PRIMARY KEY (habit_id, timeframe, period_start))"
+            )
+        )
+        conn.execute(migrations.schema_version.update().values(version=1))
+
+    migrations.migrate(engine)
+
+    columns = {
+        column["name"] for column in inspect(engine).get_columns("period_rollups")
+    }
+    assert {"min_value", "max_value"} <= columns
+
+
+def test_logs_gain_client_id(engine):
+    # Simulate a database from before logs had client ids
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ux_habit_logs_habit_id_client_id"))
+        conn.execute(text("ALTER TABLE habit_logs DROP COLUMN client_id"))
+        conn.execute(migrations.schema_version.update().values(version=2))
+
+    migrations.migrate(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("habit_logs")}
+    assert "client_id" in columns
+    assert "ux_habit_logs_habit_id_client_id" in index_names(engine, "habit_logs")
+
+
+def test_existing_rows_go_to_default_user(engine):
+    # Simulate a database from before users, with a habit, a log and its change
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE habits (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+                "habit_type VARCHAR(10) NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE habit_logs (id INTEGER PRIMARY KEY, habit_id INTEGER NOT NULL, "
+                "timestamp DATETIME NOT NULL, habit_type VARCHAR(10) NOT NULL, client_id VARCHAR(64))"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE sync_changes (kind VARCHAR(6), entity_id INTEGER, habit_id INTEGER, "
+                "seq INTEGER, deleted BOOLEAN, PRIMARY KEY (kind, entity_id))"
+            )
+        )
+        conn.execute(text("INSERT INTO habits VALUES (1, 'Medicine', 'COMPLETION')"))
+        conn.execute(
+            text(
+                "INSERT INTO habit_logs VALUES (1, 1, '2024-01-01 08:00:00', 'COMPLETION', NULL)"
+            )
+        )
+        conn.execute(text("INSERT INTO sync_changes VALUES ('LOG', 1, 1, 2, 0)"))
+        migrations.metadata.create_all(conn)
+        conn.execute(migrations.schema_version.insert().values(version=3))
+
+    migrations.migrate(engine)
+
+    with engine.connect() as conn:
+        for table in ("habits", "habit_logs", "sync_changes"):
+            owners = conn.execute(text(f"SELECT user_id FROM {table}")).scalars().all()
+            assert owners == [d.DEFAULT_USER_ID]
+        assert conn.execute(text("SELECT id FROM users")).scalars().all() == [
+            d.DEFAULT_USER_ID
+        ]
+    key = inspect(engine).get_pk_constraint("sync_changes")["constrained_columns"]
+    assert set(key) == {"user_id", "kind", "entity_id"}
+    assert "ix_sync_changes_user_id_seq" in index_names(engine, "sync_changes")
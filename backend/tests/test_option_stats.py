@@ -0,0 +1,62 @@
+import numpy as np
+
+import option_stats
+
+
+def log_moods(client, moods):
+    # One log per day in January, options 1 Happy, 2 Sad, 3 Neutral
+    for day, option_id in enumerate(moods, start=1):
+        response = client.post(
+            "/log/6",
+            json={"timestamp": f"2024-01-{day:02} 20:00:00", "option_id": option_id},
+        )
+        assert response.status_code == 201
+
+
+def test_option_frequencies_per_period(client, example_habits):
+    # Monday 2024-01-01 to Tuesday 2024-01-09
+    log_moods(client, [1, 2, 1, 1, 3, 2, 1, 2, 2])
+
+    response = client.get("/habits/6/options/stats", params={"timeframe": "week"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [
+        (option["id"], option["option_text"], option["count"])
+        for option in body["options"]
+    ] == [(1, "Happy", 4), (2, "Sad", 4), (3, "Neutral", 1)]
+    assert body["options"][2]["share"] == round(1 / 9, 4)
+    assert body["periods"] == [
+        {"period_start": "2024-01-01", "counts": [4, 2, 1]},
+        {"period_start": "2024-01-08", "counts": [0, 2, 0]},
+    ]
+
+
+def test_transitions(client, example_habits):
+    log_moods(client, [1, 2, 1, 1, 3, 2, 1, 2, 2])
+
+    transitions = client.get("/habits/6/options/stats").json()["transitions"]
+    # After a sad day: happy twice, sad once
+    assert transitions["counts"] == [[1, 2, 1], [2, 1, 0], [0, 1, 0]]
+    assert transitions["probabilities"][1] == [0.6667, 0.3333, 0.0]
+    assert transitions["probabilities"][2] == [0.0, 1.0, 0.0]
+
+
+def test_range_filter(client, example_habits):
+    log_moods(client, [1, 2, 3])
+    response = client.get(
+        "/habits/6/options/stats",
+        params={"since": "2024-01-02T00:00:00", "until": "2024-01-03T00:00:00"},
+    )
+    body = response.json()
+    assert [option["count"] for option in body["options"]] == [0, 1, 0]
+    assert body["transitions"]["counts"] == [[0] * 3] * 3
+
+
+def test_only_for_choice_habits(client, example_habits):
+    assert client.get("/habits/1/options/stats").status_code == 400
+    assert client.get("/habits/42/options/stats").status_code == 404
+
+
+def test_transition_counts_handle_unsorted_ids():
+    counts = option_stats.transition_counts(np.array([30, 10, 30, 30]), [10, 20, 30])
+    assert counts.tolist() == [[0, 0, 1], [0, 0, 0], [1, 0, 1]]
@@ -64,6 +64,14 @@ def test_delete_choice_option(client, example_habits):
     assert all(option["option_text"] != "Sad" for option in habit["options"])
 
 
+def test_delete_choice_option_in_use(client, example_habits):
+    client.post("/log/6", json={"timestamp": "2024-01-01 08:00:00", "option_id": 2})
+    response = client.delete("/habits/6/options/2")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Option is used by log entries"
+    assert len(client.get("/habits/6/options").json()) == 3
+
+
 def test_delete_choice_option_invalid_habit(client, example_habits):
     # Try to delete an option from a non-choice habit
     response = client.delete("/habits/1/options/1")
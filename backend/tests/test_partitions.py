@@ -0,0 +1,178 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import app
+import db_models as d
+import manage
+import partitions
+from database import DatabaseSettings
+
+
+@pytest.fixture
+def file_db(tmp_path, monkeypatch):
+    """
+    A database file, which unlike the in-memory one can have archives next to it.
+    """
+    engine = d.get_engine(DatabaseSettings(url=f"sqlite:///{tmp_path}/app.db"))
+    monkeypatch.setattr(app, "db", sessionmaker(bind=engine))
+    yield tmp_path
+    for db in partitions.engines.values():
+        db.kw["bind"].dispose()
+    partitions.engines.clear()
+    engine.dispose()
+
+
+def log_history(client):
+    # Two logs a year for the water (4) and mood (6) habits, 2022 to 2024
+    for year in (2022, 2023, 2024):
+        for month, amount, option_id in ((3, 500, 1), (9, 250, 2)):
+            timestamp = f"{year}-{month:02}-01 08:00:00"
+            client.post("/log/4", json={"timestamp": timestamp, "amount": amount})
+            client.post("/log/6", json={"timestamp": timestamp, "option_id": option_id})
+
+
+def compact(before: int) -> dict[int, int]:
+    with app.db() as session:
+        return manage.compact(session, before, vacuum=True)
+
+
+def test_compact_moves_old_logs(client, file_db, example_habits):
+    log_history(client)
+    before = {
+        path: client.get(path).json()
+        for path in (
+            "/log/6",
+            "/habits/4/analytics",
+            "/habits/4/rollups?timeframe=month",
+            "/habits/6/options/stats",
+            "/habits/heatmap?from=2023-01-01&to=2023-12-31",
+        )
+    }
+
+    assert compact(2024) == {2022: 4, 2023: 4}
+    assert sorted(path.name for path in (file_db / "app-archive").iterdir()) == [
+        "logs-2022.db",
+        "logs-2023.db",
+    ]
+    with app.db() as session:
+        assert session.query(d.LogEntry).count() == 4
+    for path, body in before.items():
+        assert client.get(path).json() == body, path
+
+    with app.db() as session:
+        session.execute(d.PeriodRollup.__table__.delete())
+        session.commit()
+        manage.rebuild_rollups(session)
+    assert (
+        client.get("/habits/4/rollups?timeframe=month").json()
+        == before["/habits/4/rollups?timeframe=month"]
+    )
+    records = client.get("/export").text.splitlines()
+    assert sum('"kind": "log"' in record for record in records) == 12
+    # Nothing left to move
+    assert compact(2024) == {}
+
+
+def test_pages_span_archives(client, file_db, example_habits):
+    log_history(client)
+    compact(2024)
+    # Logged late into an archived year, so it stays in the main database
+    client.post("/log/6", json={"timestamp": "2022-06-01 08:00:00", "option_id": 3})
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2} | ({"cursor": cursor} if cursor else {})
+        response = client.get("/log/6", params=params)
+        seen += [(log["timestamp"], log["option"]["id"]) for log in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+    assert seen == [
+        ("2022-03-01 08:00:00", 1),
+        ("2022-06-01 08:00:00", 3),
+        ("2022-09-01 08:00:00", 2),
+        ("2023-03-01 08:00:00", 1),
+        ("2023-09-01 08:00:00", 2),
+        ("2024-03-01 08:00:00", 1),
+        ("2024-09-01 08:00:00", 2),
+    ]
+
+
+def test_ids_of_archived_logs_are_not_reused(client, file_db, example_habits):
+    for day in (1, 2, 3):
+        client.post(
+            "/log/1", json={"timestamp": f"2025-01-0{day} 08:00:00", "status": True}
+        )
+    # Imported history gets the highest ids, which compaction then takes out of the table
+    rows = [
+        {"habit_id": 1, "timestamp": f"2020-01-0{day} 08:00:00", "status": True}
+        for day in (1, 2, 3)
+    ]
+    assert client.post("/log/bulk", json=rows).json()["inserted"] == 3
+    compact(2024)
+
+    response = client.post(
+        "/log/1", json={"timestamp": "2025-01-04 08:00:00", "status": True}
+    )
+    assert response.json()["id"] == 7
+    logs = client.get("/log/1").json()
+    assert len(logs) == len({log["id"] for log in logs}) == 7
+
+
+def test_recent_reads_skip_archives(client, file_db, example_habits, monkeypatch):
+    log_history(client)
+    compact(2024)
+    opened = []
+    open_archive = partitions.open_archive
+    monkeypatch.setattr(
+        partitions,
+        "open_archive",
+        lambda path: opened.append(path.name) or open_archive(path),
+    )
+
+    logs = client.get("/log/4", params={"since": "2024-01-01T00:00:00"}).json()
+    assert [log["value"] for log in logs] == [500, 250]
+    client.get("/habits/heatmap?from=2024-01-01&to=2024-12-31")
+    assert opened == []
+    client.get("/log/4", params={"since": "2023-06-01T00:00:00"})
+    assert opened == ["logs-2023.db"]
+
+
+def test_timezone_aware_windows(client, file_db, example_habits):
+    log_history(client)
+    compact(2024)
+    response = client.get("/log/4", params={"limit": 1})
+    params = {
+        "limit": 1,
+        "cursor": response.headers["x-next-cursor"],
+        "since": "2022-01-01T00:00:00Z",
+        "until": "2024-01-01T00:00:00+02:00",
+    }
+    assert [log["value"] for log in client.get("/log/4", params=params).json()] == [250]
+    analytics = client.get(
+        "/habits/4/analytics", params={"until": "2023-01-01T00:00:00Z"}
+    )
+    assert analytics.status_code == 200
+
+
+def test_deleting_a_habit_deletes_archived_logs(client, file_db, example_habits):
+    log_history(client)
+    compact(2024)
+    assert client.delete("/habits/6").status_code == 200
+    for year in (2022, 2023):
+        db = partitions.open_archive(file_db / "app-archive" / f"logs-{year}.db")
+        with db() as archive:
+            assert [log.habit_id for log in archive.query(d.LogEntry)] == [4, 4]
+
+
+def test_options_of_archived_logs_cant_be_deleted(client, file_db, example_habits):
+    client.post("/log/6", json={"timestamp": "2022-06-01 08:00:00", "option_id": 3})
+    compact(2024)
+
+    assert client.delete("/habits/6/options/3").status_code == 409
+    assert [log["option"]["id"] for log in client.get("/log/6").json()] == [3]
+
+
+def test_only_database_files_compact(client):
+    with app.db() as session, pytest.raises(ValueError):
+        partitions.compact(session, 2024)
@@ -0,0 +1,65 @@
+import pytest
+
+
+def add_habits(client, count):
+    for i in range(count):
+        client.post(
+            "/habits/new",
+            json={
+                "type": "choice",
+                "name": f"Choice {i}",
+                "options": [{"option_text": "Yes"}, {"option_text": "No"}],
+            },
+        )
+        client.post(
+            "/habits/new",
+            json={
+                "type": "measurable",
+                "name": f"Measurable {i}",
+                "target": 10,
+                "completion_target": "day",
+                "unit": "km",
+            },
+        )
+
+
+def add_logs(client, count):
+    for i in range(count):
+        client.post(
+            "/log/6",
+            json={
+                "timestamp": f"2024-01-{i % 28 + 1:02} 08:00:00",
+                "option_id": 1 + i % 3,
+            },
+        )
+
+
+@pytest.mark.parametrize("more", [1, 10])
+def test_list_habits_query_count_is_constant(
+    client, example_habits, count_queries, more
+):
+    with count_queries() as baseline:
+        assert len(client.get("/habits").json()) == 6
+
+    add_habits(client, more)
+    with count_queries() as statements:
+        response = client.get("/habits")
+    assert len(response.json()) == 6 + 2 * more
+    # Version lookup for the ETag, habits, options
+    assert len(statements) == len(baseline) == 3
+
+
+@pytest.mark.parametrize("more", [1, 20])
+def test_get_habit_logs_query_count_is_constant(
+    client, example_habits, count_queries, more
+):
+    add_logs(client, 2)
+    with count_queries() as baseline:
+        assert len(client.get("/log/6").json()) == 2
+
+    add_logs(client, more)
+    with count_queries() as statements:
+        response = client.get("/log/6")
+    assert all(log["option"] is not None for log in response.json())
+    # Version lookup for the ETag, logs with their options
+    assert len(statements) == len(baseline) == 2
@@ -0,0 +1,153 @@
+import random
+
+import pytest
+
+import app
+import db_models as d
+import manage
+
+
+def log_amounts(client, habit_id, entries):
+    ids = []
+    for timestamp, amount in entries:
+        response = client.post(
+            f"/log/{habit_id}", json={"timestamp": timestamp, "amount": amount}
+        )
+        assert response.status_code == 201
+        ids.append(response.json()["id"])
+    return ids
+
+
+def get_rollups(client, habit_id, **params):
+    response = client.get(f"/habits/{habit_id}/rollups", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_rollups_per_timeframe(client, example_habits):
+    log_amounts(
+        client,
+        4,
+        [
+            ("2024-01-01 08:00:00", 500),
+            ("2024-01-01 18:00:00", 1500),
+            ("2024-01-03 08:00:00", 700),
+            ("2024-02-01 08:00:00", 100),
+        ],
+    )
+
+    assert get_rollups(client, 4, timeframe="day") == [
+        {
+            "period_start": "2024-01-01",
+            "count": 2,
+            "total": 2000,
+            "min_value": 500,
+            "max_value": 1500,
+        },
+        {
+            "period_start": "2024-01-03",
+            "count": 1,
+            "total": 700,
+            "min_value": 700,
+            "max_value": 700,
+        },
+        {
+            "period_start": "2024-02-01",
+            "count": 1,
+            "total": 100,
+            "min_value": 100,
+            "max_value": 100,
+        },
+    ]
+    assert [
+        (rollup["period_start"], rollup["total"])
+        for rollup in get_rollups(client, 4, timeframe="week")
+    ] == [("2024-01-01", 2700), ("2024-01-29", 100)]
+    assert [
+        (rollup["period_start"], rollup["total"])
+        for rollup in get_rollups(client, 4, timeframe="month")
+    ] == [("2024-01-01", 2700), ("2024-02-01", 100)]
+
+
+def test_rollups_window(client, example_habits):
+    log_amounts(
+        client,
+        4,
+        [(f"2024-01-{day:02} 08:00:00", day) for day in range(1, 11)],
+    )
+    rollups = get_rollups(client, 4, since="2024-01-03", until="2024-01-06")
+    assert [rollup["period_start"] for rollup in rollups] == [
+        "2024-01-03",
+        "2024-01-04",
+        "2024-01-05",
+    ]
+
+
+def test_removing_extreme_recomputes_min_max(client, example_habits):
+    ids = log_amounts(
+        client,
+        4,
+        [
+            ("2024-01-01 08:00:00", 100),
+            ("2024-01-01 12:00:00", 300),
+            ("2024-01-01 18:00:00", 200),
+        ],
+    )
+    assert client.delete(f"/log/{ids[1]}").status_code == 200
+    assert get_rollups(client, 4) == [
+        {
+            "period_start": "2024-01-01",
+            "count": 2,
+            "total": 300,
+            "min_value": 100,
+            "max_value": 200,
+        },
+    ]
+
+    assert client.delete(f"/log/{ids[0]}").status_code == 200
+    assert client.delete(f"/log/{ids[2]}").status_code == 200
+    assert get_rollups(client, 4) == []
+
+
+def test_rollups_for_nonexistent_habit(client):
+    response = client.get("/habits/999/rollups")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Habit not found"
+
+
+def all_rollups(habit_id):
+    with app.db() as session:
+        return [
+            rollup.to_dict()
+            for timeframe in d.Timeframe
+            for rollup in session.query(d.PeriodRollup)
+            .filter_by(habit_id=habit_id, timeframe=timeframe)
+            .order_by(d.PeriodRollup.period_start)
+        ]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_rollups_match_rebuild(client, example_habits, seed):
+    rng = random.Random(seed)
+    ids = []
+    for _ in range(60):
+        action = rng.random()
+        timestamp = f"2024-{rng.randint(1, 3):02}-{rng.randint(1, 28):02} 08:00:00"
+        if action < 0.6 or not ids:
+            ids += log_amounts(client, 5, [(timestamp, rng.randint(1, 5))])
+        elif action < 0.8:
+            assert (
+                client.delete(f"/log/{ids.pop(rng.randrange(len(ids)))}").status_code
+                == 200
+            )
+        else:
+            response = client.patch(
+                f"/log/{rng.choice(ids)}",
+                json={"timestamp": timestamp, "amount": rng.randint(1, 5)},
+            )
+            assert response.status_code == 200
+
+    incremental = all_rollups(5)
+    with app.db() as session:
+        assert manage.rebuild_rollups(session, 5) == 1
+    assert all_rollups(5) == incremental
@@ -0,0 +1,73 @@
+from datetime import date, datetime
+
+import db_models as d
+import serializers
+
+
+def test_habit_serializers_skip_unlisted_relationships():
+    habit = d.ChoiceHabit(
+        id=1,
+        name="Mood",
+        habit_type=d.HabitType.CHOICE,
+        options=[d.ChoiceOption(id=2, habit_id=1, option_text="Happy")],
+    )
+    assert habit.to_dict() == {
+        "id": 1,
+        "name": "Mood",
+        "habit_type": "choice",
+        "options": [
+            {
+                "id": 2,
+                "habit_id": 1,
+                "option_text": "Happy",
+                "color": None,
+                "icon": None,
+            }
+        ],
+    }
+
+
+def test_log_serializer_formats_timestamps():
+    entry = d.MeasureableLogEntry(
+        id=1,
+        habit_id=4,
+        timestamp=datetime(2024, 1, 2, 3, 4, 5),
+        habit_type=d.HabitType.MEASURABLE,
+        value=10,
+    )
+    assert entry.to_dict() == {
+        "id": 1,
+        "habit_id": 4,
+        "timestamp": "2024-01-02 03:04:05",
+        "client_id": None,
+        "habit_type": "measurable",
+        "value": 10,
+    }
+
+
+def test_choice_log_serializer_nests_option():
+    entry = d.ChoiceLogEntry(
+        id=1,
+        habit_id=6,
+        timestamp=datetime(2024, 1, 1),
+        habit_type=d.HabitType.CHOICE,
+        option_id=2,
+        option=None,
+    )
+    assert entry.to_dict()["option"] is None
+
+
+def test_serializers_are_compiled_once_per_class():
+    rollup = d.PeriodRollup(
+        habit_id=1,
+        timeframe=d.Timeframe.WEEK,
+        period_start=date(2024, 1, 1),
+        count=1,
+        total=2,
+        min_value=2,
+        max_value=2,
+    )
+    assert rollup.to_dict()["period_start"] == "2024-01-01"
+    serializer = serializers._serializers[d.PeriodRollup]
+    rollup.to_dict()
+    assert serializers._serializers[d.PeriodRollup] is serializer
@@ -0,0 +1,180 @@
+import random
+
+import pytest
+
+import app
+import db_models as d
+import stats
+
+
+def log_days(client, habit_id, days, **payload):
+    ids = []
+    for day in days:
+        response = client.post(
+            f"/log/{habit_id}", json={"timestamp": f"{day} 12:00:00", **payload}
+        )
+        assert response.status_code == 201
+        ids.append(response.json()["id"])
+    return ids
+
+
+def get_stats(client, habit_id, at):
+    response = client.get(f"/habits/{habit_id}/stats", params={"at": at})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_daily_streaks(client, example_habits):
+    log_days(
+        client,
+        1,
+        ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-05"],
+        status=True,
+    )
+
+    result = get_stats(client, 1, "2024-01-05 20:00:00")
+    assert result["best_streak"] == 3
+    assert result["current_streak"] == 1
+    assert result["periods_met"] == 4
+    assert result["total_logs"] == 4
+    assert result["current_period"] == {
+        "start": "2024-01-05",
+        "progress": 1,
+        "met": True,
+    }
+
+    # Today isn't over yet, so yesterday's streak still counts
+    assert get_stats(client, 1, "2024-01-06 08:00:00")["current_streak"] == 1
+    assert get_stats(client, 1, "2024-01-07 08:00:00")["current_streak"] == 0
+
+
+def test_unchecked_completion_does_not_count(client, example_habits):
+    log_days(client, 1, ["2024-01-01"], status=False)
+    result = get_stats(client, 1, "2024-01-01 20:00:00")
+    assert result["total_logs"] == 1
+    assert result["periods_met"] == 0
+    assert result["current_period"]["met"] is False
+
+
+def test_multiple_completions_per_day(client, example_habits):
+    log_days(client, 3, ["2024-01-01"], status=True)
+    assert get_stats(client, 3, "2024-01-01 20:00:00")["current_period"] == {
+        "start": "2024-01-01",
+        "progress": 1,
+        "met": False,
+    }
+
+    log_days(client, 3, ["2024-01-01"], status=True)
+    result = get_stats(client, 3, "2024-01-01 20:00:00")
+    assert result["current_period"]["met"] is True
+    assert result["current_streak"] == 1
+
+
+def test_weekly_target(client, example_habits):
+    # 2024-01-01 is a Monday
+    log_days(
+        client,
+        2,
+        ["2024-01-01", "2024-01-03", "2024-01-07", "2024-01-08", "2024-01-10"],
+        status=True,
+    )
+    result = get_stats(client, 2, "2024-01-10 20:00:00")
+    assert result["timeframe"] == "week"
+    assert result["best_streak"] == 1
+    assert result["current_streak"] == 1  # Last week met, this week still in progress
+    assert result["current_period"] == {
+        "start": "2024-01-08",
+        "progress": 2,
+        "met": False,
+    }
+
+
+def test_measurable_target(client, example_habits):
+    log_days(client, 4, ["2024-01-01"], amount=1500)
+    assert get_stats(client, 4, "2024-01-01 20:00:00")["current_period"]["met"] is False
+
+    log_days(client, 4, ["2024-01-01"], amount=600)
+    result = get_stats(client, 4, "2024-01-01 20:00:00")
+    assert result["current_period"] == {
+        "start": "2024-01-01",
+        "progress": 2100,
+        "met": True,
+    }
+
+
+def test_delete_log_breaks_streak(client, example_habits):
+    ids = log_days(client, 1, ["2024-01-01", "2024-01-02", "2024-01-03"], status=True)
+    assert get_stats(client, 1, "2024-01-03 20:00:00")["best_streak"] == 3
+
+    assert client.delete(f"/log/{ids[1]}").status_code == 200
+    result = get_stats(client, 1, "2024-01-03 20:00:00")
+    assert result["best_streak"] == 1
+    assert result["total_logs"] == 2
+
+
+def test_update_log_moves_between_periods(client, example_habits):
+    ids = log_days(client, 1, ["2024-01-01", "2024-01-05"], status=True)
+    assert get_stats(client, 1, "2024-01-05 20:00:00")["best_streak"] == 1
+
+    response = client.patch(f"/log/{ids[1]}", json={"timestamp": "2024-01-02 12:00:00"})
+    assert response.status_code == 200
+    result = get_stats(client, 1, "2024-01-02 20:00:00")
+    assert result["best_streak"] == 2
+    assert result["total_logs"] == 2
+
+
+def test_update_log_status(client, example_habits):
+    ids = log_days(client, 1, ["2024-01-01"], status=True)
+    response = client.patch(f"/log/{ids[0]}", json={"status": False})
+    assert response.status_code == 200
+    assert get_stats(client, 1, "2024-01-01 20:00:00")["periods_met"] == 0
+
+
+def test_changing_target_recomputes_stats(client, example_habits):
+    log_days(client, 3, ["2024-01-01", "2024-01-02"], status=True)
+    assert get_stats(client, 3, "2024-01-02 20:00:00")["best_streak"] == 0
+
+    assert client.patch("/habits/3", json={"completion_target": 1}).status_code == 200
+    assert get_stats(client, 3, "2024-01-02 20:00:00")["best_streak"] == 2
+
+
+def test_choice_habit_counts_logged_days(client, example_habits):
+    log_days(client, 6, ["2024-01-01", "2024-01-02"], option_id=1)
+    result = get_stats(client, 6, "2024-01-02 20:00:00")
+    assert result["current_streak"] == 2
+
+
+def test_stats_for_nonexistent_habit(client):
+    response = client.get("/habits/999/stats")
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Habit not found"
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_stats_match_rebuild(client, example_habits, seed):
+    rng = random.Random(seed)
+    ids = []
+    for _ in range(40):
+        action = rng.random()
+        if action < 0.6 or not ids:
+            day = rng.randint(1, 20)
+            ids += log_days(client, 3, [f"2024-01-{day:02}"], status=rng.random() < 0.8)
+        elif action < 0.8:
+            assert (
+                client.delete(f"/log/{ids.pop(rng.randrange(len(ids)))}").status_code
+                == 200
+            )
+        else:
+            day = rng.randint(1, 20)
+            response = client.patch(
+                f"/log/{rng.choice(ids)}",
+                json={"timestamp": f"2024-01-{day:02} 09:00:00"},
+            )
+            assert response.status_code == 200
+
+    incremental = get_stats(client, 3, "2024-01-20 20:00:00")
+    with app.db() as session:
+        habit = session.get_one(d.Habit, 3)
+        stats.rebuild(session, habit)
+        session.commit()
+    assert get_stats(client, 3, "2024-01-20 20:00:00") == incremental
@@ -0,0 +1,101 @@
+import io
+import json
+import logging
+
+import pytest
+
+import app
+import structured_logging
+from structured_logging import LogSettings
+
+
+@pytest.fixture
+def capture():
+    """
+    Start logging to a buffer, the returned function stops the listener and parses the records.
+    """
+    engine = app.db.kw["bind"]
+    stream = io.StringIO()
+    listeners = []
+
+    def start(settings: LogSettings):
+        listeners.append(structured_logging.configure(settings, stream))
+        structured_logging.install_sql_logging(engine, settings)
+
+    def records() -> list[dict]:
+        listeners[0].stop()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield start, records
+    structured_logging.logger.handlers = []
+
+
+def test_settings_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("HABITS_LOG_LEVEL", "debug")
+    monkeypatch.setenv("HABITS_SQL_SLOW_MS", "250")
+    monkeypatch.setenv("HABITS_SQL_SAMPLE_RATE", "0.01")
+    assert LogSettings.from_env() == LogSettings("DEBUG", 250, 0.01)
+
+    monkeypatch.setenv("HABITS_SQL_SAMPLE_RATE", "2")
+    with pytest.raises(ValueError):
+        LogSettings.from_env()
+
+
+def test_records_are_json_with_extras():
+    record = logging.LogRecord(
+        "habits", logging.WARNING, "", 0, "Hi %s", ("you",), None
+    )
+    record.duration_ms = 12.5
+    data = json.loads(structured_logging.JsonFormatter().format(record))
+    assert data["level"] == "WARNING"
+    assert data["message"] == "Hi you"
+    assert data["duration_ms"] == 12.5
+
+
+def test_fast_statements_are_not_logged(client, example_habits, capture):
+    start, records = capture
+    start(LogSettings())
+    client.get("/log/1")
+    assert records() == []
+
+
+def test_slow_statements_are_logged_with_request_id(client, example_habits, capture):
+    start, records = capture
+    start(LogSettings(sql_slow_ms=0))
+    response = client.get("/log/1", headers={"X-Request-ID": "abc-123"})
+    assert response.headers["x-request-id"] == "abc-123"
+
+    logged = records()
+    assert logged
+    assert {record["message"] for record in logged} == {"Slow query"}
+    assert {record["request_id"] for record in logged} == {"abc-123"}
+    assert all(record["statement"].startswith("SELECT") for record in logged)
+    assert "parameters" not in logged[0]
+
+
+def test_sampling(client, example_habits, capture):
+    start, records = capture
+    start(LogSettings(sql_sample_rate=1.0))
+    client.get("/log/1")
+    logged = records()
+    assert logged
+    assert {record["message"] for record in logged} == {"Sampled query"}
+    assert {record["level"] for record in logged} == {"INFO"}
+
+
+def test_debug_logs_every_statement(client, example_habits, capture, count_queries):
+    start, records = capture
+    start(LogSettings(level="DEBUG"))
+    with count_queries() as statements:
+        client.get("/log/1")
+    assert [record["statement"] for record in records()] == statements
+
+
+def test_request_ids_are_generated(client):
+    first = client.get("/habits").headers["x-request-id"]
+    second = client.get("/habits").headers["x-request-id"]
+    assert len(first) == 32
+    assert first != second
+    # Ids that could break a log line are replaced
+    response = client.get("/habits", headers={"X-Request-ID": 'a b"c'})
+    assert response.headers["x-request-id"] != 'a b"c'
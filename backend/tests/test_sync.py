@@ -0,0 +1,92 @@
+def log(client, habit_id, timestamp, **fields):
+    response = client.post(f"/log/{habit_id}", json={"timestamp": timestamp, **fields})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def test_first_sync_returns_everything(client, example_habits):
+    log(client, 1, "2024-01-01 08:00:00", status=True)
+    log(client, 6, "2024-01-01 08:00:00", option_id=2)
+
+    response = client.get("/sync")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["full"] is True
+    assert len(body["habits"]) == 6
+    assert len(body["habits"][5]["options"]) == 3
+    assert [entry["habit_id"] for entry in body["logs"]] == [1, 6]
+    assert body["seq"] > 0
+
+
+def test_delta_only_has_changes_since_seq(client, example_habits):
+    log(client, 1, "2024-01-01 08:00:00", status=True)
+    seq = client.get("/sync").json()["seq"]
+
+    new_log = log(client, 4, "2024-01-01 08:00:00", amount=250)
+    client.patch("/habits/2", json={"name": "Running"})
+    client.patch("/habits/6/options/1", json={"color": "orange"})
+
+    body = client.get("/sync", params={"since": seq}).json()
+    assert body["full"] is False
+    assert [habit["name"] for habit in body["habits"]] == ["Running", "Mood"]
+    assert [entry["id"] for entry in body["logs"]] == [new_log]
+    assert body["deleted"] == {"habits": [], "logs": []}
+
+    assert client.get("/sync", params={"since": body["seq"]}).json() == {
+        "seq": body["seq"],
+        "full": False,
+        "habits": [],
+        "logs": [],
+        "deleted": {"habits": [], "logs": []},
+    }
+
+
+def test_deletions_are_tombstones(client, example_habits):
+    kept = log(client, 1, "2024-01-01 08:00:00", status=True)
+    removed = log(client, 1, "2024-01-02 08:00:00", status=True)
+    log(client, 3, "2024-01-01 08:00:00", status=True)
+    seq = client.get("/sync").json()["seq"]
+
+    client.delete(f"/log/{removed}")
+    client.delete("/habits/3")
+
+    body = client.get("/sync", params={"since": seq}).json()
+    assert body["deleted"] == {"habits": [3], "logs": [removed]}
+    assert body["habits"] == []
+    assert body["logs"] == []
+    assert kept not in body["deleted"]["logs"]
+
+
+def test_push_applies_queued_writes(client, example_habits):
+    edited = log(client, 4, "2024-01-01 08:00:00", amount=100)
+    seq = client.get("/sync").json()["seq"]
+
+    response = client.post(
+        "/sync",
+        json={
+            "deleted": [edited, 9999],
+            "created": [
+                {"habit_id": 4, "timestamp": "2024-01-01 08:00:00", "amount": 300},
+                {"habit_id": 1, "timestamp": "2024-01-02 08:00:00", "status": True},
+                {"habit_id": 42, "timestamp": "2024-01-02 08:00:00", "status": True},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["inserted"] == 2
+    assert body["deleted"] == 1  # Missing ids are skipped
+    assert body["errors"] == [{"row": 2, "detail": "Habit not found"}]
+
+    delta = client.get("/sync", params={"since": seq}).json()
+    assert delta["seq"] == body["seq"]
+    assert sorted(entry["habit_id"] for entry in delta["logs"]) == [1, 4]
+    # SQLite may hand the deleted id to a new log, which then replaces the tombstone
+    live_ids = {entry["id"] for entry in delta["logs"]}
+    assert delta["deleted"]["logs"] == ([] if edited in live_ids else [edited])
+    assert (
+        client.get("/habits/4/stats", params={"at": "2024-01-01T12:00:00"}).json()[
+            "current_period"
+        ]["progress"]
+        == 300
+    )
@@ -0,0 +1,179 @@
+import json
+
+import pytest
+
+import app
+import auth
+import db_models as d
+import tenants
+from database import DatabaseSettings
+
+
+def create_user(name: str) -> dict:
+    with app.db() as session:
+        user = auth.create_user(session, name)
+        token = auth.create_token(session, user.id)
+        session.commit()
+        return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def alice(client):
+    headers = create_user("alice")
+    response = client.post(
+        "/habits/new",
+        json={
+            "type": "completion",
+            "name": "Medicine",
+            "completion_target": 1,
+            "target_timeframe": "day",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 201
+    return headers, response.json()["id"]
+
+
+@pytest.fixture
+def bob(client):
+    return create_user("bob")
+
+
+def test_users_only_see_their_habits(client, alice, bob):
+    alice_headers, habit_id = alice
+    assert [h["name"] for h in client.get("/habits", headers=alice_headers).json()] == [
+        "Medicine"
+    ]
+    assert client.get("/habits", headers=bob).json() == []
+    assert client.get(f"/habits/{habit_id}", headers=bob).status_code == 404
+    for url in (f"/habits/{habit_id}", f"/log/{habit_id}"):
+        response = client.get(url, headers=bob | {"If-None-Match": "*"})
+        assert response.status_code == 404
+    assert (
+        client.patch(
+            f"/habits/{habit_id}", json={"name": "Mine"}, headers=bob
+        ).status_code
+        == 404
+    )
+    assert client.delete(f"/habits/{habit_id}", headers=bob).status_code == 404
+    # Requests without a token are the default user's
+    assert client.get("/habits").json() == []
+
+
+def test_users_only_see_their_logs(client, alice, bob):
+    alice_headers, habit_id = alice
+    log = {"timestamp": "2024-01-01 08:00:00", "status": True}
+    response = client.post(f"/log/{habit_id}", json=log, headers=alice_headers)
+    log_id = response.json()["id"]
+
+    assert client.post(f"/log/{habit_id}", json=log, headers=bob).status_code == 404
+    assert client.get(f"/log/{habit_id}", headers=bob).status_code == 404
+    assert client.delete(f"/log/{log_id}", headers=bob).status_code == 404
+    bulk = client.post("/log/bulk", json=[log | {"habit_id": habit_id}], headers=bob)
+    assert bulk.json()["errors"] == [{"row": 0, "detail": "Habit not found"}]
+
+    assert client.get("/sync", headers=bob).json()["logs"] == []
+    assert [
+        log["id"] for log in client.get("/sync", headers=alice_headers).json()["logs"]
+    ] == [log_id]
+    assert client.get("/export", headers=bob).text == ""
+    heatmap = client.get(
+        "/habits/heatmap?from=2024-01-01&to=2024-01-01", headers=bob
+    ).json()
+    assert heatmap["habits"] == []
+
+
+def test_logs_cant_use_other_users_options(client, alice, bob):
+    alice_headers, _ = alice
+    choice = {
+        "type": "choice",
+        "name": "Mood",
+        "options": [{"option_text": "Good", "color": "green", "icon": "smile"}],
+    }
+    habits = []
+    for headers in (alice_headers, bob):
+        habit_id = client.post("/habits/new", json=choice, headers=headers).json()["id"]
+        options = client.get(f"/habits/{habit_id}/options", headers=headers).json()
+        habits.append((habit_id, options[0]["id"]))
+    (habit_id, alices_option), (_, bobs_option) = habits
+    log = {"timestamp": "2024-01-01 08:00:00", "option_id": alices_option}
+    response = client.post(f"/log/{habit_id}", json=log, headers=alice_headers)
+    log_id = response.json()["id"]
+
+    response = client.patch(
+        f"/log/{log_id}", json={"option_id": bobs_option}, headers=alice_headers
+    )
+    assert response.status_code == 400
+    logs = client.get(f"/log/{habit_id}", headers=alice_headers).json()
+    assert [log["option"]["id"] for log in logs] == [alices_option]
+
+
+def test_me(client, alice):
+    alice_headers, _ = alice
+    assert client.get("/me", headers=alice_headers).json()["name"] == "alice"
+    assert client.get("/me").json() == {"id": d.DEFAULT_USER_ID, "name": "default"}
+
+
+@pytest.mark.parametrize("authorization", ["Bearer nope", "Basic abc", "Bearer "])
+def test_invalid_token(client, authorization):
+    response = client.get("/habits", headers={"Authorization": authorization})
+    assert response.status_code == 401
+    assert response.headers["www-authenticate"] == "Bearer"
+
+
+def test_token_required(client, alice, monkeypatch):
+    monkeypatch.setattr(app, "auth_required", True)
+    assert client.get("/habits").status_code == 401
+    assert client.get("/habits", headers=alice[0]).status_code == 200
+
+
+def test_tokens_are_stored_hashed(client, bob):
+    token = bob["Authorization"].removeprefix("Bearer ")
+    with app.db() as session:
+        stored = session.get(d.AuthToken, auth.hash_token(token))
+        assert stored is not None
+        assert token not in stored.token_hash
+
+
+def test_tenant_databases(client, tmp_path, monkeypatch):
+    engines = tenants.EngineCache(
+        f"sqlite:///{tmp_path}/{{user_id}}.db",
+        DatabaseSettings(),
+        max_engines=1,
+    )
+    monkeypatch.setattr(app, "tenant_dbs", engines)
+    users = [create_user("alice"), create_user("bob")]
+    habit = {
+        "type": "measurable",
+        "name": "Water",
+        "target": 2000,
+        "completion_target": "day",
+        "unit": "ml",
+    }
+    for headers in users:
+        response = client.post("/habits/new", json=habit, headers=headers)
+        # Every tenant starts from scratch
+        assert response.json()["id"] == 1
+        client.post(
+            "/log/1",
+            json={"timestamp": "2024-01-01 08:00:00", "amount": 250},
+            headers=headers,
+        )
+
+    assert sorted(path.name for path in tmp_path.iterdir() if path.suffix == ".db") == [
+        "2.db",
+        "3.db",
+    ]
+    # Only the most recently used engine is kept open
+    assert list(engines.engines) == [3]
+    for headers in users:
+        logs = client.get("/log/1", headers=headers).json()
+        assert [log["value"] for log in logs] == [250]
+    # Nothing went to the main database
+    assert client.get("/habits").json() == []
+    records = [
+        json.loads(line)
+        for line in client.get("/export", headers=users[0]).text.splitlines()
+    ]
+    assert [record["kind"] for record in records] == ["habit", "log"]
+    engines.dispose()
@@ -0,0 +1,83 @@
+def etag(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def test_unchanged_poll_is_not_modified(client, example_habits, count_queries):
+    for url in ("/habits", "/habits/6", "/habits/6/options", "/log/6"):
+        tag = etag(client, url)
+        with count_queries() as statements:
+            response = client.get(url, headers={"If-None-Match": tag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == tag
+        assert response.content == b""
+        assert len(statements) == 1  # Just the version lookup
+
+
+def test_weak_and_listed_tags_match(client, example_habits):
+    tag = etag(client, "/habits")
+    for header in (f"W/{tag}", f'"other", {tag}', "*"):
+        assert (
+            client.get("/habits", headers={"If-None-Match": header}).status_code == 304
+        )
+    assert (
+        client.get("/habits", headers={"If-None-Match": '"other"'}).status_code == 200
+    )
+
+
+def test_any_tag_needs_an_existing_habit(client, example_habits):
+    for url in ("/habits/99", "/habits/99/options", "/log/99"):
+        assert client.get(url, headers={"If-None-Match": "*"}).status_code == 404
+
+
+def test_log_write_only_changes_its_habit(client, example_habits):
+    before = {url: etag(client, url) for url in ("/habits", "/habits/1", "/habits/2")}
+    logs_before = etag(client, "/log/1")
+
+    response = client.post(
+        "/log/1", json={"timestamp": "2024-01-01 08:00:00", "status": True}
+    )
+    assert response.status_code == 201
+
+    assert etag(client, "/habits") != before["/habits"]
+    assert etag(client, "/habits/1") != before["/habits/1"]
+    assert etag(client, "/habits/2") == before["/habits/2"]
+    assert etag(client, "/log/1") != logs_before
+
+
+def test_every_write_bumps_the_habit(client, example_habits):
+    writes = [
+        ("patch", "/habits/6", {"name": "Feeling"}),
+        ("post", "/habits/6/options", {"option_text": "Tired"}),
+        ("patch", "/habits/6/options/1", {"color": "orange"}),
+        ("delete", "/habits/6/options/4", None),
+        ("post", "/log/6", {"timestamp": "2024-01-01 08:00:00", "option_id": 1}),
+        ("patch", "/log/1", {"option_id": 2}),
+        ("delete", "/log/1", None),
+    ]
+    seen = {etag(client, "/habits/6")}
+    for method, url, body in writes:
+        response = client.request(method, url, json=body)
+        assert response.status_code < 300, (url, response.json())
+        tag = etag(client, "/habits/6")
+        assert tag not in seen, url
+        seen.add(tag)
+
+
+def test_bulk_import_bumps_touched_habits(client, example_habits):
+    before = {url: etag(client, url) for url in ("/habits/1", "/habits/2")}
+    client.post(
+        "/log/bulk",
+        json=[{"habit_id": 1, "timestamp": "2024-01-01 08:00:00", "status": True}],
+    )
+    assert etag(client, "/habits/1") != before["/habits/1"]
+    assert etag(client, "/habits/2") == before["/habits/2"]
+
+
+def test_deleted_habit_does_not_serve_stale_etag(client, example_habits):
+    tag = etag(client, "/habits/1")
+    assert client.delete("/habits/1").status_code == 200
+
+    response = client.get("/habits/1", headers={"If-None-Match": tag})
+    assert response.status_code == 404
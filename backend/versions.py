@@ -0,0 +1,74 @@
+"""
+Version counters for conditional GETs.
+
+Every write bumps a global counter and stamps the habits it touched with the new value, so
+versions only ever grow (even when SQLite reuses the id of a deleted habit). Reads answer
+`If-None-Match` by comparing the client's `ETag` with a single primary key lookup, once the
+habit cache says the habit exists, so a 304 never tells apart missing and other users' habits.
+"""
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import db_models as d
+import dialects
+import ownership
+
+# Row of `habit_versions` holding the global counter, habit ids start at 1
+GLOBAL = 0
+
+
+def bump(session: Session, *habit_ids: int) -> int:
+    """
+    Record a write touching `habit_ids`, in the caller's transaction.
+    """
+    versions = d.HabitVersion.__table__
+    counter = dialects.insert(session, versions).values(habit_id=GLOBAL, version=1)
+    version = session.scalar(
+        counter.on_conflict_do_update(
+            index_elements=[versions.c.habit_id],
+            set_={"version": versions.c.version + 1},
+        ).returning(versions.c.version)
+    )
+
+    if habit_ids:
+        stamp = dialects.insert(session, versions)
+        session.execute(
+            stamp.on_conflict_do_update(
+                index_elements=[versions.c.habit_id],
+                set_={"version": stamp.excluded.version},
+            ),
+            [{"habit_id": habit_id, "version": version} for habit_id in habit_ids],
+        )
+    return version
+
+
+def current(session: Session, habit_id: int = GLOBAL) -> int:
+    version = session.scalar(
+        select(d.HabitVersion.version).where(d.HabitVersion.habit_id == habit_id)
+    )
+    return version or 0
+
+
+def etag(session: Session, resource: str, habit_id: int = GLOBAL) -> str:
+    # With the user, tenant databases count versions (and habit ids) on their own
+    user_id = ownership.user_id(session)
+    return f'"{resource}-{user_id}-{habit_id}-{current(session, habit_id)}"'
+
+
+def matches(request: Request, etag: str) -> bool:
+    """
+    Whether the request's `If-None-Match` matches `etag`, `*` matching any. Only call it for
+    resources known to exist.
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    # Weak comparison, as If-None-Match calls for
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
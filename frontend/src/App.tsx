@@ -1,13 +1,47 @@
 import { useState, useEffect } from 'react'
 
+const API = 'http://localhost:8000'
+
 function App() {
   const [habits, setHabits] = useState([])
 
   useEffect(() => {
-    fetch('http://localhost:8000/habits')
-      .then(response => response.json())
-      .then(data => setHabits(data))
-      .catch(error => console.error('Error fetching habits:', error))
+    const loadHabits = () =>
+      fetch(`${API}/habits`)
+        .then(response => response.json())
+        .then(data => setHabits(data))
+        .catch(error => console.error('Error fetching habits:', error))
+
+    // Only the habit an event is about gets re-fetched, instead of the whole list
+    const refreshHabit = (id, deleted) => {
+      if (deleted) {
+        setHabits(habits => habits.filter(habit => habit.id !== id))
+        return
+      }
+      fetch(`${API}/habits/${id}`)
+        .then(response => response.json())
+        .then(updated =>
+          setHabits(habits =>
+            habits.some(habit => habit.id === id)
+              ? habits.map(habit => (habit.id === id ? updated : habit))
+              : [...habits, updated]
+          )
+        )
+        .catch(error => console.error('Error fetching habit:', error))
+    }
+
+    loadHabits()
+    const events = new EventSource(`${API}/events`)
+    events.addEventListener('habit', event => {
+      const change = JSON.parse(event.data)
+      refreshHabit(change.habit_id, change.action === 'deleted')
+    })
+    events.addEventListener('option', event => {
+      refreshHabit(JSON.parse(event.data).habit_id, false)
+    })
+    // Events were missed, start over (EventSource reconnects by itself once the stream ends)
+    events.addEventListener('reset', loadHabits)
+    return () => events.close()
   }, [])
 
   return (